@@ -1,10 +1,14 @@
 import os
-# import fitz # Moved to extract_text_per_page
+# import fitz # Moved to parse_pdf
 import re
 import json
 import csv
 import time
 import datetime
+import hashlib
+import itertools
+import numbers
+from array import array
 # import nltk # Moved to usage
 # from sentence_transformers import SentenceTransformer # Moved to get_model
 # import chromadb # Moved to get_chroma_collection
@@ -12,9 +16,9 @@ import datetime
 # from sklearn.metrics.pairwise import cosine_similarity # Moved to usage
 # import numpy as np # Moved where needed or kept if light (numpy is medium, generally okay if simple, but let's be safe for Free Tier)
 # import textwrap
-# import pdfplumber
 # from sklearn.feature_extraction.text import TfidfVectorizer # Moved to usage
 from collections import defaultdict
+from collections.abc import Mapping
 from typing import List, Dict, Any
 # from groq import Groq # Moved to query_gemini
 # Constants
@@ -23,14 +27,33 @@ from typing import List, Dict, Any
 _model = None
 _nlp = None
 
+# Model used by a fresh index; changing it (or the chunker settings) takes effect through
+# `manage.py rebuild_index`, see the index generations below
+EMBED_MODEL_NAME = os.environ.get("RAG_EMBED_MODEL", 'all-MiniLM-L6-v2')
+_tokenizer = None
+
 def get_model():
     global _model
+    if _model is None:
+        # The active index generation decides which model its vectors come from
+        get_index_generation()
     if _model is None:
         print("[INFO] Loading SentenceTransformer model...")
         from sentence_transformers import SentenceTransformer
-        _model = SentenceTransformer('all-MiniLM-L6-v2')
+        _model = SentenceTransformer(EMBED_MODEL_NAME)
     return _model
 
+def get_tokenizer():
+    """
+    The active generation's embedding model tokenizer and max sequence length (word-piece
+    tokens it reads per input; anything longer is silently truncated), from the loaded model.
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        model = get_model()
+        _tokenizer = (model.tokenizer, model.max_seq_length)
+    return _tokenizer
+
 def get_nlp():
     global _nlp
     if _nlp is None:
@@ -42,52 +65,939 @@ def get_nlp():
 pdf_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploaded_pdfs")
 log_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), "time_report_ingestion.csv")
 cache_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "embeddings_cache")
+stats_dir = os.path.join(cache_dir, "pdf_stats")
+contents_dir = os.path.join(cache_dir, "contents")
+# Uploaded PDFs by content hash (immutable; the visible copy in pdf_dir is a hard link)
+content_files_dir = os.path.join(pdf_dir, ".content")
 
 # Lazy ChromaDB
+chroma_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "chroma_db")
+_chroma_client = None
 _collection = None
 
+def get_chroma_client():
+    global _chroma_client
+    if _chroma_client is None:
+        import chromadb
+        _chroma_client = chromadb.PersistentClient(path=chroma_dir)
+    return _chroma_client
+
 def get_chroma_collection():
+    """The collection of the index generation this process serves (see get_index_generation)."""
     global _collection
+    generation = get_index_generation()
     if _collection is None:
         print("[INFO] Loading ChromaDB...")
-        import chromadb
-        project_root = os.path.dirname(os.path.dirname(__file__))
-        chroma_client = chromadb.PersistentClient(path=os.path.join(project_root, "chroma_db"))
-        collection_name = "rag_documents"
+        chroma_client = get_chroma_client()
+        collection_name = generation["collection"]
         try:
             _collection = chroma_client.get_collection(collection_name)
             print(f"[CHROMADB] Using existing collection: {collection_name}")
         except:
-            _collection = chroma_client.create_collection(collection_name)
+            _collection = chroma_client.create_collection(collection_name, metadata=index_settings_of(generation))
             print(f"[CHROMADB] Created new collection: {collection_name}")
     return _collection
 
+# Number of chunks sent to ChromaDB per upsert() call during ingestion
+UPSERT_BATCH_SIZE = int(os.environ.get("RAG_UPSERT_BATCH_SIZE", "256"))
+# Chunks per SentenceTransformer forward pass, and how many chunks are pooled across pages before encoding
+EMBED_BATCH_SIZE = int(os.environ.get("RAG_EMBED_BATCH_SIZE", "64"))
+EMBED_WINDOW = int(os.environ.get("RAG_EMBED_WINDOW", "512"))
+# Pages of unchanged chunks fetched from ChromaDB per get() when re-ingesting a document
+REUSE_BATCH_PAGES = 64
+# Ingestion commits (and reports) the first N pages early so they become queryable,
+# then commits every M pages after that
+PROGRESSIVE_FIRST_PAGES = int(os.environ.get("RAG_PROGRESSIVE_FIRST_PAGES", "20"))
+PROGRESSIVE_COMMIT_PAGES = int(os.environ.get("RAG_PROGRESSIVE_COMMIT_PAGES", "50"))
+# Pages parsed and chunked ahead of the embedder during ingestion
+PIPELINE_QUEUE_SIZE = int(os.environ.get("RAG_PIPELINE_QUEUE_SIZE", "16"))
+
+
+def prefetch(iterable, maxsize=None):
+    """
+    Run a generator pipeline stage in a background thread and hand its items over
+    through a bounded queue, so parsing and chunking work ahead while the consumer
+    (the embedder) is busy without ever holding more than maxsize items. Exceptions
+    in the stage are re-raised in the consumer; if the consumer stops early, the
+    stage is closed.
+    """
+    import queue
+    import threading
+
+    items = queue.Queue(maxsize or PIPELINE_QUEUE_SIZE)
+    stopped = threading.Event()
+    end = object()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    break
+            else:
+                put(end)
+        except BaseException as e:
+            put((end, e))
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+
+    thread = threading.Thread(target=produce, name="ingest-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is end:
+                break
+            if isinstance(item, tuple) and len(item) == 2 and item[0] is end:
+                raise item[1]
+            yield item
+    finally:
+        stopped.set()
+        thread.join()
+
+
+class ChromaBatchWriter:
+    """
+    Buffers chunks, embeddings and metadata during ingestion and writes them to
+    ChromaDB with batched upsert() calls. Upserting (instead of add) makes
+    re-ingesting a document replace its vectors rather than fail on duplicate ids.
+    """
+
+    def __init__(self, batch_size=None, collection=None):
+        self.batch_size = max(1, batch_size or UPSERT_BATCH_SIZE)
+        self.collection = collection
+        self.ids = []
+        self.documents = []
+        self.embeddings = []
+        self.metadatas = []
+        self.written = 0
+        self.flushes = 0
+        self.store_time = 0.0
+
+    def add(self, doc_id, chunk, embedding, metadata):
+        self.ids.append(doc_id)
+        self.documents.append(chunk)
+        self.embeddings.append(embedding.tolist() if hasattr(embedding, 'tolist') else list(embedding))
+        self.metadatas.append(metadata)
+        if len(self.ids) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.ids:
+            return
+        start = time.perf_counter()
+        collection = self.collection or get_chroma_collection()
+        collection.upsert(
+            ids=self.ids,
+            documents=self.documents,
+            embeddings=self.embeddings,
+            metadatas=self.metadatas
+        )
+        lexical_index = get_lexical_index()
+        if lexical_index is not None:
+            lexical_index.upsert(self.ids, self.documents, self.metadatas)
+        self.store_time += time.perf_counter() - start
+        self.written += len(self.ids)
+        self.flushes += 1
+        self.ids, self.documents, self.embeddings, self.metadatas = [], [], [], []
+
+    def update_metadatas(self, updates):
+        """Merge {doc_id: {key: value}} into already-written chunks' metadata (None deletes a key)."""
+        if not updates:
+            return
+        self.flush()
+        start = time.perf_counter()
+        collection = self.collection or get_chroma_collection()
+        ids = list(updates)
+        collection.update(ids=ids, metadatas=[updates[doc_id] for doc_id in ids])
+        self.store_time += time.perf_counter() - start
+
+    def prune(self, selector, keep_ids):
+        """
+        Delete a document's stored chunks that are not in keep_ids: pages removed or
+        re-chunked since a previous ingestion, or ids from an older id scheme.
+        """
+        start = time.perf_counter()
+        try:
+            collection = self.collection or get_chroma_collection()
+            existing = collection.get(where=selector, include=[])
+            stale = [doc_id for doc_id in existing.get('ids', []) if doc_id not in keep_ids]
+            if stale:
+                collection.delete(ids=stale)
+                if get_lexical_index() is not None:
+                    get_lexical_index().delete(ids=stale)
+                print(f"[STORE] Pruned {len(stale)} stale chunks")
+        except Exception as e:
+            print(f"[STORE] Could not prune stale chunks for {selector}: {e}")
+        self.store_time += time.perf_counter() - start
+
+    def close(self):
+        self.flush()
+
+
+def _chunk_doc_id(filename, page_no, page_chunk_index, conversation_id=None, content_hash=None):
+    """
+    Stable vector id for a chunk, keyed by page so re-ingesting a revised document only
+    touches the pages that changed. Content-addressed chunks are keyed by the file's hash
+    and shared by every upload of the same bytes; otherwise ids are scoped by conversation
+    so uploads in different chats don't overwrite each other.
+    """
+    suffix = f"p{page_no}_{page_chunk_index}"
+    if content_hash:
+        return f"{content_hash}_{suffix}"
+    if conversation_id:
+        return f"{conversation_id}_{filename}_{suffix}"
+    return f"{filename}_{suffix}"
+
+
+def _document_selector(filename, scope, content_hash=None):
+    """ChromaDB where clause matching every stored chunk of one document."""
+    if content_hash:
+        return {"content_hash": content_hash}
+    return {"$and": [{"source_pdf": filename}, {"conversation_id": scope}]}
+
+
+def _and_where(selector, clause):
+    clauses = list(selector["$and"]) if "$and" in selector else [selector]
+    return {"$and": clauses + [clause]}
+
+def _top_k_rows(scores, top_k, threshold=None):
+    """
+    Positions of the top_k scores that are at least threshold, best first, found with
+    argpartition rather than a full sort. Ties (also at the cut) go to the lower position,
+    as with a stable sort.
+    """
+    import numpy as np
+    if top_k <= 0 or not len(scores):
+        return np.empty(0, dtype=np.intp)
+    candidates = np.arange(len(scores)) if threshold is None else np.flatnonzero(scores >= threshold)
+    if len(candidates) > top_k:
+        best = np.argpartition(-scores[candidates], top_k - 1)[:top_k]
+        kth = scores[candidates[best]].min()
+        candidates = candidates[scores[candidates] >= kth]  # Everything tied with the k-th, for a stable cut
+    order = np.lexsort((candidates, -scores[candidates]))[:top_k]
+    return candidates[order]
+
+
+def _normalise_rows(vectors):
+    """(float32 rows scaled to unit length, their original norms); zero vectors stay zero, as in cosine_similarity."""
+    import numpy as np
+    vectors = np.array(vectors, dtype=np.float32, ndmin=2)
+    norms = np.linalg.norm(vectors, axis=1)
+    np.divide(vectors, norms[:, None], out=vectors, where=norms[:, None] > 0)
+    return vectors, norms
+
+
+class VectorIndex:
+    """
+    Embeddings held as one contiguous float32 matrix of L2-normalised rows with a parallel
+    list of keys, so a query is scored against every row (or a subset of keys) with a single
+    matrix-vector product and the top k are picked with argpartition instead of a full sort.
+    Rows keep insertion order and ties are broken by it, so results match sorting the
+    cosine similarities of the same embeddings one pair at a time. Used for embeddings that
+    are not in the in-memory ChunkStore (which keeps its own matrix) and by retrieval_benchmark.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.positions = {}
+        self._matrix = None  # Grown by doubling; the first len(self.keys) rows are in use
+
+    def __len__(self):
+        return len(self.keys)
+
+    @property
+    def matrix(self):
+        import numpy as np
+        if self._matrix is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._matrix[:len(self.keys)]
+
+    def add(self, key, vector):
+        self.add_many([key], [vector])
+
+    def add_many(self, keys, vectors):
+        import numpy as np
+        keys = list(keys)
+        if not keys:
+            return
+        rows, _ = _normalise_rows(vectors)
+        if rows.shape[0] != len(keys):
+            raise ValueError(f"{len(keys)} keys for {rows.shape[0]} vectors")
+        if self._matrix is not None and rows.shape[1] != self._matrix.shape[1]:
+            raise ValueError(f"Vectors of dimension {rows.shape[1]} added to an index of dimension {self._matrix.shape[1]}")
+        size = len(self.keys)
+        needed = size + len(keys)
+        if self._matrix is None or needed > self._matrix.shape[0]:
+            grown = np.empty((max(1024, needed, 2 * size), rows.shape[1]), dtype=np.float32)
+            if self._matrix is not None:
+                grown[:size] = self._matrix[:size]
+            self._matrix = grown
+        for key, row in zip(keys, rows):
+            position = self.positions.get(key)
+            if position is None:
+                position = self.positions[key] = len(self.keys)
+                self.keys.append(key)
+            self._matrix[position] = row
+
+    def remove(self, keys):
+        """Drop rows by key, compacting the matrix in place (order of the rest is kept)."""
+        import numpy as np
+        dropped = [self.positions[key] for key in keys if key in self.positions]
+        if not dropped:
+            return
+        size = len(self.keys)
+        keep = np.ones(size, dtype=bool)
+        keep[dropped] = False
+        kept = int(keep.sum())
+        self._matrix[:kept] = self._matrix[:size][keep]
+        self.keys = [key for key, kept_row in zip(self.keys, keep) if kept_row]
+        self.positions = {key: position for position, key in enumerate(self.keys)}
+
+    def clear(self):
+        self.keys = []
+        self.positions = {}
+        self._matrix = None
+
+    @classmethod
+    def from_embeddings(cls, embeddings):
+        """Index of a {key: vector} dict, in its iteration order."""
+        index = cls()
+        index.add_many(embeddings.keys(), list(embeddings.values()))
+        return index
+
+    def search(self, query_vector, top_k, threshold=None, keys=None):
+        """
+        [(key, cosine similarity)] of the top_k rows scoring at least threshold, best first;
+        with keys, only those rows are scored (and ties are broken by their order in keys).
+        """
+        import numpy as np
+        if not self.keys:
+            return []
+        query = _normalise_rows(query_vector)[0][0]
+        if keys is None:
+            keys = self.keys
+            scores = self.matrix @ query
+        else:
+            keys = list(keys)
+            rows = np.fromiter((self.positions[key] for key in keys), dtype=np.intp, count=len(keys))
+            scores = self._matrix[rows] @ query
+        return [(keys[i], float(scores[i])) for i in _top_k_rows(scores, top_k, threshold)]
+
+
+def _document_name_key(filename):
+    """Name a pdf_context is matched on: "report" selects "report.pdf" and vice versa."""
+    return (filename or "").replace('.pdf', '')
+
+
+# Metadata fields the ChunkStore keeps in columns; anything else is kept per chunk as-is
+_STORE_COLUMNS = ("id", "type", "source_pdf", "conversation_id", "content_hash", "page_no", "chunk_index",
+                  "page_chunk_index", "page_hash", "duplicate_pages")
+
+
+class ChunkStore:
+    """
+    The in-memory chunks of the web process, stored by column instead of one dict per chunk:
+    documents (source_pdf, conversation scope, content hash) are interned once, page and chunk
+    numbers are int32 arrays, texts share one UTF-8 buffer addressed by offsets, page hashes
+    are 20 raw bytes, and embeddings are a float32 matrix of unit rows plus their norms, which
+    is also what similarity search runs on. Rarely set fields (duplicate_pages, ids that don't
+    follow _chunk_doc_id, unknown metadata keys) are kept in small dicts by row key.
+
+    Rows are addressed by key ("chunk_<n>", increasing, so a key's row is found by bisection).
+    `chunks` and `embeddings` are read-only mappings over the rows, with ChunkRow views that
+    look like the chunk dicts retrieval used to pass around. Arrays grow by doubling, and
+    removing a document compacts them in place.
+
+    Each document keeps a posting list of its rows (ascending), and documents are indexed by
+    normalised name and by scope, so the rows of a pdf_context or a conversation are found
+    without scanning the store. Postings are appended to on add and shifted on removal.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        import numpy as np
+        self.size = 0
+        self.documents = []          # [(source_pdf, scope, content_hash)], by document number
+        self._document_numbers = {}
+        self._postings = []          # Rows of each document, ascending, by document number
+        self._documents_by_name = defaultdict(set)   # _document_name_key(source_pdf) -> document numbers
+        self._documents_by_scope = defaultdict(set)  # scope -> document numbers
+        self.keys = np.empty(0, dtype=np.int64)
+        self.document = np.empty(0, dtype=np.int32)
+        self.page_no = np.empty(0, dtype=np.int32)
+        self.chunk_index = np.empty(0, dtype=np.int32)
+        self.page_chunk_index = np.empty(0, dtype=np.int32)
+        self.page_hashes = np.empty((0, 20), dtype=np.uint8)
+        self.has_page_hash = np.empty(0, dtype=bool)
+        self.text_offsets = np.zeros(1, dtype=np.int64)   # Row i's text is text[offsets[i]:offsets[i + 1]]
+        self.text = bytearray()
+        self.matrix = None
+        self.norms = np.empty(0, dtype=np.float32)
+        self.duplicate_pages = {}
+        self.explicit_ids = {}
+        self.extras = {}
+
+    _INT_COLUMNS = ("page_no", "chunk_index", "page_chunk_index")
+    _ABSENT = -1  # Stored for a missing page/chunk number
+
+    def __len__(self):
+        return self.size
+
+    def _reserve(self, rows, dim):
+        import numpy as np
+        needed = self.size + rows
+        capacity = len(self.keys)
+        if self.matrix is not None and dim != self.matrix.shape[1]:
+            raise ValueError(f"Embedding of dimension {dim} added to a store of dimension {self.matrix.shape[1]}")
+        if self.matrix is not None and needed <= capacity:
+            return
+        capacity = max(1024, needed, 2 * capacity)
+
+        def grow(column, shape=()):
+            grown = np.zeros((capacity,) + shape, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            return grown
+
+        self.keys, self.document = grow(self.keys), grow(self.document)
+        for name in self._INT_COLUMNS:
+            setattr(self, name, grow(getattr(self, name)))
+        self.page_hashes, self.has_page_hash = grow(self.page_hashes, (20,)), grow(self.has_page_hash)
+        self.norms = grow(self.norms)
+        offsets = np.zeros(capacity + 1, dtype=np.int64)
+        offsets[:self.size + 1] = self.text_offsets[:self.size + 1]
+        self.text_offsets = offsets
+        self.matrix = grow(self.matrix if self.matrix is not None else np.empty((0, dim), dtype=np.float32), (dim,))
+
+    def _document_number(self, source_pdf, scope, content_hash):
+        document = (source_pdf, scope, content_hash)
+        number = self._document_numbers.get(document)
+        if number is None:
+            number = self._document_numbers[document] = len(self.documents)
+            self.documents.append(document)
+            self._postings.append(array('q'))
+            self._documents_by_name[_document_name_key(source_pdf)].add(number)
+            self._documents_by_scope[scope].add(number)
+        return number
+
+    def add(self, chunk, metadata, embedding):
+        """Append one chunk (text, metadata as stored in ChromaDB, embedding) and return its key."""
+        key = next(_chunk_key_counter)
+        row, norm = _normalise_rows(embedding)
+        self._reserve(1, row.shape[1])
+        position = self.size
+        extras = {name: value for name, value in metadata.items() if name not in _STORE_COLUMNS}
+        if metadata.get("type", "pdf_chunk") != "pdf_chunk":
+            extras["type"] = metadata["type"]
+
+        self.keys[position] = key
+        number = self._document_number(
+            metadata.get("source_pdf", "Unknown"), metadata.get("conversation_id"), metadata.get("content_hash")
+        )
+        self.document[position] = number
+        self._postings[number].append(position)
+        for name in self._INT_COLUMNS:
+            value = metadata.get(name)
+            if value is None:
+                value = self._ABSENT
+            elif not isinstance(value, numbers.Integral) or isinstance(value, bool) or not 0 <= value < 2 ** 31:
+                extras[name], value = value, self._ABSENT
+            getattr(self, name)[position] = value
+        page_hash = metadata.get("page_hash")
+        self.has_page_hash[position] = False
+        if page_hash:
+            digest = bytes.fromhex(page_hash) if isinstance(page_hash, str) and re.fullmatch(r"[0-9a-f]{40}", page_hash) else None
+            if digest is None:
+                extras["page_hash"] = page_hash
+            else:
+                self.page_hashes[position] = list(digest)
+                self.has_page_hash[position] = True
+        if metadata.get("duplicate_pages"):
+            self.duplicate_pages[key] = metadata["duplicate_pages"]
+        encoded = (chunk or "").encode('utf-8')
+        self.text += encoded
+        self.text_offsets[position + 1] = self.text_offsets[position] + len(encoded)
+        self.matrix[position] = row[0]
+        self.norms[position] = norm[0]
+        self.size += 1
+        if metadata.get("id") != self._derived_id(position):
+            self.explicit_ids[key] = metadata.get("id")
+        if extras:
+            self.extras[key] = extras
+        return f"chunk_{key}"
+
+    def _derived_id(self, position):
+        source_pdf, scope, content_hash = self.documents[self.document[position]]
+        page_chunk_index = int(self.page_chunk_index[position])
+        if page_chunk_index == self._ABSENT or self.page_no[position] == self._ABSENT:
+            return None
+        conversation_id = None if scope in (None, "global", "shared") else scope
+        return _chunk_doc_id(source_pdf, int(self.page_no[position]), page_chunk_index, conversation_id, content_hash)
+
+    def position(self, chunk_key):
+        """Row of a "chunk_<n>" key, or None if it isn't (or no longer) stored."""
+        import numpy as np
+        try:
+            key = int(str(chunk_key).rpartition("_")[2])
+        except ValueError:
+            return None
+        position = int(np.searchsorted(self.keys[:self.size], key))
+        return position if position < self.size and self.keys[position] == key else None
+
+    def text_of(self, position):
+        return self.text[self.text_offsets[position]:self.text_offsets[position + 1]].decode('utf-8')
+
+    def metadata_of(self, position):
+        """The chunk's metadata dict, as it was added."""
+        key = int(self.keys[position])
+        source_pdf, scope, content_hash = self.documents[self.document[position]]
+        metadata = {"type": "pdf_chunk", "source_pdf": source_pdf}
+        if scope is not None:
+            metadata["conversation_id"] = scope
+        chunk_id = self.explicit_ids[key] if key in self.explicit_ids else self._derived_id(position)
+        if chunk_id is not None:
+            metadata["id"] = chunk_id
+        for name in self._INT_COLUMNS:
+            value = int(getattr(self, name)[position])
+            if value != self._ABSENT:
+                metadata[name] = value
+        if content_hash is not None:
+            metadata["content_hash"] = content_hash
+        if self.has_page_hash[position]:
+            metadata["page_hash"] = self.page_hashes[position].tobytes().hex()
+        if key in self.duplicate_pages:
+            metadata["duplicate_pages"] = self.duplicate_pages[key]
+        metadata.update(self.extras.get(key, {}))
+        return metadata
+
+    def embedding_of(self, position):
+        return self.matrix[position] * self.norms[position]
+
+    def rows_of(self, numbers):
+        """Ascending rows of these documents, from their postings."""
+        import numpy as np
+        parts = [np.frombuffer(self._postings[number], dtype=np.int64) for number in numbers if self._postings[number]]
+        if not parts:
+            return np.empty(0, dtype=np.intp)
+        rows = parts[0].copy() if len(parts) == 1 else np.sort(np.concatenate(parts))
+        return rows.astype(np.intp, copy=False)
+
+    def document_rows(self, filename=None, scope=None, match=None):
+        """Rows of the documents with this source_pdf and/or scope (or for which match(source_pdf, scope, hash) is true)."""
+        if filename is not None:
+            numbers = self._documents_by_name.get(_document_name_key(filename), ())
+        elif scope is not None:
+            numbers = self._documents_by_scope.get(scope, ())
+        else:
+            numbers = range(len(self.documents))
+        wanted = [
+            number for number in numbers
+            if (filename is None or self.documents[number][0] == filename)
+            and (scope is None or self.documents[number][1] == scope)
+            and (match is None or match(*self.documents[number]))
+        ]
+        return self.rows_of(sorted(wanted))
+
+    def name_rows(self, pdf_filename):
+        """Rows of every document a pdf_context of pdf_filename selects (same name, with or without .pdf)."""
+        return self.rows_of(sorted(self._documents_by_name.get(_document_name_key(pdf_filename), ())))
+
+    def conversation_rows(self, conversation_id, content_hashes=()):
+        """
+        Rows a conversation can search: its own documents, documents ingested without a
+        conversation, and content-addressed documents whose hash is in content_hashes
+        (loaded from ChromaDB as "shared", or ingested by this process under the uploading
+        conversation). conversation_id None leaves out conversation-scoped documents.
+        """
+        numbers = set(self._documents_by_scope.get(str(conversation_id), ())) if conversation_id else set()
+        for scope in ("global", None):
+            numbers |= self._documents_by_scope.get(scope, set())
+        if content_hashes:
+            numbers.update(number for number, (_, _, content_hash) in enumerate(self.documents)
+                           if content_hash in content_hashes)
+        return self.rows_of(sorted(numbers))
+
+    def has_scope(self, scope):
+        return any(self._postings[number] for number in self._documents_by_scope.get(scope, ()))
+
+    def document_names(self, scope):
+        """source_pdf of every document with rows in this scope."""
+        return {self.documents[number][0] for number in self._documents_by_scope.get(scope, ()) if self._postings[number]}
+
+    def remove_rows(self, positions):
+        """Drop rows, compacting every column in place; returns how many were dropped."""
+        import numpy as np
+        if not len(positions):
+            return 0
+        size = self.size
+        keep = np.ones(size, dtype=bool)
+        keep[positions] = False
+        for key in self.keys[:size][~keep].tolist():
+            self.duplicate_pages.pop(key, None)
+            self.explicit_ids.pop(key, None)
+            self.extras.pop(key, None)
+        # Postings: drop the removed rows and shift the rest down by the removed rows before them
+        removed = np.flatnonzero(~keep)
+        for number, posting in enumerate(self._postings):
+            if not posting or posting[-1] < removed[0]:
+                continue
+            rows = np.frombuffer(posting, dtype=np.int64).copy()
+            rows = rows[keep[rows]]
+            self._postings[number] = array('q', (rows - np.searchsorted(removed, rows)).tobytes())
+        starts, ends = self.text_offsets[:size][keep], self.text_offsets[1:size + 1][keep]
+        self.text = bytearray(b"".join(self.text[start:end] for start, end in zip(starts.tolist(), ends.tolist())))
+        kept = int(keep.sum())
+        self.text_offsets[1:kept + 1] = np.cumsum(ends - starts)
+        for name in ("keys", "document", "page_hashes", "has_page_hash", "norms", "matrix") + self._INT_COLUMNS:
+            column = getattr(self, name)
+            column[:kept] = column[:size][keep]
+        self.size = kept
+        return size - kept
+
+    def set_duplicate_pages(self, updates, scope):
+        """Apply {chunk id: duplicate_pages or None} to the chunks with those ids in scope."""
+        for position in self.document_rows(scope=scope).tolist():
+            key = int(self.keys[position])
+            chunk_id = self.explicit_ids[key] if key in self.explicit_ids else self._derived_id(position)
+            if chunk_id in updates:
+                if updates[chunk_id]:
+                    self.duplicate_pages[key] = updates[chunk_id]
+                else:
+                    self.duplicate_pages.pop(key, None)
+
+    def search(self, query_vector, top_k, threshold=None, positions=None):
+        """[(row, cosine similarity)] of the best top_k rows (or of positions) scoring at least threshold."""
+        if not self.size:
+            return []
+        query = _normalise_rows(query_vector)[0][0]
+        if positions is None:
+            scores = self.matrix[:self.size] @ query
+            return [(int(i), float(scores[i])) for i in _top_k_rows(scores, top_k, threshold)]
+        scores = self.matrix[positions] @ query
+        return [(int(positions[i]), float(scores[i])) for i in _top_k_rows(scores, top_k, threshold)]
+
+    def nbytes(self):
+        """Bytes held by the columns in use (text, numbers, hashes and embeddings)."""
+        used = self.size
+        columns = (self.keys, self.document, self.norms, self.has_page_hash) + tuple(getattr(self, name) for name in self._INT_COLUMNS)
+        total = sum(column[:used].nbytes for column in columns) + self.page_hashes[:used].nbytes
+        total += self.text_offsets[:used + 1].nbytes + len(self.text)
+        return total + (self.matrix[:used].nbytes if self.matrix is not None else 0)
+
+    @property
+    def chunks(self):
+        return ChunkRows(self)
+
+    @property
+    def embeddings(self):
+        return EmbeddingRows(self)
+
+
+class ChunkRow(Mapping):
+    """
+    Read-only view of one stored chunk with the keys of the old per-chunk dicts (content,
+    chunk_text, metadata, source, source_pdf, page_no, page_number, chunk_id, document_id).
+    copy() returns a plain dict that callers can annotate (e.g. with similarity scores).
+    """
+
+    def __init__(self, store, position):
+        self._store = store
+        self._position = position
+        self._fields = None
+
+    def _materialise(self):
+        if self._fields is None:
+            store, position = self._store, self._position
+            text = store.text_of(position)
+            metadata = store.metadata_of(position)
+            chunk_key = f"chunk_{int(store.keys[position])}"
+            self._fields = {
+                'content': text,
+                'chunk_text': text,
+                'metadata': metadata,
+                'source': metadata.get('source', 'Unknown'),
+                'source_pdf': metadata.get('source_pdf', 'Unknown'),
+                'page_no': metadata.get('page_no', 1),
+                'page_number': metadata.get('page_no', 1),
+                'chunk_id': metadata.get('id', chunk_key),
+                'document_id': metadata.get('id', chunk_key),
+            }
+        return self._fields
+
+    def __getitem__(self, name):
+        return self._materialise()[name]
+
+    def __iter__(self):
+        return iter(self._materialise())
+
+    def __len__(self):
+        return len(self._materialise())
+
+    def copy(self):
+        fields = dict(self._materialise())
+        fields['metadata'] = dict(fields['metadata'])
+        return fields
+
+
+class ChunkRows(Mapping):
+    """Read-only {"chunk_<n>": ChunkRow} over a ChunkStore, or over some of its rows (ascending positions)."""
+
+    def __init__(self, store, positions=None):
+        self.store = store
+        self.positions = positions
+
+    def _rows(self):
+        import numpy as np
+        return np.arange(self.store.size) if self.positions is None else self.positions
+
+    def _position(self, chunk_key):
+        import numpy as np
+        position = self.store.position(chunk_key)
+        if position is None:
+            raise KeyError(chunk_key)
+        if self.positions is not None:
+            # positions are ascending, as returned by ChunkStore.document_rows()
+            found = int(np.searchsorted(self.positions, position))
+            if found == len(self.positions) or self.positions[found] != position:
+                raise KeyError(chunk_key)
+        return position
+
+    def __getitem__(self, chunk_key):
+        return ChunkRow(self.store, self._position(chunk_key))
+
+    def __iter__(self):
+        return (f"chunk_{key}" for key in self.store.keys[self._rows()].tolist())
+
+    def __len__(self):
+        return self.store.size if self.positions is None else len(self.positions)
+
+    def subset(self, positions):
+        return ChunkRows(self.store, positions)
+
+    @property
+    def embeddings(self):
+        """The embeddings of the same rows."""
+        return EmbeddingRows(self.store, self.positions)
+
+
+class EmbeddingRows(ChunkRows):
+    """Read-only {"chunk_<n>": float32 embedding} over a ChunkStore, or over some of its rows."""
+
+    def __getitem__(self, chunk_key):
+        return self.store.embedding_of(self._position(chunk_key))
+
+    def search(self, query_vector, top_k, threshold=None):
+        """[("chunk_<n>", cosine similarity)] of the best top_k of these rows, best first."""
+        return [(f"chunk_{int(self.store.keys[position])}", score)
+                for position, score in self.store.search(query_vector, top_k, threshold, self.positions)]
+
+
 # In-memory storage for backward compatibility
-in_memory_chunks = {}  # Store all chunks in memory as dictionary
-in_memory_embeddings = {}  # Store all embeddings in memory as dictionary
-in_memory_metadata = []  # Store all metadata in memory
+_chunk_key_counter = itertools.count()
+in_memory_store = ChunkStore()
+in_memory_chunks = in_memory_store.chunks  # Read-only views over the store
+in_memory_embeddings = in_memory_store.embeddings
+
+
+def _add_in_memory_chunk(chunk, metadata, embedding):
+    """Add one chunk to the in-memory store under a fresh key and return the key."""
+    return in_memory_store.add(chunk, metadata, embedding)
+
+
+def clear_in_memory_store():
+    in_memory_store.clear()
+
+
+def remove_in_memory_document(filename, conversation_id=None):
+    """Drop a document's chunks from memory (all scopes, or only the given conversation)."""
+    scope = str(conversation_id) if conversation_id else None
+    return in_memory_store.remove_rows(in_memory_store.document_rows(filename, scope))
 
 # Ensure directories exist
 os.makedirs(pdf_dir, exist_ok=True)
 os.makedirs(cache_dir, exist_ok=True)
+os.makedirs(stats_dir, exist_ok=True)
+os.makedirs(contents_dir, exist_ok=True)
+os.makedirs(content_files_dir, exist_ok=True)
 
 # -------- PDF Utils -------- #
 
-def extract_text_per_page(pdf_path):
+# Lines repeated on at least this fraction of a document's pages (running headers and
+# footers, page counters, disclaimers, watermarks) are stripped before chunking; 0 disables
+BOILERPLATE_MIN_FRACTION = float(os.environ.get("RAG_BOILERPLATE_MIN_FRACTION", "0.5"))
+# Documents shorter than this many pages are never stripped
+BOILERPLATE_MIN_PAGES = 3
+
+
+# "12", "Page 12", "12 of 40", "page 12/40"
+_PAGE_COUNTER = re.compile(r'^(page\s*)?(\d+)(\s*(?:of|/)\s*\d+)?$', re.IGNORECASE)
+
+
+def _boilerplate_key(line, page_no):
+    """
+    Stable digest of a line with its spacing normalized, or None if blank. Page counters
+    are keyed by their number minus page_no, so "Page 3 of 40" on page 3 matches "Page 4 of 40"
+    on page 4, while numbers that don't follow the page (table cells, totals) never match.
+    Every other line must repeat exactly.
+    """
+    normalized = " ".join(line.split())
+    if not normalized:
+        return None
+    counter = _PAGE_COUNTER.match(normalized)
+    if counter:
+        prefix, number, total = counter.groups()
+        normalized = f"\0page-counter:{(prefix or '').lower().strip()}:{int(number) - page_no}:{' '.join((total or '').lower().split())}"
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).digest()
+
+
+def detect_boilerplate(doc, min_fraction=None):
+    """
+    Scan every page of an open fitz document and return the keys of lines that appear on
+    at least min_fraction of its pages. Only line hashes and counts are kept, so memory
+    stays proportional to the number of distinct lines rather than the document's text.
+    """
+    fraction = BOILERPLATE_MIN_FRACTION if min_fraction is None else min_fraction
+    page_count = len(doc)
+    if fraction <= 0 or page_count < BOILERPLATE_MIN_PAGES:
+        return set()
+    counts = defaultdict(int)
+    for page_num in range(page_count):
+        keys = {_boilerplate_key(line, page_num + 1) for line in doc.load_page(page_num).get_text("text").splitlines()}
+        keys.discard(None)
+        for key in keys:
+            counts[key] += 1
+    threshold = max(BOILERPLATE_MIN_PAGES, -(-fraction * page_count // 1))
+    return {key for key, pages in counts.items() if pages >= threshold}
+
+
+def open_pdf(pdf_path):
+    """
+    Open a PDF through a read-only memory map of the file: PyMuPDF parses straight from the
+    mapped pages (already in the page cache for a file that was just uploaded) with no
+    read() copies, and both the boilerplate scan and the page reader share them.
+    Returns (document, buffer); release the buffer with close_pdf() after the document.
+    """
     import fitz
-    doc = fitz.open(pdf_path)
-    page_texts = []
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        text = page.get_text("text")
+    import mmap
+    with open(pdf_path, 'rb') as f:
+        try:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty file: let PyMuPDF raise its usual error
+            return fitz.open(pdf_path), None
+    buffer = memoryview(mapped)
+    try:
+        return fitz.open(stream=buffer, filetype="pdf"), buffer
+    except Exception:
+        buffer.release()
+        mapped.close()
+        raise
+
+
+def close_pdf(doc, buffer):
+    doc.close()
+    if buffer is not None:
+        mapped = buffer.obj
+        buffer.release()
+        mapped.close()
+
+
+class PdfPageStream:
+    """
+    Reads a PDF one page at a time with PyMuPDF. Iterating yields cleaned, non-empty
+    page dicts ({page_no, text, page_hash}), so only the current page's text is held in
+    memory. page_count is known as soon as the stream is opened; page_word_counts fills
+    in as pages are read and is complete once iteration finishes.
+
+    Unless strip_boilerplate is False, a first pass over the whole document finds lines
+    repeated across most pages and the reader drops them; boilerplate_stats records how
+    much text that removed.
+    """
+
+    def __init__(self, pdf_path, max_pages=None, strip_boilerplate=True):
+        self.doc, self.buffer = open_pdf(pdf_path)
+        self.page_count = len(self.doc)
+        self.pages_to_read = self.page_count if max_pages is None else min(max_pages, self.page_count)
+        self.page_word_counts = []
+        # Detected over all pages even for partial reads, so page hashes match the full run
+        self.boilerplate = detect_boilerplate(self.doc) if strip_boilerplate else set()
+        self.boilerplate_lines = {}  # key -> first line removed with it, for reporting
+        self.boilerplate_stats = {"patterns": len(self.boilerplate), "lines_removed": 0, "chars_removed": 0, "chars_total": 0}
+
+    def strip(self, text, page_no):
+        """Remove boilerplate lines from one page's raw text."""
+        self.boilerplate_stats["chars_total"] += len(text)
+        if not self.boilerplate:
+            return text
+        kept = []
+        for line in text.splitlines():
+            key = _boilerplate_key(line, page_no)
+            if key in self.boilerplate:
+                self.boilerplate_lines.setdefault(key, line.strip())
+                self.boilerplate_stats["lines_removed"] += 1
+                self.boilerplate_stats["chars_removed"] += len(line) + 1
+            else:
+                kept.append(line)
+        return "\n".join(kept)
+
+    def raw_pages(self):
+        """Reader stage: (page_no, raw text) per page; closes the document when exhausted."""
+        try:
+            for page_num in range(self.pages_to_read):
+                text = self.doc.load_page(page_num).get_text("text")
+                self.page_word_counts.append(len(text.split()))
+                yield page_num + 1, self.strip(text, page_num + 1)
+        finally:
+            close_pdf(self.doc, self.buffer)
+
+    def __iter__(self):
+        return clean_pages(self.raw_pages())
+
+    def stats(self):
+        return {
+            "page_count": self.page_count,
+            "page_word_counts": self.page_word_counts,
+            "total_words": sum(self.page_word_counts),
+            "boilerplate": dict(self.boilerplate_stats, examples=list(self.boilerplate_lines.values())[:5]),
+        }
+
+
+def clean_pages(raw_pages):
+    """Cleaner stage: clean each (page_no, text) pair and skip pages left empty."""
+    for page_no, text in raw_pages:
         cleaned = clean_text(text)
         if cleaned.strip():  # Skip empty pages
-            page_texts.append({
-                "page_no": page_num + 1,
-                "text": cleaned
-            })
-    doc.close()
-    return page_texts
+            yield {
+                "page_no": page_no,
+                "text": cleaned,
+                # Fingerprint used to skip unchanged pages when a document is replaced
+                "page_hash": hashlib.sha1(cleaned.encode('utf-8')).hexdigest()
+            }
+
+
+def parse_pdf(pdf_path):
+    """
+    Single PyMuPDF pass over a PDF. Returns the cleaned text of every non-empty page
+    together with the page count and per-page word counts, so ingestion, analysis and
+    the library listing don't each reopen the file with a different parser. Holds the
+    whole document in memory; process_pdf streams pages through PdfPageStream instead.
+    """
+    stream = PdfPageStream(pdf_path)
+    pages = list(stream)
+    return dict(stream.stats(), pages=pages)
+
+def extract_text_per_page(pdf_path):
+    return parse_pdf(pdf_path)["pages"]
 
 def clean_text(text):
     text = re.sub(r'[^\x00-\x7F]+', '', text)#sub is regular expression substitution
@@ -100,107 +1010,1383 @@ def clean_text(text):
 
 #spaCy is used for intelligent text chunking that preserves semantic meaning
 
+# Sentence segmentation backend used by the chunker:
+#   "spacy"       - the full en_core_web_sm pipeline (default; what existing indexes were chunked with)
+#   "sentencizer" - rule-based spaCy sentencizer on a blank English pipeline (fast, no model to load)
+#   "parser"      - en_core_web_sm dependency parser only; tagger, NER and lemmatizer are excluded
+# Sentence boundaries decide chunk boundaries and ids, so switching an existing index to another
+# mode goes through `manage.py rebuild_index` (a new index generation), not a plain restart
+CHUNKER_MODE = os.environ.get("RAG_CHUNKER", "spacy")
+# Pages per nlp.pipe() batch, and spaCy worker processes (1 = in-process)
+CHUNKER_BATCH_SIZE = int(os.environ.get("RAG_CHUNKER_BATCH_SIZE", "32"))
+CHUNKER_PROCESSES = int(os.environ.get("RAG_CHUNKER_PROCESSES", "1"))
+
+
+def _load_sentencizer():
+    import spacy
+    nlp = spacy.blank("en")
+    nlp.add_pipe("sentencizer")
+    return nlp
+
+
+def _load_parser_only():
+    import spacy
+    # The parser sets sentence boundaries; it only needs tok2vec
+    return spacy.load("en_core_web_sm", exclude=["tagger", "attribute_ruler", "lemmatizer", "ner", "senter"])
+
+
+# Chunker modes -> loader returning a spaCy pipeline that sets doc.sents
+CHUNKER_PIPELINES = {
+    "sentencizer": _load_sentencizer,
+    "parser": _load_parser_only,
+    "spacy": get_nlp,
+}
+
+
+# How chunk length is measured:
+#   "words"  - up to 800 whitespace words (default; what existing indexes were chunked with, though
+#              the model truncates most of each chunk)
+#   "tokens" - embedding-model word-piece tokens, chunks fit its max sequence length (no truncation)
+# Like RAG_CHUNKER, changing it for an existing index goes through `manage.py rebuild_index`
+CHUNK_BUDGET = os.environ.get("RAG_CHUNK_BUDGET", "words")
+# Tokens of trailing sentences repeated at the start of the next chunk in "tokens" mode
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("RAG_CHUNK_OVERLAP_TOKENS", "32"))
+# 1 = tokenize every "words" chunk during ingestion to log how much the model truncates (an extra
+# word-piece pass over the whole document; `manage.py chunking_report` gives the same figures offline)
+TRUNCATION_STATS = int(os.environ.get("RAG_TRUNCATION_STATS", "0"))
+
+
+def measure_truncation(chunks):
+    """
+    How much of each chunk the embedding model never sees. Returns a dict with the chunk
+    count, total tokens, chunks over the limit and tokens dropped by truncation.
+    """
+    tokenizer, max_length = get_tokenizer()
+    limit = max_length - 2  # [CLS] and [SEP]
+    lengths = [len(ids) for ids in tokenizer(list(chunks), add_special_tokens=False)["input_ids"]] if chunks else []
+    return {
+        "chunks": len(lengths),
+        "tokens": sum(lengths),
+        "truncated_chunks": sum(1 for n in lengths if n > limit),
+        "truncated_tokens": sum(n - limit for n in lengths if n > limit),
+    }
+
+
+class SentenceChunker:
+    """
+    Groups sentences into chunks, carrying the last few sentences over as overlap.
+    With budget="words", chunks hold about chunk_size words; with budget="tokens",
+    they are measured with the embedding model's tokenizer and fit its max sequence
+    length, so nothing is truncated at encode time. Sentence boundaries come from the
+    spaCy pipeline of the configured mode (see CHUNKER_PIPELINES), and chunk_many()
+    segments many pages with one nlp.pipe() call instead of one pipeline call per page.
+    """
+
+    def __init__(self, mode=None, chunk_size=800, overlap=50, batch_size=None, n_process=None,
+                 budget=None, overlap_tokens=None):
+        self.mode = mode or CHUNKER_MODE
+        if self.mode not in CHUNKER_PIPELINES:
+            raise ValueError(f"Unknown chunker mode {self.mode!r}; expected one of {sorted(CHUNKER_PIPELINES)}")
+        self.budget = budget or CHUNK_BUDGET
+        if self.budget not in ("words", "tokens"):
+            raise ValueError(f"Unknown chunk budget {self.budget!r}; expected 'words' or 'tokens'")
+        self.chunk_size = chunk_size
+        self.overlap = overlap
+        self.overlap_tokens = CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+        self.batch_size = batch_size or CHUNKER_BATCH_SIZE
+        self.n_process = n_process or CHUNKER_PROCESSES
+        self._nlp = None
+
+    @property
+    def nlp(self):
+        if self._nlp is None:
+            print(f"[CHUNK] Loading '{self.mode}' sentence segmenter")
+            self._nlp = CHUNKER_PIPELINES[self.mode]()
+        return self._nlp
+
+    @property
+    def signature(self):
+        """Identifies the chunking settings; pages chunked under other settings are re-chunked."""
+        if self.budget == "tokens":
+            return f"{self.mode}:tokens:{get_tokenizer()[1]}:{self.overlap_tokens}"
+        return f"{self.mode}:words:{self.chunk_size}:{self.overlap}"
+
+    def group(self, sentences):
+        if self.budget == "tokens":
+            return self._group_tokens(sentences)
+        chunks = []
+        current_chunk = []
+        current_length = 0
+        for sentence in sentences:
+            sentence_length = len(sentence.split())
+            if current_chunk and current_length + sentence_length > self.chunk_size:
+                chunks.append(" ".join(current_chunk))
+                # overlap: keep last few sentences for next chunk
+                overlap_sentences = current_chunk[-(self.overlap // 20):] if self.overlap > 0 else []
+                current_chunk = overlap_sentences.copy()
+                current_length = sum(len(s.split()) for s in current_chunk)
+            current_chunk.append(sentence)
+            current_length += sentence_length
+        if current_chunk:
+            chunks.append(" ".join(current_chunk))
+        return chunks
+
+    def _group_tokens(self, sentences):
+        tokenizer, max_length = get_tokenizer()
+        limit = max_length - 2  # [CLS] and [SEP]
+        sentences = [sentence for sentence in sentences if sentence]
+        if not sentences:
+            return []
+        offsets = tokenizer(sentences, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+
+        # (text, token count); sentences longer than the limit are cut at token boundaries
+        pieces = []
+        for sentence, sentence_offsets in zip(sentences, offsets):
+            if len(sentence_offsets) <= limit:
+                pieces.append((sentence, len(sentence_offsets)))
+                continue
+            for start in range(0, len(sentence_offsets), limit):
+                window = sentence_offsets[start:start + limit]
+                pieces.append((sentence[window[0][0]:window[-1][1]].strip(), len(window)))
+
+        chunks = []
+        current_chunk = []
+        current_length = 0
+        for piece in pieces:
+            if current_chunk and current_length + piece[1] > limit:
+                chunks.append(" ".join(text for text, _ in current_chunk))
+                # overlap: carry trailing sentences worth at most overlap_tokens, leaving room for this one
+                carried = []
+                carried_length = 0
+                for previous in reversed(current_chunk):
+                    if carried_length + previous[1] > self.overlap_tokens or carried_length + previous[1] + piece[1] > limit:
+                        break
+                    carried.insert(0, previous)
+                    carried_length += previous[1]
+                current_chunk, current_length = carried, carried_length
+            current_chunk.append(piece)
+            current_length += piece[1]
+        if current_chunk:
+            chunks.append(" ".join(text for text, _ in current_chunk))
+        return chunks
+
+    def chunk(self, text):
+        return self.group(sent.text.strip() for sent in self.nlp(text).sents)
+
+    def chunk_pages(self, pages, skip=None, n_process=None):
+        """
+        Chunker stage: yield (page_info, chunks) for each page dict, lazily, through one
+        nlp.pipe() call. Page text is dropped from page_info once it has been segmented.
+        Pages for which skip(page_info) is true are passed through with no chunks.
+        """
+        def texts():
+            for page_info in pages:
+                text = page_info.pop("text")
+                yield ("" if skip and skip(page_info) else text), page_info
+
+        docs = self.nlp.pipe(texts(), as_tuples=True, batch_size=self.batch_size, n_process=n_process or self.n_process)
+        for doc, page_info in docs:
+            yield page_info, self.group(sent.text.strip() for sent in doc.sents) if len(doc) else []
+
+    def chunk_many(self, texts, n_process=None):
+        """Yield the chunk list of each text, in order, segmenting them in nlp.pipe() batches."""
+        docs = self.nlp.pipe(texts, batch_size=self.batch_size, n_process=n_process or self.n_process)
+        for doc in docs:
+            yield self.group(sent.text.strip() for sent in doc.sents)
+
+
+_chunkers = {}
+
+
+def get_chunker(mode=None):
+    """Shared SentenceChunker per mode, so each process loads a segmenter once."""
+    mode = mode or CHUNKER_MODE
+    if mode not in _chunkers:
+        _chunkers[mode] = SentenceChunker(mode)
+    return _chunkers[mode]
+
+
+def page_fingerprint(page_hash):
+    """Page text hash combined with the chunker settings, stored with each chunk as page_hash."""
+    return hashlib.sha1(f"{get_chunker().signature}:{page_hash}".encode('utf-8')).hexdigest()
+
+
+# -------- Index generations -------- #
+
+# Vectors are kept in one ChromaDB collection per index generation: the embedding model and
+# chunker settings they were produced with. Changing those builds a new generation next to
+# the active one (`manage.py rebuild_index`) while queries keep using the old collection, then
+# the registry is switched over in one atomic write. The original collection is the legacy generation.
+LEGACY_COLLECTION = "rag_documents"
+index_registry_path = os.path.join(chroma_dir, "index_generations.json")
+# Seconds between checks of the registry by serving processes, so they follow a switch
+INDEX_CHECK_SECONDS = float(os.environ.get("RAG_INDEX_CHECK_SECONDS", "5"))
+
+
+def index_settings():
+    """Embedding model and chunker settings this process currently produces vectors with."""
+    return {
+        "embed_model": EMBED_MODEL_NAME,
+        "chunker": CHUNKER_MODE,
+        "chunk_budget": CHUNK_BUDGET,
+        "chunk_overlap_tokens": CHUNK_OVERLAP_TOKENS,
+    }
+
+
+# Settings from the environment, i.e. what the next rebuild_index builds by default
+CONFIGURED_INDEX_SETTINGS = index_settings()
+# Settings the original collection was built with. It keeps them until rebuild_index writes
+# a registry, so changing the environment alone never mixes models or chunkers in it
+LEGACY_INDEX_SETTINGS = {
+    "embed_model": "all-MiniLM-L6-v2",
+    "chunker": "spacy",
+    "chunk_budget": "words",
+    "chunk_overlap_tokens": 32,
+}
+
+
+def index_settings_of(generation):
+    return {key: generation.get(key, value) for key, value in CONFIGURED_INDEX_SETTINGS.items()}
+
+
+def new_index_generation(settings):
+    """A generation record for settings, with a collection name of its own (also when rebuilding the same settings)."""
+    created_at = time.time()
+    digest = hashlib.sha1(json.dumps(dict(settings, created_at=created_at), sort_keys=True).encode('utf-8')).hexdigest()[:10]
+    return dict(settings, collection=f"{LEGACY_COLLECTION}_{digest}", created_at=created_at)
+
+
+def load_index_registry():
+    """{"active": generation, "building": generation or None}, or None before the first rebuild."""
+    try:
+        with open(index_registry_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_index_registry(registry):
+    os.makedirs(os.path.dirname(index_registry_path), exist_ok=True)
+    tmp_path = f"{index_registry_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(registry, f, indent=1)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, index_registry_path)
+
+
+def current_index_registry():
+    """
+    The saved registry, or (before the first rebuild_index) the original collection as the
+    legacy generation with LEGACY_INDEX_SETTINGS. Only rebuild_index writes the registry.
+    """
+    return load_index_registry() or {
+        "active": dict(LEGACY_INDEX_SETTINGS, collection=LEGACY_COLLECTION), "building": None
+    }
+
+
+_generation = None
+_generation_pinned = False
+_generation_checked = 0.0
+
+
+def get_index_generation():
+    """
+    The generation this process reads and writes: the registry's active one, re-read every
+    INDEX_CHECK_SECONDS so a switch made by rebuild_index is picked up. Without a registry
+    the existing collection is the legacy generation (see current_index_registry).
+    """
+    global _generation_checked
+    if _generation is not None and (_generation_pinned or time.monotonic() - _generation_checked < INDEX_CHECK_SECONDS):
+        return _generation
+    _generation_checked = time.monotonic()
+    active = current_index_registry()["active"]
+    if _generation is None or active["collection"] != _generation["collection"]:
+        _apply_index_generation(active)
+    return _generation
+
+
+def use_index_generation(generation):
+    """Pin this process to a generation, e.g. the one rebuild_index is writing; the registry is no longer followed."""
+    global _generation_pinned, _collection
+    _generation_pinned = True
+    _apply_index_generation(generation)
+    _collection = None
+
+
+def _apply_index_generation(generation):
+    global _generation, _collection, _model, _tokenizer, _embedding_cache, _lexical_index
+    global EMBED_MODEL_NAME, CHUNKER_MODE, CHUNK_BUDGET, CHUNK_OVERLAP_TOKENS
+    previous, _generation = _generation, generation
+    settings = index_settings_of(generation)
+    if settings["embed_model"] != EMBED_MODEL_NAME:
+        _model = _tokenizer = _embedding_cache = None
+    if settings != index_settings():
+        _chunkers.clear()
+    EMBED_MODEL_NAME = settings["embed_model"]
+    CHUNKER_MODE = settings["chunker"]
+    CHUNK_BUDGET = settings["chunk_budget"]
+    CHUNK_OVERLAP_TOKENS = settings["chunk_overlap_tokens"]
+    if previous is not None and previous["collection"] != generation["collection"]:
+        # Vectors held in memory came from the old generation and can't be compared with
+        # the new model's query embeddings; queries reload them from the new collection
+        _collection = _lexical_index = None
+        clear_in_memory_store()
+        print(f"[INDEX] Switched from {previous['collection']} to {generation['collection']} ({EMBED_MODEL_NAME}, {CHUNKER_MODE})")
+    if not _generation_pinned and settings != CONFIGURED_INDEX_SETTINGS:
+        print(f"[INDEX] Configured settings {CONFIGURED_INDEX_SETTINGS} differ from the active index "
+              f"generation {settings}; run `manage.py rebuild_index` to apply them")
+
+
+def index_cache_dir(generation=None):
+    """Where a generation keeps its content manifests, conversation snapshots and ingestion journals."""
+    name = (generation or get_index_generation())["collection"]
+    if name == LEGACY_COLLECTION:
+        return cache_dir
+    path = os.path.join(cache_dir, "generations", name)
+    os.makedirs(os.path.join(path, "contents"), exist_ok=True)
+    return path
+
+
+def retire_index_generation(generation):
+    """Drop a generation that is no longer active: its collection and its cached state."""
+    import glob
+    import shutil
+    try:
+        get_chroma_client().delete_collection(generation["collection"])
+    except Exception as e:
+        print(f"[INDEX] Could not drop collection {generation['collection']}: {e}")
+    if generation["collection"] == LEGACY_COLLECTION:
+        paths = glob.glob(os.path.join(contents_dir, "*.json")) + glob.glob(os.path.join(cache_dir, "conv_*.npz"))
+        paths += glob.glob(os.path.join(cache_dir, "ingestion_journal.sqlite3*"))
+        paths += glob.glob(os.path.join(cache_dir, "lexical_index.sqlite3*"))
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    else:
+        shutil.rmtree(os.path.join(cache_dir, "generations", generation["collection"]), ignore_errors=True)
+    print(f"[INDEX] Retired generation {generation['collection']}")
+
+
+def list_indexed_documents(collection, page_size=5000):
+    """
+    Every document stored in a collection, read page_size metadata records at a time:
+    a list of {"filename", "scope", "content_hash", "chunks"}. Content-addressed documents
+    are listed once per hash, under the filename they were ingested as.
+    """
+    documents = {}
+    offset = 0
+    while True:
+        metadatas = collection.get(include=['metadatas'], limit=page_size, offset=offset)['metadatas'] or []
+        for metadata in metadatas:
+            content_hash = metadata.get("content_hash")
+            key = content_hash or (metadata.get("source_pdf"), metadata.get("conversation_id"))
+            if key not in documents:
+                documents[key] = {"filename": metadata.get("source_pdf"), "scope": metadata.get("conversation_id"),
+                                  "content_hash": content_hash, "chunks": 0}
+            documents[key]["chunks"] += 1
+        if len(metadatas) < page_size:
+            break
+        offset += page_size
+    return list(documents.values())
+
+
 def chunk_text(text, chunk_size=800, overlap=50):
     """
     Improved chunking using spaCy sentence segmentation to better capture semantic units.
-    Chunks are created by grouping sentences until chunk_size tokens are reached, with overlap.
-    """
-    nlp_engine = get_nlp()
-    doc = nlp_engine(text)
-    sentences = [sent.text.strip() for sent in doc.sents]
-    chunks = []
-    current_chunk = []
-    current_length = 0
-
-    for sentence in sentences:
-        sentence_length = len(sentence.split())
-        if current_length + sentence_length > chunk_size:
-            chunks.append(" ".join(current_chunk))
-            # overlap: keep last few sentences for next chunk
-            overlap_sentences = current_chunk[-(overlap // 20):] if overlap > 0 else []
-            current_chunk = overlap_sentences.copy()
-            current_length = sum(len(s.split()) for s in current_chunk)
-        current_chunk.append(sentence)
-        current_length += sentence_length;
+    Chunks are created by grouping sentences until the configured budget (model tokens,
+    or chunk_size words) is reached, with overlap.
+    """
+    chunker = get_chunker()
+    if chunk_size == chunker.chunk_size and overlap == chunker.overlap:
+        return chunker.chunk(text)
+    return SentenceChunker(chunker.mode, chunk_size, overlap, budget="words").group(
+        sent.text.strip() for sent in chunker.nlp(text).sents
+    )
+
+
+def _pdf_stats_path(file_path):
+    return os.path.join(stats_dir, f"{os.path.basename(file_path)}.json")
+
+
+def save_pdf_stats(file_path, parsed):
+    """Persist page/word counts from parse_pdf() next to the embeddings cache."""
+    try:
+        stat = os.stat(file_path)
+        stats = {
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "page_count": parsed["page_count"],
+            "total_words": parsed["total_words"],
+            "page_word_counts": parsed["page_word_counts"],
+            "boilerplate": parsed.get("boilerplate"),
+        }
+        path = _pdf_stats_path(file_path)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(stats, f)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"[STATS] Failed to save stats for {file_path}: {e}")
+
+
+def get_pdf_stats(file_path):
+    """Return stored stats for a PDF, or None if missing or the file changed since they were recorded."""
+    try:
+        with open(_pdf_stats_path(file_path), 'r', encoding='utf-8') as f:
+            stats = json.load(f)
+        stat = os.stat(file_path)
+        if stats.get("size") != stat.st_size or stats.get("mtime") != stat.st_mtime:
+            return None
+        return stats
+    except (OSError, ValueError):
+        return None
+
+
+def get_pdf_page_count(file_path):
+    """Page count from stored stats, falling back to opening the PDF without extracting text."""
+    stats = get_pdf_stats(file_path)
+    if stats:
+        return stats["page_count"]
+    try:
+        import fitz
+        with fitz.open(file_path) as doc:
+            return doc.page_count
+    except Exception:
+        return None
 
-    if current_chunk:
-        chunks.append(" ".join(current_chunk))
-    return chunks
 
 def analyze_pdf(file_path):
+    stats = get_pdf_stats(file_path)
+    if stats:
+        return stats["page_count"], stats["total_words"]
     try:
-        import pdfplumber
-        with pdfplumber.open(file_path) as pdf:
-            num_pages = len(pdf.pages)
-            total_words = 0
-            for page in pdf.pages:
-                text = page.extract_text() or ""
-                total_words += len(text.split())
-            return num_pages, total_words
+        parsed = parse_pdf(file_path)
+        save_pdf_stats(file_path, parsed)
+        return parsed["page_count"], parsed["total_words"]
     except Exception as e:
         print(f"Error processing {file_path}: {e}")
         return 0, 0
 
-def process_pdf(file_path, filename, conversation_id: str | None = None):
-    insight_time = embedding_time = store_time = 0.0
+# Size limit of the persistent embedding cache (0 disables it)
+EMBED_CACHE_MB = float(os.environ.get("RAG_EMBED_CACHE_MB", "512"))
+
+
+class EmbeddingCache:
+    """
+    Persistent, content-addressed cache of embeddings in embeddings_cache/embeddings.sqlite3.
+    Keys are sha256(model name + the exact text encoded), vectors are stored as raw float32 bytes,
+    and least-recently-used rows are evicted once the cache grows past max_bytes. SQLite
+    (WAL mode) lets the web process, ingest workers and management commands share it.
+    """
+
+    def __init__(self, path=None, model_name=None, max_bytes=None):
+        import sqlite3
+        import threading
+        self.path = path or os.path.join(cache_dir, "embeddings.sqlite3")
+        self.model_name = model_name or EMBED_MODEL_NAME
+        self.max_bytes = int(EMBED_CACHE_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    def key(self, text):
+        # The text as encode() sees it: a tokenizer that keeps whitespace embeds variants differently
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode('utf-8')).hexdigest()
+
+    def get_many(self, keys):
+        """{key: float32 vector} for the keys present in the cache; refreshes their LRU position."""
+        import numpy as np
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique), 500):  # stay under SQLite's bound-parameter limit
+                batch = unique[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+                self._conn.commit()
+        hits = sum(1 for key in keys if key in found)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, items):
+        """Store (key, vector) pairs, then evict the least recently used rows if over max_bytes."""
+        import numpy as np
+        now = time.time()
+        rows = [(key, np.asarray(vector, dtype=np.float32).tobytes(), now) for key, vector in items]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows)
+            self._conn.commit()
+            if rows:
+                self._evict(len(rows[0][1]) + 64 + 8)
+
+    def _evict(self, row_bytes):
+        max_rows = self.max_bytes // row_bytes
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count <= max_rows:
+            return
+        # Evict down to 90% so eviction doesn't run on every insert once the cache is full
+        excess = count - int(max_rows * 0.9)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,)
+        )
+        self._conn.commit()
+        self.evictions += excess
+        print(f"[EMBED CACHE] Evicted {excess} least recently used embeddings")
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+_embedding_cache = None
+
+
+def get_embedding_cache():
+    """Process-wide EmbeddingCache, or None when RAG_EMBED_CACHE_MB is 0."""
+    global _embedding_cache
+    if _embedding_cache is None and EMBED_CACHE_MB > 0:
+        _embedding_cache = EmbeddingCache()
+    return _embedding_cache
+
+
+# BM25 score that maps to a lexical score of 0.5; retrieved chunks are ranked by cosine
+# similarity plus bm25 / (bm25 + RAG_LEXICAL_SCORE_HALF), which lies in [0, 1)
+LEXICAL_SCORE_HALF = float(os.environ.get("RAG_LEXICAL_SCORE_HALF", "5"))
+# Chunk metadata the lexical index keeps next to each text, for where clauses
+_LEXICAL_FIELDS = ("type", "source_pdf", "conversation_id", "content_hash")
+
+
+def _lexical_terms(query):
+    return list(dict.fromkeys(re.findall(r"\w+", query.lower())))
+
+
+def _lexical_match(query, terms=None):
+    """FTS5 query matching chunks that contain any of the query's words (or these terms), or None if there are none."""
+    return " OR ".join(f'"{term}"' for term in (_lexical_terms(query) if terms is None else terms)) or None
+
+
+def _lexical_where_sql(where):
+    """(SQL condition on the chunks table, parameters) for a ChromaDB-style where clause."""
+    for operator, joiner in (("$and", " AND "), ("$or", " OR ")):
+        if operator in where:
+            parts = [_lexical_where_sql(clause) for clause in where[operator]]
+            return "(" + joiner.join(sql for sql, _ in parts) + ")", [value for _, values in parts for value in values]
+    (field, condition), = where.items()
+    if field not in _LEXICAL_FIELDS:
+        raise ValueError(f"The lexical index has no {field!r} field")
+    if not isinstance(condition, dict):
+        return f"{field} = ?", [condition]
+    (operator, value), = condition.items()
+    if operator == "$in":
+        return f"{field} IN ({','.join('?' * len(value))})", list(value)
+    if operator in ("$eq", "$ne"):
+        return f"{field} {'IS' if operator == '$eq' else 'IS NOT'} ?", [value]
+    raise ValueError(f"The lexical index doesn't support {operator}")
+
+
+class LexicalIndex:
+    """
+    Persistent BM25 index of the stored chunks in lexical_index.sqlite3 (per index generation):
+    an SQLite FTS5 table of chunk texts (porter-stemmed) plus a table of their ChromaDB ids
+    and scope fields. ChromaBatchWriter and document deletions keep it in step with the
+    collection, so lexical scores use the statistics of the whole corpus and a query costs
+    one FTS5 lookup. `manage.py build_lexical_index` fills it from ChromaDB, e.g. for chunks
+    stored before it existed. Write errors are logged rather than raised: ChromaDB stays the
+    source of truth.
+    """
+
+    def __init__(self, path=None):
+        import sqlite3
+        import threading
+        self.path = path or os.path.join(index_cache_dir(), "lexical_index.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, chunk_id TEXT UNIQUE NOT NULL, "
+            "type TEXT, source_pdf TEXT, conversation_id TEXT, content_hash TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_document ON chunks (source_pdf, conversation_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_content_hash ON chunks (content_hash)")
+        self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunk_text USING fts5(text, tokenize='porter unicode61')")
+        # Per-connection views for search(): document frequencies of the indexed terms, and a
+        # scratch table that runs query words through the same tokenizer to get their stems
+        self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS temp.chunk_terms USING fts5vocab(main, chunk_text, row)")
+        self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS temp.query_text USING fts5(text, tokenize='porter unicode61')")
+        self._conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS temp.query_terms USING fts5vocab(temp, query_text, instance)")
+        self._conn.commit()
+
+    def _delete(self, condition, params):
+        self._conn.execute(f"DELETE FROM chunk_text WHERE rowid IN (SELECT id FROM chunks WHERE {condition})", params)
+        self._conn.execute(f"DELETE FROM chunks WHERE {condition}", params)
+
+    def upsert(self, ids, documents, metadatas):
+        """Index (or re-index) chunks as written to ChromaDB."""
+        try:
+            with self._lock:
+                for start in range(0, len(ids), 500):  # stay under SQLite's bound-parameter limit
+                    batch = ids[start:start + 500]
+                    self._delete(f"chunk_id IN ({','.join('?' * len(batch))})", batch)
+                for chunk_id, text, metadata in zip(ids, documents, metadatas):
+                    row = self._conn.execute(
+                        "INSERT INTO chunks (chunk_id, type, source_pdf, conversation_id, content_hash) VALUES (?, ?, ?, ?, ?)",
+                        [chunk_id] + [(metadata or {}).get(field) for field in _LEXICAL_FIELDS]
+                    ).lastrowid
+                    self._conn.execute("INSERT INTO chunk_text (rowid, text) VALUES (?, ?)", (row, text or ""))
+                self._conn.commit()
+        except Exception as e:
+            self._conn.rollback()
+            print(f"[LEXICAL] Could not index {len(ids)} chunks: {e}")
+
+    def delete(self, ids=None, where=None):
+        """Drop chunks by id, or those matching a ChromaDB-style where clause (as passed to collection.delete)."""
+        try:
+            with self._lock:
+                if ids is not None:
+                    for start in range(0, len(ids), 500):
+                        batch = list(ids[start:start + 500])
+                        self._delete(f"chunk_id IN ({','.join('?' * len(batch))})", batch)
+                else:
+                    self._delete(*_lexical_where_sql(where))
+                self._conn.commit()
+        except Exception as e:
+            self._conn.rollback()
+            print(f"[LEXICAL] Could not delete chunks ({ids if ids is not None else where}): {e}")
+
+    def scores(self, query, chunk_ids):
+        """
+        BM25 scores of these chunks for the query (higher is better): returns
+        ({chunk_id: score} of the chunks containing a query word, set of the ids indexed at all).
+        """
+        match = _lexical_match(query)
+        scores = {}
+        with self._lock:
+            known = self._rows(chunk_ids)
+            rows = list(known)
+            for start in range(0, len(rows) if match else 0, 500):
+                batch = rows[start:start + 500]
+                scores.update(
+                    (known[row], -rank) for row, rank in self._conn.execute(
+                        f"SELECT rowid, bm25(chunk_text) FROM chunk_text WHERE chunk_text MATCH ? "
+                        f"AND rowid IN ({','.join('?' * len(batch))})", [match] + batch
+                    )
+                )
+        return scores, set(known.values())
+
+    def _selective_terms(self, terms):
+        """
+        The terms whose stems are in some but at most half of the chunks. FTS5's bm25 gives
+        commoner terms an IDF of ~0, yet matching them makes it score most of the corpus.
+        """
+        self._conn.executemany("INSERT INTO temp.query_text (rowid, text) VALUES (?, ?)", enumerate(terms))
+        try:
+            total = self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+            selective = {position for position, frequency in self._conn.execute(
+                "SELECT query_terms.doc, chunk_terms.doc FROM temp.query_terms "
+                "LEFT JOIN temp.chunk_terms ON chunk_terms.term = query_terms.term"
+            ) if frequency and 2 * frequency < total}
+        finally:
+            self._conn.execute("DELETE FROM temp.query_text")
+        return [term for position, term in enumerate(terms) if position in selective]
+
+    def search(self, query, top_k, where=None):
+        """
+        [(chunk_id, BM25 score)] of the top_k chunks containing query words (within a where
+        clause), best first. Words found in more than half of the chunks are left out.
+        """
+        if top_k <= 0:
+            return []
+        condition, params = _lexical_where_sql(where) if where else ("1", [])
+        with self._lock:
+            match = _lexical_match(query, self._selective_terms(_lexical_terms(query)))
+            if match is None:
+                return []
+            rows = self._conn.execute(
+                f"SELECT chunks.chunk_id, bm25(chunk_text) FROM chunk_text JOIN chunks ON chunks.id = chunk_text.rowid "
+                f"WHERE chunk_text MATCH ? AND {condition} ORDER BY bm25(chunk_text) LIMIT ?", [match] + params + [top_k]
+            ).fetchall()
+        return [(chunk_id, -rank) for chunk_id, rank in rows]
+
+    def _rows(self, chunk_ids):
+        """{row: chunk_id} of the chunk_ids that are indexed."""
+        known = {}
+        unique = list(dict.fromkeys(chunk_ids))
+        for start in range(0, len(unique), 500):
+            batch = unique[start:start + 500]
+            known.update(self._conn.execute(
+                f"SELECT id, chunk_id FROM chunks WHERE chunk_id IN ({','.join('?' * len(batch))})", batch
+            ).fetchall())
+        return known
+
+    def indexed(self, chunk_ids):
+        """The chunk_ids that are indexed."""
+        with self._lock:
+            return set(self._rows(chunk_ids).values())
+
+    def chunk_ids(self):
+        with self._lock:
+            return {chunk_id for chunk_id, in self._conn.execute("SELECT chunk_id FROM chunks")}
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunk_text")
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.commit()
+
+
+_lexical_index = None
+_lexical_index_unavailable = False
+
+
+def get_lexical_index():
+    """Process-wide LexicalIndex of the active index generation, or None if SQLite has no FTS5."""
+    global _lexical_index, _lexical_index_unavailable
+    if _lexical_index is None and not _lexical_index_unavailable:
+        try:
+            _lexical_index = LexicalIndex()
+        except Exception as e:
+            _lexical_index_unavailable = True
+            print(f"[LEXICAL] Lexical index unavailable, falling back to per-query TF-IDF: {e}")
+    return _lexical_index
+
+
+def embed_texts(texts, batch_size=None):
+    """
+    Encode texts in length-sorted batches so each batch holds chunks of similar size
+    (less padding per forward pass). Returns embeddings in the original input order.
+    Texts already in the embedding cache are not re-encoded.
+    """
+    if not texts:
+        return []
+    import numpy as np
+    cache = get_embedding_cache()
+    keys = [cache.key(text) for text in texts] if cache else None
+    cached = cache.get_many(keys) if cache else {}
+    missing = [i for i in range(len(texts)) if not cache or keys[i] not in cached]
+
+    encoded = None
+    if missing:
+        batch_size = batch_size or EMBED_BATCH_SIZE
+        order = sorted(missing, key=lambda i: len(texts[i]), reverse=True)
+        embedding_model = get_model()
+        encoded = embedding_model.encode([texts[i] for i in order], batch_size=batch_size, convert_to_numpy=True)
+        if cache:
+            cache.put_many((keys[i], embedding) for i, embedding in zip(order, encoded))
+    if not cached:
+        embeddings = np.empty_like(encoded)
+        embeddings[order] = encoded
+        return embeddings
+
+    dimension = len(next(iter(cached.values())))
+    embeddings = np.empty((len(texts), dimension), dtype=np.float32)
+    for i, key in enumerate(keys):
+        if key in cached:
+            embeddings[i] = cached[key]
+    if encoded is not None:
+        embeddings[order] = encoded
+    return embeddings
+
+
+# -------- Near-duplicate chunks -------- #
+
+# Chunks whose SimHash is within this many bits of an earlier chunk of the same document
+# are not embedded; the earlier chunk's vector cites their pages instead. Off by default
+# (-1): a collapsed chunk's own text is dropped, and with it whatever set it apart, such
+# as amounts, dates or clause numbers. 3 suits documents that repeat template text.
+NEAR_DUP_MAX_DISTANCE = int(os.environ.get("RAG_NEAR_DUP_DISTANCE", "-1"))
+# Chunks shorter than this many words are only collapsed when their signatures are identical
+NEAR_DUP_MIN_WORDS = 8
+# Signatures remembered per document, so the index stays bounded on very long PDFs
+NEAR_DUP_MAX_SIGNATURES = 200000
+
+
+def simhash(text):
+    """64-bit SimHash of a chunk over lower-cased word 3-shingles."""
+    import numpy as np
+    words = re.findall(r'\w+', text.lower())
+    shingles = {" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+    digests = b"".join(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest() for shingle in shingles)
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8)).reshape(-1, 64)
+    weights = 2 * bits.sum(axis=0, dtype=np.int64) - len(shingles)
+    return int.from_bytes(np.packbits(weights > 0).tobytes(), 'big'), len(words)
+
+
+class NearDuplicateIndex:
+    """
+    SimHash signatures of the chunks stored for one document, bucketed by LSH bands.
+    The 64 bits are split into max_distance + 1 bands, so any two signatures within
+    max_distance bits agree on at least one band and only chunks sharing a band value
+    are compared. Buckets are fixed-size head tables with chains in flat arrays, so
+    each indexed chunk costs a few dozen bytes however long the document gets.
+    """
+
+    TABLE_BITS = 16
+
+    def __init__(self, max_distance=None, max_signatures=NEAR_DUP_MAX_SIGNATURES):
+        from array import array
+        self.max_distance = NEAR_DUP_MAX_DISTANCE if max_distance is None else max_distance
+        self.bands = self.max_distance + 1
+        self.band_bits = -(-64 // self.bands)
+        self.heads = [array('i', [-1]) * (1 << self.TABLE_BITS) for _ in range(self.bands)]
+        self.chains = [array('i') for _ in range(self.bands)]  # entry -> previous entry in the same bucket
+        self.signatures = array('Q')
+        self.pages = array('i')
+        self.page_chunks = array('i')
+        self.max_signatures = max_signatures
+
+    @property
+    def size(self):
+        return len(self.signatures)
+
+    def _slots(self, signature):
+        band_mask, table_mask = (1 << self.band_bits) - 1, (1 << self.TABLE_BITS) - 1
+        slots = []
+        for band in range(self.bands):
+            value = (signature >> (band * self.band_bits)) & band_mask
+            slots.append((value ^ (value >> self.TABLE_BITS) * 0x9E3779B1) & table_mask)
+        return slots
+
+    def match(self, text, page_no, page_chunk_index, add=True):
+        """
+        (page_no, page_chunk_index) of an indexed near-duplicate of text, or None. With
+        add=True a chunk that doesn't match is indexed under its own page and position.
+        """
+        signature, words = simhash(text)
+        allowed = self.max_distance if words >= NEAR_DUP_MIN_WORDS else 0
+        slots = self._slots(signature)
+        for band, slot in enumerate(slots):
+            entry = self.heads[band][slot]
+            while entry >= 0:
+                if bin(signature ^ self.signatures[entry]).count("1") <= allowed:
+                    return self.pages[entry], self.page_chunks[entry]
+                entry = self.chains[band][entry]
+        if add and self.size < self.max_signatures:
+            entry = self.size
+            self.signatures.append(signature)
+            self.pages.append(page_no)
+            self.page_chunks.append(page_chunk_index)
+            for band, slot in enumerate(slots):
+                self.chains[band].append(self.heads[band][slot])
+                self.heads[band][slot] = entry
+        return None
+
+
+def _format_pages(pages):
+    return ",".join(str(page) for page in sorted(pages))
+
+
+def chunk_pages_cited(chunk):
+    """Page numbers a retrieved chunk stands for: its own page plus pages of collapsed near-duplicates."""
+    metadata = chunk.get('metadata') or {}
+    duplicates = chunk.get('duplicate_pages') or metadata.get('duplicate_pages') or ""
+    pages = [chunk.get('page_no', chunk.get('page_number', 1))]
+    pages += [int(page) for page in str(duplicates).split(",") if page.strip().isdigit()]
+    return pages
+
+
+def _store_chunk(store_writer, filename, conversation_id, page_no, page_chunk_index, chunk_index, chunk, embedding,
+                 keep_in_memory=True, content_hash=None, page_hash=None, duplicate_pages=None):
+    scope = conversation_id if conversation_id else "global"
+    doc_id = _chunk_doc_id(filename, page_no, page_chunk_index, conversation_id, content_hash)
+    metadata = {
+        "id": doc_id,
+        "type": "pdf_chunk",
+        "source_pdf": filename,
+        "chunk_index": chunk_index,
+        "page_no": page_no,
+        "page_chunk_index": page_chunk_index,
+        "conversation_id": scope,
+    }
+    if page_hash:
+        metadata["page_hash"] = page_hash
+    # Near-duplicates on these pages were collapsed into this chunk. upsert() merges
+    # metadata, so None is written explicitly to clear references from an earlier ingestion
+    metadata["duplicate_pages"] = _format_pages(duplicate_pages) if duplicate_pages else None
+    if content_hash:
+        # Shared by every upload of these bytes; conversations reference it by hash
+        metadata = dict(metadata, content_hash=content_hash, conversation_id="shared")
+    # Buffered; flushed to ChromaDB every UPSERT_BATCH_SIZE chunks
+    store_writer.add(doc_id, chunk, embedding, metadata)
+    if not keep_in_memory:
+        return doc_id
+
+    # Also store in memory for backward compatibility with full metadata
+    _add_in_memory_chunk(chunk, dict(metadata, conversation_id=scope), embedding)
+    return doc_id
+
+
+def stored_page_fingerprints(selector):
+    """
+    Page fingerprints recorded at ingestion for a stored document: {page_no: page_hash}.
+    Pages whose chunks lack a fingerprint (ingested before fingerprints existed) or
+    disagree are left out, so they are treated as changed. So are pages with chunks
+    collapsed into another page's vector, which are matched again on every ingestion.
+    """
+    results = get_chroma_collection().get(where=selector, include=['metadatas'])
+    fingerprints = {}
+    unreliable = set()
+    for metadata in results.get('metadatas') or []:
+        page_no = metadata.get('page_no')
+        page_hash = metadata.get('page_hash')
+        if not page_hash or fingerprints.get(page_no, page_hash) != page_hash:
+            unreliable.add(page_no)
+        else:
+            fingerprints[page_no] = page_hash
+        unreliable.update(chunk_pages_cited(metadata)[1:])
+    for page_no in unreliable:
+        fingerprints.pop(page_no, None)
+    return fingerprints
+
+
+# -------- Content-addressed documents -------- #
+
+def hash_file(file_path, block_size=1024 * 1024):
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def content_file_path(content_hash):
+    """Where the uploaded bytes with this SHA-256 are kept for ingestion."""
+    return os.path.join(content_files_dir, f"{content_hash}.pdf")
+
+
+def _content_manifest_path(content_hash):
+    # Per index generation: a hash ingested into one collection still has to be embedded into the next
+    generation_dir = index_cache_dir()
+    directory = contents_dir if generation_dir == cache_dir else os.path.join(generation_dir, "contents")
+    return os.path.join(directory, f"{content_hash}.json")
+
+
+def get_content_manifest(content_hash):
+    """Manifest written once a content hash is fully ingested, or None if it isn't."""
+    if not content_hash:
+        return None
+    try:
+        with open(_content_manifest_path(content_hash), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _save_content_manifest(content_hash, manifest):
+    path = _content_manifest_path(content_hash)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def _load_store_results(results, filename, scope):
+    remove_in_memory_document(filename, scope)
+    documents = results.get('documents') or []
+    embeddings = results.get('embeddings')
+    metadatas = results.get('metadatas') or []
+    if embeddings is None:
+        embeddings = []
+    for doc, embedding, metadata in zip(documents, embeddings, metadatas):
+        _add_in_memory_chunk(doc, dict(metadata, source_pdf=filename, conversation_id=scope), embedding)
+    return len(documents)
+
+
+def attach_content(content_hash, filename, conversation_id=None, write_cache=True):
+    """
+    Load already-ingested chunks for content_hash from ChromaDB into memory under this
+    upload's filename and conversation, without parsing or embedding anything.
+    Returns the number of chunks attached.
+    """
+    results = get_chroma_collection().get(
+        where={"content_hash": content_hash},
+        include=['documents', 'embeddings', 'metadatas']
+    )
+    scope = str(conversation_id) if conversation_id else "global"
+    count = _load_store_results(results, filename, scope)
+    print(f"[DEDUP] Attached {count} stored chunks for {filename} ({content_hash[:12]})")
+    if conversation_id and write_cache:
+        _write_conversation_cache(scope)
+    return count
+
+
+def load_document_from_store(filename, conversation_id=None):
+    """Load one document's chunks (per-conversation, not content-addressed) from ChromaDB into memory."""
+    scope = str(conversation_id) if conversation_id else "global"
+    results = get_chroma_collection().get(
+        where={"$and": [{"source_pdf": filename}, {"conversation_id": scope}]},
+        include=['documents', 'embeddings', 'metadatas']
+    )
+    count = _load_store_results(results, filename, scope)
+    print(f"[MEMORY] Loaded {count} stored chunks for {filename} ({scope})")
+    return count
+
+
+def count_stored_chunks(filename, conversation_id=None):
+    """Number of chunks ChromaDB holds for a filename/conversation-scoped document."""
+    scope = str(conversation_id) if conversation_id else "global"
+    return len(get_chroma_collection().get(where=_document_selector(filename, scope), include=[])['ids'])
+
+
+def remove_document(filename, conversation_id=None, file_path=None):
+    """Delete a filename/conversation-scoped document's vectors, in-memory chunks and stored page stats."""
+    scope = str(conversation_id) if conversation_id else "global"
+    get_chroma_collection().delete(where=_document_selector(filename, scope))
+    if get_lexical_index() is not None:
+        get_lexical_index().delete(where=_document_selector(filename, scope))
+    remove_in_memory_document(filename, scope)
+    try:
+        os.remove(_pdf_stats_path(file_path or filename))
+    except OSError:
+        pass
+    print(f"[STORE] Removed {filename} ({scope}) from the index")
+
+
+def load_document_pages(filename, conversation_id=None, first_page=1, last_page=None, content_hash=None):
+    """
+    Load pages first_page..last_page of a document that is still being ingested from
+    ChromaDB into memory, so its indexed pages can be queried before ingestion ends.
+    Loading from page 1 replaces whatever was in memory for the document.
+    Returns the number of chunks loaded.
+    """
+    scope = str(conversation_id) if conversation_id else "global"
+    where = {"content_hash": content_hash} if content_hash else _document_selector(filename, scope)
+    where = _and_where(where, {"page_no": {"$gte": first_page}})
+    if last_page is not None:
+        where = _and_where(where, {"page_no": {"$lte": last_page}})
+    results = get_chroma_collection().get(where=where, include=['documents', 'embeddings', 'metadatas'])
+    if first_page <= 1:
+        remove_in_memory_document(filename, scope)
+    documents = results.get('documents') or []
+    embeddings = results.get('embeddings')
+    if embeddings is None:
+        embeddings = []
+    for doc, embedding, metadata in zip(documents, embeddings, results.get('metadatas') or []):
+        _add_in_memory_chunk(doc, dict(metadata, source_pdf=filename, conversation_id=scope), embedding)
+    print(f"[MEMORY] Loaded pages {first_page}-{last_page or 'end'} of {filename} ({len(documents)} chunks)")
+    return len(documents)
+
+
+def chunk_pdf(file_path):
+    """
+    Parse and chunk a PDF without embedding it. Returns the parse_pdf() result (minus
+    page text) and a list of (page_no, page_chunk_index, chunk_index, chunk_text, page_hash,
+    duplicate_pages) records, with near-duplicate chunks already collapsed into the
+    duplicate_pages of the record they match. Used by the parallel preprocess_pdfs mode,
+    where this runs in worker processes.
+    """
+    parsed = parse_pdf(file_path)
+    pages = parsed.pop("pages")
+    records = []
+    near_dups = NearDuplicateIndex() if NEAR_DUP_MAX_DISTANCE >= 0 else None
+    references = defaultdict(set)  # (page_no, page_chunk_index) -> pages of collapsed near-duplicates
+    # Already inside a pool worker: segment in-process
+    page_chunks = get_chunker().chunk_many((page_info["text"] for page_info in pages), n_process=1)
+    for page_info, chunks in zip(pages, page_chunks):
+        page_no = page_info["page_no"]
+        for page_chunk_index, chunk in enumerate(chunks):
+            if near_dups is not None:
+                canonical = near_dups.match(chunk, page_no, page_chunk_index)
+                if canonical:
+                    if canonical[0] != page_no:
+                        references[canonical].add(page_no)
+                    continue
+            records.append((page_no, page_chunk_index, len(records), chunk, page_fingerprint(page_info["page_hash"])))
+    return parsed, [record + (tuple(sorted(references.get(record[:2], ()))),) for record in records]
+
+
+def delete_content(content_hash):
+    """Drop the stored vectors, manifest and uploaded file of a content hash nothing references any more."""
+    get_chroma_collection().delete(where={"content_hash": content_hash})
+    if get_lexical_index() is not None:
+        get_lexical_index().delete(where={"content_hash": content_hash})
+    for path in (_content_manifest_path(content_hash), content_file_path(content_hash)):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    print(f"[DEDUP] Deleted unreferenced content {content_hash[:12]}")
+
+
+def process_pdf(file_path, filename, conversation_id: str | None = None, progress_callback=None, raise_errors=False,
+                content_hash=None, previous_content_hash=None, keep_in_memory=True, max_pages=None):
+    """
+    Parse, chunk, embed and store one PDF. Returns None on success or the filename on
+    failure; with raise_errors=True the exception is re-raised after it has been logged.
+
+    Vectors are committed to ChromaDB in page order: after the first
+    PROGRESSIVE_FIRST_PAGES pages and then every PROGRESSIVE_COMMIT_PAGES pages, with
+    progress_callback(pages_indexed, pages_total) called at each commit, so pages
+    1..pages_indexed are queryable while the rest is still being ingested. max_pages
+    stops after that many pages; a later full run resumes from the stored pages
+    instead of re-embedding them.
+
+    Pages stream through reader -> cleaner -> chunker (in a background thread, behind a
+    bounded queue) -> batch embedder -> store writer, so peak memory depends on the
+    queue and batch sizes rather than on the length of the document. keep_in_memory=False
+    skips the in-process retrieval copy (ingest_worker; the web process loads from the store).
+
+    With content_hash, vectors are stored once per hash; if that content was already
+    ingested (under any user, conversation or filename) it is attached instead of re-embedded.
+
+    When pages of this document are already in the store (same filename and scope or
+    content hash, e.g. from a partial run), or of a previous version of it
+    (previous_content_hash for content-addressed uploads), only pages whose fingerprint
+    changed are re-chunked and re-embedded; vectors of unchanged pages are reused.
+    """
+    manifest = get_content_manifest(content_hash)
+    if manifest:
+        print(f"[DEDUP] {filename} matches already-ingested content {content_hash[:12]}, skipping embedding")
+        attach_content(content_hash, filename, conversation_id)
+        if progress_callback:
+            progress_callback(manifest.get("page_count", 0), manifest.get("page_count", 0))
+        return None
+
+    embedding_time = store_time = 0.0
+    chunk_count = 0
     start_total = time.perf_counter()
     print(f"\n[PDF] [{datetime.datetime.now().strftime('%H:%M:%S')}] Starting: {filename}")
+    store_writer = ChromaBatchWriter()
+    scope = conversation_id if conversation_id else "global"
+    written_ids = set()
+    embed_cache = get_embedding_cache()
+    cache_before = (embed_cache.hits, embed_cache.misses) if embed_cache else (0, 0)
 
     try:
-        page_texts = extract_text_per_page(file_path)
-        num_pages, total_words = analyze_pdf(file_path)
-
-        # Single loop: Generate embeddings and store to ChromaDB
-        start_embed = time.perf_counter()
-        global_chunk_idx = 0
-        for page_info in page_texts:
-            page_chunks = chunk_text(page_info["text"])
-            embedding_model = get_model()
-            page_embeddings = embedding_model.encode(page_chunks)  # Generate embeddings once
-            
-            for idx, (chunk, embedding) in enumerate(zip(page_chunks, page_embeddings)):
-                doc_id = f"{filename}_{global_chunk_idx}"
-                metadata = {
-                    "id": doc_id,
-                    "type": "pdf_chunk",
-                    "source_pdf": filename,
-                    "chunk_index": global_chunk_idx,
-                    "page_no": page_info["page_no"],
-                    "conversation_id": conversation_id if conversation_id else "global",
-                }
-                # Store in ChromaDB
-                # Store in ChromaDB
-                get_chroma_collection().add(
-                    documents=[chunk],
-                    embeddings=[embedding.tolist()],
-                    metadatas=[metadata],
-                    ids=[doc_id]
+        # Pages already stored for this document (kept as they are) and pages of the
+        # version it replaces (copied under the new content hash), by fingerprint
+        own_selector = {"content_hash": content_hash} if content_hash else _document_selector(filename, scope)
+        stored_fingerprints = stored_page_fingerprints(own_selector)
+        previous_selector = None
+        if content_hash and previous_content_hash and previous_content_hash != content_hash:
+            previous_selector = {"content_hash": previous_content_hash}
+        previous_fingerprints = stored_page_fingerprints(previous_selector) if previous_selector else {}
+        if keep_in_memory:
+            remove_in_memory_document(filename, scope)
+
+        stream = PdfPageStream(file_path, max_pages)
+        num_pages = stream.page_count
+        partial = stream.pages_to_read < num_pages
+        next_commit = min(PROGRESSIVE_FIRST_PAGES, num_pages) if PROGRESSIVE_FIRST_PAGES > 0 else num_pages
+        chunker = get_chunker()
+        truncation = defaultdict(int)
+        pending = []  # (page_no, page_chunk_index, chunk_index, chunk_text, page_hash)
+        reused_pages = {"stored": [], "copy": []}
+        reused_total = changed_total = last_page = 0
+        near_dups = NearDuplicateIndex() if NEAR_DUP_MAX_DISTANCE >= 0 else None
+        references = defaultdict(set)  # canonical chunk id -> pages of near-duplicates collapsed into it
+        stale_references = set()  # already-written canonical ids whose duplicate_pages must be rewritten
+        collapsed_total = 0
+
+        def fingerprinted(pages):
+            for page_info in pages:
+                page_no, fingerprint = page_info["page_no"], page_fingerprint(page_info["page_hash"])
+                page_info["fingerprint"] = fingerprint
+                page_info["reused"] = (
+                    "stored" if stored_fingerprints.get(page_no) == fingerprint
+                    else "copy" if previous_fingerprints.get(page_no) == fingerprint
+                    else None
                 )
-                
-                # Also store in memory for backward compatibility with full metadata
-                chunk_id = f"chunk_{len(in_memory_chunks)}"
-                in_memory_chunks[chunk_id] = {
-                    'content': chunk,
-                    'chunk_text': chunk,
-                    'metadata': metadata,
-                    'source': metadata.get('source', 'Unknown'),
-                    'source_pdf': metadata.get('source_pdf', 'Unknown'),
-                    'page_no': metadata.get('page_no', 1),
-                    'page_number': metadata.get('page_no', 1),
-                    'chunk_id': metadata.get('id', chunk_id),
-                    'document_id': metadata.get('id', chunk_id)
-                }
-                in_memory_embeddings[chunk_id] = embedding.tolist()
-                in_memory_metadata.append(metadata)
-                global_chunk_idx += 1
-        
-        end_embed = time.perf_counter()
-        embedding_time = end_embed - start_embed
-        store_time = embedding_time  # Store time is same as embedding time now
+                yield page_info
+
+        def reuse_pending():
+            nonlocal chunk_count
+            for kind, pages in reused_pages.items():
+                if not pages:
+                    continue
+                copy = kind == "copy"
+                reused = get_chroma_collection().get(
+                    where=_and_where(previous_selector if copy else own_selector, {"page_no": {"$in": list(pages)}}),
+                    include=['documents', 'embeddings', 'metadatas'] if copy or keep_in_memory
+                    else ['documents', 'metadatas'] if near_dups is not None else ['metadatas']
+                )
+                reused_embeddings = reused.get('embeddings')
+                if reused_embeddings is None:
+                    reused_embeddings = [None] * len(reused['ids'])
+                documents = reused.get('documents') or [None] * len(reused['ids'])
+                for doc_id, doc, embedding, metadata in zip(reused['ids'], documents, reused_embeddings, reused['metadatas']):
+                    if copy:
+                        # New revision has a new hash: copy the vector under its id, no re-embedding
+                        doc_id = _store_chunk(
+                            store_writer, filename, conversation_id, metadata["page_no"], metadata.get("page_chunk_index", 0),
+                            metadata.get("chunk_index", 0), doc, embedding, keep_in_memory=keep_in_memory,
+                            content_hash=content_hash, page_hash=metadata.get("page_hash")
+                        )
+                        written_ids.add(doc_id)
+                    else:
+                        # Already stored under this document's ids: left untouched, only reloaded into memory
+                        written_ids.add(doc_id)
+                        if keep_in_memory:
+                            _add_in_memory_chunk(doc, dict(metadata, conversation_id=scope), embedding)
+                    page_key = (metadata["page_no"], metadata.get("page_chunk_index", 0))
+                    # Chunks stored under an older id scheme are pruned at the end, so they can't be canonical
+                    if near_dups is not None and doc and doc_id == _chunk_doc_id(filename, *page_key, conversation_id, content_hash):
+                        near_dups.match(doc, *page_key)
+                        cited = chunk_pages_cited(metadata)[1:]
+                        if cited:
+                            # Pages read in this run are matched again and re-added; keep the rest
+                            references[doc_id] = {page for page in cited if page > stream.pages_to_read}
+                            stale_references.add(doc_id)
+                    chunk_count += 1
+                pages.clear()
+
+        def commit():
+            """Store everything read so far, so pages 1..last_page become queryable."""
+            if reused_pages["stored"] or reused_pages["copy"]:
+                reuse_pending()
+            if pending:
+                embed_pending()
+            store_writer.flush()
+            if stale_references:
+                update_references()
+            if progress_callback:
+                progress_callback(last_page, num_pages)
+
+        def update_references():
+            """Rewrite duplicate_pages of canonical chunks that gained references after they were written."""
+            updates = {
+                doc_id: {"duplicate_pages": _format_pages(references[doc_id]) if references.get(doc_id) else None}
+                for doc_id in stale_references
+            }
+            store_writer.update_metadatas(updates)
+            if keep_in_memory:
+                in_memory_store.set_duplicate_pages(
+                    {doc_id: update["duplicate_pages"] for doc_id, update in updates.items()}, scope
+                )
+            stale_references.clear()
+
+        # Chunks from consecutive pages are pooled and embedded together once the
+        # window is full, instead of one tiny encode() call per page.
+        def embed_pending():
+            nonlocal embedding_time
+            if chunker.budget == "words" and TRUNCATION_STATS:
+                # Word-budget chunks overrun the model's sequence limit; record what it drops
+                for key, value in measure_truncation([record[3] for record in pending]).items():
+                    truncation[key] += value
+            start_embed = time.perf_counter()
+            embeddings = embed_texts([record[3] for record in pending])
+            embedding_time += time.perf_counter() - start_embed
+            for (page_no, page_chunk_index, chunk_index, chunk, page_hash), embedding in zip(pending, embeddings):
+                doc_id = _chunk_doc_id(filename, page_no, page_chunk_index, conversation_id, content_hash)
+                written_ids.add(_store_chunk(
+                    store_writer, filename, conversation_id, page_no, page_chunk_index, chunk_index, chunk, embedding,
+                    keep_in_memory=keep_in_memory, content_hash=content_hash, page_hash=page_hash,
+                    duplicate_pages=references.get(doc_id)
+                ))
+            pending.clear()
+
+        chunked_pages = chunker.chunk_pages(fingerprinted(stream), skip=lambda page_info: page_info["reused"])
+        for page_info, chunks in prefetch(chunked_pages):
+            last_page = page_info["page_no"]
+            if page_info["reused"]:
+                reused_total += 1
+                reused_pages[page_info["reused"]].append(last_page)
+                if len(reused_pages[page_info["reused"]]) >= REUSE_BATCH_PAGES:
+                    reuse_pending()
+            else:
+                changed_total += 1
+                if near_dups is not None and (reused_pages["stored"] or reused_pages["copy"]):
+                    reuse_pending()  # Index the chunks of unchanged pages before matching against them
+                for page_chunk_index, chunk in enumerate(chunks):
+                    if near_dups is not None:
+                        canonical = near_dups.match(chunk, last_page, page_chunk_index)
+                        if canonical:
+                            canonical_id, canonical_page = _chunk_doc_id(filename, *canonical, conversation_id, content_hash), canonical[0]
+                            if canonical_page != last_page:
+                                references[canonical_id].add(last_page)
+                                if canonical_id in written_ids:
+                                    stale_references.add(canonical_id)
+                            collapsed_total += 1
+                            continue
+                    pending.append((last_page, page_chunk_index, chunk_count, chunk, page_info["fingerprint"]))
+                    chunk_count += 1
+                if len(pending) >= EMBED_WINDOW:
+                    embed_pending()
+            if last_page >= next_commit:
+                commit()
+                next_commit = last_page + PROGRESSIVE_COMMIT_PAGES
+        last_page = stream.pages_to_read
+        commit()
+        if reused_total:
+            print(f"[INCREMENTAL] {filename}: reused {reused_total} stored pages, embedded {changed_total}")
+        if collapsed_total:
+            print(f"[NEAR DUP] {filename}: collapsed {collapsed_total} near-duplicate chunks into earlier vectors")
+
+        store_writer.close()
+        if partial:
+            # Stats, manifest and pruning wait for the run that reads the whole document
+            print(f"[PARTIAL] {filename}: indexed pages 1-{last_page} of {num_pages}")
+            total_words = sum(stream.page_word_counts)
+        else:
+            parsed = stream.stats()
+            total_words = parsed["total_words"]
+            save_pdf_stats(file_path, parsed)
+            if content_hash:
+                # Content-addressed vectors never go stale; record that this hash is complete
+                _save_content_manifest(content_hash, {
+                    "filename": filename,
+                    "page_count": num_pages,
+                    "total_words": total_words,
+                    "chunk_count": chunk_count,
+                })
+            else:
+                # Drop chunks of pages that changed shape or disappeared
+                store_writer.prune(_document_selector(filename, scope), written_ids)
+        store_time = store_writer.store_time
 
         total_time = time.perf_counter() - start_total
-
-        print(f"[OK] Finished {filename} | [EMBED] Embed: {embedding_time:.2f}s | [STORE] Store: {store_time:.2f}s | [TIME] Total: {total_time:.2f}s")
+        pages_per_s = num_pages / total_time if total_time > 0 else 0.0
+        chunks_per_s = chunk_count / total_time if total_time > 0 else 0.0
+
+        print(f"[OK] Finished {filename} | [EMBED] Embed: {embedding_time:.2f}s | [STORE] Store: {store_time:.2f}s ({store_writer.written} chunks, {store_writer.flushes} upserts) | [TIME] Total: {total_time:.2f}s")
+        print(f"[RATE] {filename}: {pages_per_s:.2f} pages/s, {chunks_per_s:.2f} chunks/s")
+        if embed_cache:
+            print(f"[EMBED CACHE] {filename}: {embed_cache.hits - cache_before[0]} hits, {embed_cache.misses - cache_before[1]} encoded")
+        boilerplate = stream.boilerplate_stats
+        if boilerplate["lines_removed"]:
+            print(f"[BOILERPLATE] {filename}: stripped {boilerplate['lines_removed']} lines matching {boilerplate['patterns']} repeated patterns, "
+                  f"{boilerplate['chars_removed']}/{boilerplate['chars_total']} chars ({100.0 * boilerplate['chars_removed'] / boilerplate['chars_total']:.1f}%)")
+        if truncation["tokens"]:
+            print(f"[TRUNCATION] {filename}: {truncation['truncated_chunks']}/{truncation['chunks']} chunks over the model limit, "
+                  f"{truncation['truncated_tokens']}/{truncation['tokens']} tokens ({100.0 * truncation['truncated_tokens'] / truncation['tokens']:.1f}%) never embedded")
 
         with open(log_file, mode='a', newline='', encoding='utf-8') as f:
             writer = csv.writer(f)
@@ -211,27 +2397,21 @@ def process_pdf(file_path, filename, conversation_id: str | None = None):
                 f"{embedding_time:.2f}",
                 f"{store_time:.2f}",
                 f"{total_time:.2f}",
-                "success",
-                ""
+                "partial" if partial else "success",
+                "",
+                chunk_count,
+                f"{pages_per_s:.2f}",
+                f"{chunks_per_s:.2f}"
             ])
 
         # Persist a cache for this conversation so we can reload instantly later
-        if conversation_id:
+        if conversation_id and keep_in_memory and not partial:
             _write_conversation_cache(conversation_id)
-        
-        # Mark document as ready in processing status
-        try:
-            from ragapp.views import processing_status
-            processing_status[filename] = {
-                'status': 'ready',
-                'timestamp': time.time()
-            }
-            print(f"[STATUS] Marked {filename} as ready")
-        except Exception as e:
-            print(f"[STATUS] Error updating status: {e}")
+
 
     except Exception as e:
         print(f"[ERROR] Error with {filename}: {e}")
+        store_time = store_writer.store_time
         with open(log_file, mode='a', newline='', encoding='utf-8') as f:
             writer = csv.writer(f)
             writer.writerow([
@@ -242,12 +2422,181 @@ def process_pdf(file_path, filename, conversation_id: str | None = None):
                 f"{store_time:.2f}",
                 f"{time.perf_counter() - start_total:.2f}",
                 "failed",
-                str(e)
+                str(e),
+                chunk_count,
+                "0.00",
+                "0.00"
             ])
+        if raise_errors:
+            raise
         return filename
 
     return None
 
+
+# -------- Bulk ingestion journal -------- #
+
+class IngestionJournal:
+    """
+    Durable record of bulk ingestion in ingestion_journal.sqlite3 (per index generation): one row
+    per PDF with its size/mtime when ingested, status (running, done, failed) and the
+    pages committed to ChromaDB so far. Every write is committed with synchronous=FULL,
+    so a run killed at any point leaves an accurate journal behind for the next one.
+    """
+
+    def __init__(self, path=None):
+        import sqlite3
+        self.path = path or os.path.join(index_cache_dir(), "ingestion_journal.sqlite3")
+        self._conn = sqlite3.connect(self.path, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents (filename TEXT PRIMARY KEY, size INTEGER, mtime REAL, "
+            "status TEXT NOT NULL, pages_committed INTEGER NOT NULL DEFAULT 0, page_count INTEGER, "
+            "chunk_count INTEGER, error TEXT, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, filename):
+        row = self._conn.execute(
+            "SELECT filename, size, mtime, status, pages_committed, page_count, chunk_count, error FROM documents WHERE filename = ?",
+            (filename,)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("filename", "size", "mtime", "status", "pages_committed", "page_count", "chunk_count", "error"), row))
+
+    def entries(self):
+        filenames = [row[0] for row in self._conn.execute("SELECT filename FROM documents ORDER BY filename")]
+        return [self.get(filename) for filename in filenames]
+
+    def start(self, filename, file_path):
+        """Record that filename is being ingested; keeps the committed page count of an interrupted run of the same file."""
+        stat = os.stat(file_path)
+        entry = self.get(filename)
+        same_file = (entry and entry["status"] == "running"
+                     and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime)
+        self._conn.execute(
+            "INSERT OR REPLACE INTO documents (filename, size, mtime, status, pages_committed, page_count, updated_at) "
+            "VALUES (?, ?, ?, 'running', ?, ?, ?)",
+            (filename, stat.st_size, stat.st_mtime, entry["pages_committed"] if same_file else 0,
+             entry["page_count"] if same_file else None, time.time())
+        )
+        self._conn.commit()
+        return entry["pages_committed"] if same_file else 0
+
+    def progress(self, filename, pages_committed, page_count):
+        self._conn.execute(
+            "UPDATE documents SET pages_committed = ?, page_count = ?, updated_at = ? WHERE filename = ?",
+            (pages_committed, page_count, time.time(), filename)
+        )
+        self._conn.commit()
+
+    def finish(self, filename, chunk_count):
+        self._conn.execute(
+            "UPDATE documents SET status = 'done', pages_committed = COALESCE(page_count, pages_committed), "
+            "chunk_count = ?, error = NULL, updated_at = ? WHERE filename = ?",
+            (chunk_count, time.time(), filename)
+        )
+        self._conn.commit()
+
+    def fail(self, filename, error):
+        self._conn.execute(
+            "UPDATE documents SET status = 'failed', error = ?, updated_at = ? WHERE filename = ?",
+            (str(error), time.time(), filename)
+        )
+        self._conn.commit()
+
+    def invalidate(self, filename):
+        self._conn.execute("UPDATE documents SET status = 'stale', updated_at = ? WHERE filename = ?", (time.time(), filename))
+        self._conn.commit()
+
+    def is_done(self, filename, file_path):
+        """True if filename was fully ingested and the file hasn't changed since."""
+        entry = self.get(filename)
+        if not entry or entry["status"] != "done":
+            return False
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return False
+        return entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime
+
+    def verify(self):
+        """
+        Check that every document journaled as done still has its vectors in ChromaDB
+        (e.g. after the store was restored from an older backup or wiped). Documents
+        whose stored chunk count no longer matches are marked stale so they are redone.
+        Returns the filenames invalidated.
+        """
+        invalid = []
+        for entry in self.entries():
+            if entry["status"] != "done":
+                continue
+            if not entry["chunk_count"]:
+                continue  # Nothing to find for a document without text
+            stored = count_stored_chunks(entry["filename"])
+            if stored != entry["chunk_count"]:
+                print(f"[JOURNAL] {entry['filename']}: journaled {entry['chunk_count']} chunks but the store has {stored}, redoing it")
+                self.invalidate(entry["filename"])
+                invalid.append(entry["filename"])
+        return invalid
+
+    def reset(self):
+        self._conn.execute("DELETE FROM documents")
+        self._conn.commit()
+
+    def prepare(self, force=False):
+        """Start of a bulk run: forget everything with force, otherwise verify what is journaled as done."""
+        if force:
+            self.reset()
+        else:
+            self.verify()
+
+    def close(self):
+        self._conn.close()
+
+
+def ingest_pdfs(file_paths, force=False, journal=None, on_start=None, keep_in_memory=True):
+    """
+    Ingest PDFs into the global scope through the ingestion journal, so a bulk run that is
+    killed part-way can simply be started again: documents journaled as done (and verified
+    to still be in the store) are skipped, and the document that was in flight resumes
+    after its last committed page, its stored pages being reused rather than re-embedded.
+    force=True clears the journal and re-ingests everything; a journal passed in is used
+    as is, the caller having already prepared it. on_start(index, filename) is called
+    before each document that is ingested.
+    Returns (processed filenames, skipped filenames, error messages).
+    """
+    if journal is None:
+        journal = IngestionJournal()
+        journal.prepare(force)
+    processed, skipped, errors = [], [], []
+    for index, file_path in enumerate(file_paths, 1):
+        filename = os.path.basename(file_path)
+        if journal.is_done(filename, file_path):
+            skipped.append(filename)
+            continue
+        if on_start:
+            on_start(index, filename)
+        resume_from = journal.start(filename, file_path)
+        if resume_from:
+            print(f"[JOURNAL] Resuming {filename} after page {resume_from}")
+        try:
+            process_pdf(
+                file_path, filename, None, raise_errors=True, keep_in_memory=keep_in_memory,
+                progress_callback=lambda pages, total, name=filename: journal.progress(name, pages, total)
+            )
+        except Exception as e:
+            journal.fail(filename, e)
+            errors.append(f"Failed to process {filename}: {e}")
+            continue
+        journal.finish(filename, count_stored_chunks(filename))
+        processed.append(filename)
+    if skipped:
+        print(f"[JOURNAL] Skipped {len(skipped)} documents already ingested")
+    return processed, skipped, errors
+
 # Retrieval functions
 
 def filter_chunks_by_document(chunks, pdf_filename):
@@ -262,11 +2611,24 @@ def filter_chunks_by_document(chunks, pdf_filename):
     if not pdf_filename:
         return chunks
     
+    def matches(source_pdf):
+        # Match exact filename or filename without extension
+        return source_pdf == pdf_filename or source_pdf.replace('.pdf', '') == pdf_filename.replace('.pdf', '')
+    
+    if isinstance(chunks, ChunkRows):
+        # The store's name index gives the document's rows directly; the result views the same rows
+        rows = chunks.store.name_rows(pdf_filename)
+        if chunks.positions is not None:
+            import numpy as np
+            rows = np.intersect1d(rows, chunks.positions)
+        filtered = chunks.subset(rows)
+        print(f"[FILTER] Filtered {len(filtered)} chunks from {pdf_filename} (out of {len(chunks)} total)")
+        return filtered
+    
     filtered = {}
     for chunk_id, chunk_data in chunks.items():
         source_pdf = chunk_data.get('source_pdf', chunk_data.get('source', ''))
-        # Match exact filename or filename without extension
-        if source_pdf == pdf_filename or source_pdf.replace('.pdf', '') == pdf_filename.replace('.pdf', ''):
+        if matches(source_pdf):
             filtered[chunk_id] = chunk_data
     
     print(f"[FILTER] Filtered {len(filtered)} chunks from {pdf_filename} (out of {len(chunks)} total)")
@@ -339,87 +2701,279 @@ def format_no_answer_response(pdf_context=None, reason="no_relevant_info"):
         "confidence_score": 0.0
     }
 
-def convert_query_to_embedding(query):
-    return model.encode(query)
-
-
 def _conversation_cache_path(conversation_id: str) -> str:
     safe_id = str(conversation_id)
-    return os.path.join(cache_dir, f"conv_{safe_id}.json")
+    return os.path.join(index_cache_dir(), f"conv_{safe_id}.npz")
 
 
 def _write_conversation_cache(conversation_id: str) -> None:
-    """Write all in-memory entries for a conversation to a JSON cache file."""
+    """
+    Snapshot a conversation's in-memory chunks: one float32 embedding matrix plus the
+    chunk texts and metadata as UTF-8 JSON, in a single .npz file.
+    """
     try:
+        import numpy as np
         cid = str(conversation_id)
-        items = []
-        for chunk_id, chunk in in_memory_chunks.items():
-            # Find corresponding embedding and metadata by index
-            chunk_index = int(chunk_id.split('_')[1]) if '_' in chunk_id else 0
-            if chunk_id in in_memory_embeddings and chunk_index < len(in_memory_metadata):
-                emb = in_memory_embeddings[chunk_id]
-                meta = in_memory_metadata[chunk_index]
-            if meta.get("conversation_id") == cid:
-                items.append({
-                    "chunk": chunk,
-                    "embedding": emb,
-                    "metadata": meta,
-                })
+        rows = in_memory_store.document_rows(scope=cid)
+        records = [
+            {"chunk": in_memory_store.text_of(position), "metadata": in_memory_store.metadata_of(position)}
+            for position in rows.tolist()
+        ]
         path = _conversation_cache_path(cid)
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump({"items": items}, f)
-        print(f"[CACHE] Wrote conversation cache: {path} ({len(items)} items)")
+        tmp_path = f"{path}.{os.getpid()}.tmp.npz"
+        np.savez(
+            tmp_path,
+            embeddings=in_memory_store.matrix[rows] * in_memory_store.norms[rows][:, None] if len(rows) else np.empty((0, 0), dtype=np.float32),
+            records=np.frombuffer(json.dumps(records).encode('utf-8'), dtype=np.uint8),
+        )
+        os.replace(tmp_path, path)
+        print(f"[CACHE] Wrote conversation snapshot: {path} ({len(records)} items)")
     except Exception as e:
-        print(f"[CACHE] Failed to write cache for {conversation_id}: {e}")
+        print(f"[CACHE] Failed to write snapshot for {conversation_id}: {e}")
 
 
-def _load_conversation_cache(conversation_id: str) -> bool:
-    """Load conversation cache into memory (replacing current memory for speed). Returns True if loaded."""
+def _load_conversation_cache(conversation_id: str, filenames=None, content_hashes=None) -> set:
+    """
+    Load a conversation snapshot into memory, alongside whatever is already there.
+    Only documents in filenames (all if None) are loaded, and a document is skipped if
+    content_hashes gives it a hash other than the one it was snapshotted with.
+    Returns the set of filenames loaded.
+    """
     try:
+        import numpy as np
         path = _conversation_cache_path(conversation_id)
         if not os.path.isfile(path):
-            return False
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        items = data.get("items", [])
-        # Replace in-memory with only this conversation's items
-        in_memory_chunks.clear()
-        in_memory_embeddings.clear()
-        in_memory_metadata.clear()
-        for i, it in enumerate(items):
-            chunk_id = f"chunk_{i}"
-            metadata = it.get("metadata", {})
-            chunk_text = it.get("chunk", "")
-            # Store with full metadata structure
-            in_memory_chunks[chunk_id] = {
-                'content': chunk_text,
-                'chunk_text': chunk_text,
-                'metadata': metadata,
-                'source': metadata.get('source', 'Unknown'),
-                'source_pdf': metadata.get('source_pdf', 'Unknown'),
-                'page_no': metadata.get('page_no', 1),
-                'page_number': metadata.get('page_no', 1),
-                'chunk_id': metadata.get('id', chunk_id),
-                'document_id': metadata.get('id', chunk_id)
-            }
-            in_memory_embeddings[chunk_id] = it.get("embedding", [])
-            in_memory_metadata.append(metadata)
-        print(f"[CACHE] Loaded conversation cache: {path} ({len(items)} items)")
-        return len(items) > 0
+            return set()
+        with np.load(path) as data:
+            embeddings = data["embeddings"]
+            records = json.loads(data["records"].tobytes().decode('utf-8'))
+        content_hashes = content_hashes or {}
+        stale = {
+            record["metadata"].get("source_pdf") for record in records
+            if content_hashes.get(record["metadata"].get("source_pdf"), record["metadata"].get("content_hash"))
+            != record["metadata"].get("content_hash")
+        }
+        wanted = [
+            (record, embedding) for record, embedding in zip(records, embeddings)
+            if record["metadata"].get("source_pdf") not in stale
+            and (filenames is None or record["metadata"].get("source_pdf") in filenames)
+        ]
+        loaded = {record["metadata"].get("source_pdf") for record, _ in wanted}
+        for filename in loaded:
+            remove_in_memory_document(filename, conversation_id)
+        for record, embedding in wanted:
+            _add_in_memory_chunk(record["chunk"], record["metadata"], embedding)
+        print(f"[CACHE] Loaded conversation snapshot: {path} ({len(wanted)} items, {len(loaded)} documents)")
+        return loaded
     except Exception as e:
-        print(f"[CACHE] Failed to load cache for {conversation_id}: {e}")
+        print(f"[CACHE] Failed to load snapshot for {conversation_id}: {e}")
+        return set()
+
+
+def restore_conversation(conversation_id, documents, content_hashes=None, pdf_root=None):
+    """
+    Make a conversation's documents searchable in memory from the cheapest source that
+    has them: memory itself, the conversation snapshot, vectors already in ChromaDB
+    (by content hash, or by filename and conversation) and, only for documents that
+    are genuinely missing, re-ingesting the PDF. content_hashes maps filename -> hash.
+    Returns {filename: source} where source is one of "memory", "snapshot", "store",
+    "processed" or "missing".
+    """
+    start = time.perf_counter()
+    scope = str(conversation_id)
+    content_hashes = content_hashes or {}
+    in_memory = in_memory_store.document_names(scope)
+    sources = {doc: "memory" for doc in documents if doc in in_memory}
+
+    remaining = [doc for doc in documents if doc not in sources]
+    if remaining:
+        for doc in _load_conversation_cache(scope, set(remaining), content_hashes):
+            sources[doc] = "snapshot"
+
+    for doc in documents:
+        if doc in sources:
+            continue
+        content_hash = content_hashes.get(doc)
+        file_path = os.path.join(pdf_root or pdf_dir, doc)
+        if content_hash and os.path.exists(content_file_path(content_hash)):
+            file_path = content_file_path(content_hash)  # The bytes this conversation uploaded, even if the name was reused
+        if content_hash and get_content_manifest(content_hash) and attach_content(content_hash, doc, scope, write_cache=False):
+            sources[doc] = "store"
+        elif not content_hash and load_document_from_store(doc, scope):
+            sources[doc] = "store"
+        elif os.path.exists(file_path):
+            print(f"[RESTORE] No stored vectors for {doc}, re-ingesting")
+            process_pdf(file_path, doc, scope, content_hash=content_hash or hash_file(file_path))
+            sources[doc] = "processed"
+        else:
+            print(f"[WARNING] Document not found: {file_path}")
+            sources[doc] = "missing"
+
+    if any(source in ("store", "processed") for source in sources.values()):
+        # Next time this conversation opens, it loads from the snapshot
+        _write_conversation_cache(scope)
+    counts = {source: list(sources.values()).count(source) for source in set(sources.values())}
+    print(f"[RESTORE] Conversation {scope}: {counts} in {time.perf_counter() - start:.3f}s")
+    return sources
+
+
+def _conversation_content_hashes(conversation_id):
+    """{content_hash: filename} for the shared documents a conversation references."""
+    try:
+        from ragapp.models import ConversationDocument
+        return dict(
+            ConversationDocument.objects.filter(conversation_key=str(conversation_id)).values_list('content_hash', 'filename')
+        )
+    except Exception as e:
+        print(f"[DEDUP] Could not resolve documents for conversation {conversation_id}: {e}")
+        return {}
+
+def _owner_content_hashes(owner):
+    """{content_hash: filename} of the documents a user uploaded (UserDocument rows)."""
+    try:
+        from ragapp.models import UserDocument
+        return dict(
+            UserDocument.objects.filter(user_id=owner).exclude(content_hash="").values_list('content_hash', 'filename')
+        )
+    except Exception as e:
+        print(f"[PRIVACY] Could not resolve documents for user {owner}: {e}")
+        return {}
+
+
+def _owns_conversation(conversation_id, owner):
+    """
+    False if conversation_id is a saved conversation of another user. With owner None (a
+    guest) only conversations saved without a user qualify; guest session ids are nobody's.
+    """
+    try:
+        from ragapp.models import Conversation
+        return not Conversation.objects.filter(id=conversation_id).exclude(user_id=owner).exists()
+    except (ValueError, TypeError):
+        return True  # Not a Conversation id (a guest session uuid)
+    except Exception as e:
+        print(f"[PRIVACY] Could not check the owner of conversation {conversation_id}: {e}")
         return False
 
+
+# Where the retrieval in get_answer runs: "memory" loads the whole collection into the
+# in-memory store on first use and searches that; "store" queries ChromaDB directly, with
+# conversation, owner and document filters pushed into the query (see store_where)
+RETRIEVAL_BACKEND = os.environ.get("RAG_RETRIEVAL_BACKEND", "memory")
+# ChromaDB is asked for this many times top_k results: hnswlib searches with
+# ef = max(ef_search, n_results), so a wider beam makes the filtered top_k more reliable
+STORE_QUERY_OVERFETCH = int(os.environ.get("RAG_STORE_QUERY_OVERFETCH", "2"))
+
+
+def _any_of(clauses):
+    """$or of the clauses that can match anything (None if none can)."""
+    clauses = [clause for clause in clauses if clause is not None]
+    if len(clauses) > 1:
+        return {"$or": clauses}
+    return clauses[0] if clauses else None
+
+
+def _in(field, values):
+    values = sorted(set(values))
+    if not values:
+        return None
+    return {field: values[0]} if len(values) == 1 else {field: {"$in": values}}
+
+
+def store_where(conversation_id=None, pdf_context=None, owner=None):
+    """
+    ChromaDB where clause selecting the chunks a retrieval may return, so the store prunes
+    candidates itself instead of results being filtered afterwards:
+      - a conversation sees its own (conversation-scoped) chunks, chunks ingested without
+        a conversation ("global"), and the content-addressed documents it references;
+      - a saved conversation of another user only gets the global documents; for a guest
+        (no owner) that is any conversation saved with a user. Without a conversation an
+        owner sees the global documents plus everything they uploaded, and a guest only
+        the global documents;
+      - pdf_context narrows that to one document by name (with or without .pdf).
+        Content-addressed chunks match by the name their hash has in scope, not by the
+        source_pdf of whoever uploaded those bytes first.
+    Returns (where, {content_hash: filename} of the shared documents in scope), with where
+    None when nothing matches.
+    """
+    shared_names = {}
+    scopes = ["global"]
+    if not conversation_id:
+        shared_names = _owner_content_hashes(owner) if owner is not None else {}
+    elif _owns_conversation(conversation_id, owner):
+        scopes.append(str(conversation_id))
+        shared_names = _conversation_content_hashes(conversation_id)
+    else:
+        print(f"[PRIVACY] Conversation {conversation_id} belongs to another user; searching global documents only")
+    clauses = [{"type": "pdf_chunk"}, _any_of([_in("conversation_id", scopes), _in("content_hash", shared_names)])]
+    if pdf_context:
+        name = _document_name_key(pdf_context)
+        by_name = {"$and": [_in("source_pdf", [name, name + '.pdf']), {"conversation_id": {"$ne": "shared"}}]}
+        clauses.append(_any_of([
+            by_name,
+            _in("content_hash", [h for h, filename in shared_names.items() if _document_name_key(filename) == name]),
+        ]))
+    if any(clause is None for clause in clauses):
+        return None, shared_names
+    return {"$and": clauses}, shared_names
+
+
+def in_memory_scope(conversation_id=None, owner=None):
+    """
+    The in-memory rows a retrieval may search, by the same rules as store_where: the global
+    documents, plus the conversation's own and referenced documents when the requester may
+    see that conversation, or (without a conversation) the documents the owner uploaded.
+    """
+    if conversation_id:
+        if not _owns_conversation(conversation_id, owner):
+            print(f"[PRIVACY] Conversation {conversation_id} belongs to another user; searching global documents only")
+            return in_memory_chunks.subset(in_memory_store.conversation_rows(None))
+        return in_memory_chunks.subset(
+            in_memory_store.conversation_rows(conversation_id, _conversation_content_hashes(conversation_id))
+        )
+    content_hashes = _owner_content_hashes(owner) if owner is not None else {}
+    return in_memory_chunks.subset(in_memory_store.conversation_rows(None, content_hashes))
+
+
+def _store_result_chunk(doc, metadata, similarity_score, shared_names):
+    """
+    A ChromaDB result as the chunk dict retrieval returns, with the fields of an in-memory
+    row (see ChunkRow) as well; shared documents get the name they have in scope.
+    """
+    page_no = metadata.get("page_no", 1)
+    return {
+        "document_id": metadata.get("id"),
+        "chunk_id": metadata.get("id"),
+        "document_type": metadata.get("type"),
+        "source_pdf": shared_names.get(metadata.get("content_hash"), metadata.get("source_pdf")),
+        "source": metadata.get("source", "Unknown"),
+        "chunk_index": metadata.get("chunk_index"),
+        "page_no": page_no,
+        "page_number": page_no,
+        "duplicate_pages": metadata.get("duplicate_pages"),
+        "chunk_text": doc,
+        "content": doc,
+        "metadata": metadata,
+        "similarity_score": similarity_score
+    }
+
+
 def convert_query_to_embedding(query):
-    embedding_model = get_model()
-    return embedding_model.encode(query)
+    # Through the embedding cache: repeated questions skip the model
+    return embed_texts([query])[0]
 
-def retrieve_similar_chunks(query, top_k=10, similarity_threshold=0.7, conversation_id: str | None = None, custom_chunks=None, custom_embeddings=None):
+def retrieve_similar_chunks(query, top_k=10, similarity_threshold=0.7, conversation_id: str | None = None, custom_chunks=None, custom_embeddings=None,
+                            pdf_context: str = None, owner=None, query_embedding=None, scope=None):
+    """
+    Chunks most similar to the query: from custom chunks/embeddings (e.g. the in-memory
+    store), or from ChromaDB filtered by store_where. scope is that (where, shared_names)
+    pair when the caller has already built it, so it can apply the same filter elsewhere.
+    """
     try:
         import time
         print(f"[SEARCH] Converting query to embedding...")
         embedding_start = time.perf_counter()
-        query_embedding = convert_query_to_embedding(query)
+        if query_embedding is None:
+            query_embedding = convert_query_to_embedding(query)
         embedding_time = time.perf_counter() - embedding_start
         print(f"[TIME] Query embedding took: {embedding_time:.2f}s")
         
@@ -428,24 +2982,12 @@ def retrieve_similar_chunks(query, top_k=10, similarity_threshold=0.7, conversat
             print(f"[SEARCH] Using custom chunks/embeddings with {len(custom_embeddings)} items...")
             similarity_start = time.perf_counter()
             
-            similarities = []
-            for chunk_id, chunk_embedding in custom_embeddings.items():
-                # Reshape to 2D arrays for cosine_similarity
-                # Reshape to 2D arrays for cosine_similarity
-                import numpy as np
-                from sklearn.metrics.pairwise import cosine_similarity
-                
-                query_2d = query_embedding.reshape(1, -1) if hasattr(query_embedding, 'reshape') else np.array(query_embedding).reshape(1, -1)
-                chunk_2d = chunk_embedding.reshape(1, -1) if hasattr(chunk_embedding, 'reshape') else np.array(chunk_embedding).reshape(1, -1)
-                similarity = cosine_similarity(query_2d, chunk_2d)[0][0]
-                similarities.append((chunk_id, similarity))
-            
-            # Sort by similarity (descending)
-            similarities.sort(key=lambda x: x[1], reverse=True)
-            
-            # Filter by threshold and get top_k
-            filtered_similarities = [(chunk_id, sim) for chunk_id, sim in similarities if sim >= similarity_threshold]
-            top_similarities = filtered_similarities[:top_k]
+            # One matrix-vector product over the in-memory store's rows (all of them, or the
+            # filtered subset); embeddings from elsewhere get an index of their own
+            if isinstance(custom_embeddings, EmbeddingRows):
+                top_similarities = custom_embeddings.search(query_embedding, top_k, similarity_threshold)
+            else:
+                top_similarities = VectorIndex.from_embeddings(custom_embeddings).search(query_embedding, top_k, similarity_threshold)
             
             similarity_time = time.perf_counter() - similarity_start
             print(f"[TIME] Custom similarity computation took: {similarity_time:.2f}s")
@@ -464,17 +3006,19 @@ def retrieve_similar_chunks(query, top_k=10, similarity_threshold=0.7, conversat
             print(f"[SEARCH] Searching ChromaDB with {top_k} results...")
             similarity_start = time.perf_counter()
             
-            # Prepare where clause for conversation filtering
-            where_clause = None
-            if conversation_id:
-                where_clause = {"conversation_id": conversation_id}
+            # Conversation, owner and document filters are part of the query, so every
+            # result is in scope and only the similarity threshold is applied here
+            where_clause, shared_names = scope or store_where(conversation_id, pdf_context, owner)
+            if where_clause is None:
+                print("[SEARCH] Nothing in scope for this query")
+                return []
+            print(f"[SEARCH] ChromaDB filter: {json.dumps(where_clause)}")
             
-            # Query ChromaDB
-            # Query ChromaDB
             results = get_chroma_collection().query(
                 query_embeddings=[query_embedding.tolist()],
-                n_results=top_k,
-                where=where_clause
+                n_results=top_k * max(1, STORE_QUERY_OVERFETCH),
+                where=where_clause,
+                include=['documents', 'metadatas', 'distances']
             )
             
             similarity_time = time.perf_counter() - similarity_start
@@ -482,26 +3026,18 @@ def retrieve_similar_chunks(query, top_k=10, similarity_threshold=0.7, conversat
             
             similar_chunks = []
             if results['documents'] and results['documents'][0]:
-                for i, (doc, metadata, distance) in enumerate(zip(
+                for doc, metadata, distance in zip(
                     results['documents'][0], 
                     results['metadatas'][0], 
                     results['distances'][0]
-                )):
+                ):
                     # Convert distance to similarity score (ChromaDB uses distance, we need similarity)
                     similarity_score = 1 - distance
-                    if similarity_score >= similarity_threshold:
-                        document_type = metadata.get("type")
-                    
-                    if document_type == "pdf_chunk":
-                        similar_chunks.append({
-                            "document_id": metadata.get("id"),
-                            "document_type": document_type,
-                            "source_pdf": metadata.get("source_pdf"),
-                            "chunk_index": metadata.get("chunk_index"),
-                            "page_no": metadata.get("page_no", 1),
-                            "chunk_text": doc,
-                            "similarity_score": similarity_score
-                        })
+                    if similarity_score < similarity_threshold:
+                        break  # Results come best first
+                    similar_chunks.append(_store_result_chunk(doc, metadata, similarity_score, shared_names))
+                    if len(similar_chunks) == top_k:
+                        break
 
         return similar_chunks
 
@@ -533,18 +3069,192 @@ def tfidf_filter_chunks(query, retrieved_chunks, threshold=0.1):
     return filtered_chunks
     
 
-def process_query_with_tfidf(query, top_k=10, similarity_threshold=0.3, tfidf_threshold=0.05, conversation_id: str | None = None, custom_chunks=None, custom_embeddings=None):
-    # Use custom chunks and embeddings if provided, otherwise use global ones
-    chunks_to_use = custom_chunks if custom_chunks is not None else in_memory_chunks
-    embeddings_to_use = custom_embeddings if custom_embeddings is not None else in_memory_embeddings
+def lexical_filter_chunks(query, retrieved_chunks, threshold=0.1):
+    """
+    Score retrieved chunks against the query with the persistent BM25 index instead of
+    fitting a TF-IDF model on them. The score, stored as tfidf_score (which ranking and
+    citations read), is bm25 / (bm25 + LEXICAL_SCORE_HALF). With a threshold above 0,
+    chunks containing none of the query's words are dropped. FTS5 gives words found in
+    over half of all chunks next to no weight, so the threshold isn't applied to the score
+    itself. Chunks missing from the index are kept unscored. Falls back to
+    tfidf_filter_chunks when there is no lexical index.
+    """
+    if not retrieved_chunks:
+        return []
+    lexical_index = get_lexical_index()
+    if lexical_index is None:
+        return tfidf_filter_chunks(query, retrieved_chunks, threshold)
+    ids = [chunk.get("document_id") for chunk in retrieved_chunks]
+    try:
+        scores, known = lexical_index.scores(query, [chunk_id for chunk_id in ids if chunk_id])
+    except Exception as e:
+        print(f"[LEXICAL] Lookup failed, falling back to TF-IDF: {e}")
+        return tfidf_filter_chunks(query, retrieved_chunks, threshold)
+
+    filtered = []
+    for chunk, chunk_id in zip(retrieved_chunks, ids):
+        if chunk_id in scores:
+            chunk["tfidf_score"] = scores[chunk_id] / (scores[chunk_id] + LEXICAL_SCORE_HALF)
+        elif chunk_id in known and threshold > 0:
+            continue
+        else:
+            chunk["tfidf_score"] = 0.0
+        filtered.append(chunk)
+    unknown = sum(1 for chunk_id in ids if chunk_id not in known)
+    if unknown:
+        print(f"[LEXICAL] {unknown} of {len(ids)} chunks are not in the lexical index; run `manage.py build_lexical_index`")
+    return filtered
+
+
+# "two-step" retrieves top_k chunks by embedding and re-scores them lexically; "hybrid" runs
+# the dense and lexical (BM25) searches side by side and fuses their rankings, so chunks that
+# only match on exact terms (part numbers, clause ids) can still be returned
+RETRIEVAL_MODE = os.environ.get("RAG_RETRIEVAL_MODE", "two-step")
+# Candidates each hybrid source contributes before fusion
+HYBRID_DENSE_DEPTH = int(os.environ.get("RAG_HYBRID_DENSE_DEPTH", "20"))
+HYBRID_LEXICAL_DEPTH = int(os.environ.get("RAG_HYBRID_LEXICAL_DEPTH", "20"))
+# "rrf": reciprocal-rank fusion, sum of 1 / (RAG_RRF_K + rank); "weighted": min-max normalised
+# scores, weighted RAG_HYBRID_DENSE_WEIGHT (dense) and 1 - that (lexical)
+HYBRID_FUSION = os.environ.get("RAG_HYBRID_FUSION", "rrf")
+RRF_K = int(os.environ.get("RAG_RRF_K", "60"))
+HYBRID_DENSE_WEIGHT = float(os.environ.get("RAG_HYBRID_DENSE_WEIGHT", "0.5"))
+
+_hybrid_executor = None
+
+
+def reciprocal_rank_fusion(rankings, k=None):
+    """{id: sum of 1 / (k + rank)} over rankings given as best-first lists of ids (rank 1 first)."""
+    k = RRF_K if k is None else k
+    fused = defaultdict(float)
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            fused[item] += 1.0 / (k + rank)
+    return dict(fused)
+
+
+def weighted_score_fusion(score_lists, weights):
+    """{id: sum of weight * min-max normalised score} over {id: score} dicts (a missing id scores 0 there)."""
+    fused = defaultdict(float)
+    for scores, weight in zip(score_lists, weights):
+        if not scores:
+            continue
+        low, high = min(scores.values()), max(scores.values())
+        for item, score in scores.items():
+            fused[item] += weight * ((score - low) / (high - low) if high > low else 1.0)
+    return dict(fused)
+
+
+def _fetch_store_chunks(chunk_ids, query_embedding, shared_names):
+    """{id: chunk dict} for chunks found only by the lexical search, with their cosine similarity to the query."""
+    import numpy as np
+    results = get_chroma_collection().get(ids=list(chunk_ids), include=['documents', 'metadatas', 'embeddings'])
+    if not results['ids']:
+        return {}
+    query = _normalise_rows(query_embedding)[0][0]
+    similarities = _normalise_rows(np.asarray(results['embeddings'], dtype=np.float32))[0] @ query
+    return {
+        chunk_id: _store_result_chunk(doc, metadata, float(similarity), shared_names)
+        for chunk_id, doc, metadata, similarity in zip(results['ids'], results['documents'], results['metadatas'], similarities)
+    }
+
+
+def hybrid_retrieve(query, top_k=5, similarity_threshold=0.3, conversation_id: str | None = None, custom_chunks=None, custom_embeddings=None,
+                    pdf_context: str = None, owner=None, dense_depth=None, lexical_depth=None, fusion=None):
+    """
+    Dense and lexical retrieval fused into one ranking. The BM25 search runs on a worker
+    thread while the query is embedded and searched densely (custom chunks/embeddings, or
+    ChromaDB). The lexical and ChromaDB searches share one store_where clause; custom
+    chunks must already be scoped by the same rules (in_memory_scope). The candidate
+    lists are merged by reciprocal-rank fusion or weighted normalised scores, and the
+    top_k chunks are returned best first. Lexical-only hits are read from ChromaDB through
+    _store_result_chunk, with the fields of an in-memory row and their real cosine
+    similarity. Every chunk carries similarity_score, tfidf_score (BM25, as in
+    lexical_filter_chunks) and fusion_score. Returns None when there is no lexical index.
+    """
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    global _hybrid_executor
+    lexical_index = get_lexical_index()
+    if lexical_index is None:
+        return None
+    dense_depth = dense_depth or HYBRID_DENSE_DEPTH
+    lexical_depth = lexical_depth or HYBRID_LEXICAL_DEPTH
+    fusion = fusion or HYBRID_FUSION
+    start = time.perf_counter()
+
+    where, shared_names = store_where(conversation_id, pdf_context, owner)
+    if where is None:
+        print("[HYBRID] Nothing in scope for this query")
+        return []
+    if _hybrid_executor is None:
+        _hybrid_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="hybrid-lexical")
+    lexical_future = _hybrid_executor.submit(lexical_index.search, query, lexical_depth, where)
+    query_embedding = convert_query_to_embedding(query)
+    dense = retrieve_similar_chunks(query, dense_depth, similarity_threshold, conversation_id, custom_chunks, custom_embeddings,
+                                    pdf_context=pdf_context, owner=owner, query_embedding=query_embedding,
+                                    scope=(where, shared_names))
+    try:
+        lexical = lexical_future.result()
+    except Exception as e:
+        print(f"[HYBRID] Lexical search failed, using dense results only: {e}")
+        lexical = []
+    search_time = time.perf_counter() - start
+
+    chunks = {chunk.get("document_id"): chunk for chunk in dense}
+    missing = [chunk_id for chunk_id, _ in lexical if chunk_id not in chunks]
+    if missing:
+        chunks.update(_fetch_store_chunks(missing, query_embedding, shared_names))
+    bm25 = dict(lexical)
+    unscored = [chunk_id for chunk_id in chunks if chunk_id not in bm25]
+    if unscored:
+        bm25.update(lexical_index.scores(query, [chunk_id for chunk_id in unscored if chunk_id])[0])
+
+    dense_ids = [chunk.get("document_id") for chunk in dense]
+    lexical_ids = [chunk_id for chunk_id, _ in lexical if chunk_id in chunks]
+    if fusion == "weighted":
+        fused = weighted_score_fusion(
+            [{chunk_id: chunks[chunk_id]["similarity_score"] for chunk_id in dense_ids}, {chunk_id: bm25[chunk_id] for chunk_id in lexical_ids}],
+            [HYBRID_DENSE_WEIGHT, 1.0 - HYBRID_DENSE_WEIGHT]
+        )
+    else:
+        fused = reciprocal_rank_fusion([dense_ids, lexical_ids])
+
+    results = []
+    for chunk_id in sorted(fused, key=fused.get, reverse=True)[:top_k]:
+        chunk = chunks[chunk_id]
+        chunk["tfidf_score"] = bm25[chunk_id] / (bm25[chunk_id] + LEXICAL_SCORE_HALF) if chunk_id in bm25 else 0.0
+        chunk["fusion_score"] = fused[chunk_id]
+        results.append(chunk)
+    print(f"[HYBRID] {len(dense)} dense + {len(lexical)} lexical candidates ({len(missing)} lexical only), "
+          f"{fusion} fusion -> {len(results)} chunks; searches took {search_time:.3f}s")
+    return results
+
+
+def process_query_with_tfidf(query, top_k=10, similarity_threshold=0.3, tfidf_threshold=0.05, conversation_id: str | None = None, custom_chunks=None, custom_embeddings=None,
+                             pdf_context: str = None, owner=None):
+    # Use custom chunks and embeddings if provided, otherwise the in-memory store (or ChromaDB
+    # itself, scoped by conversation, owner and pdf_context, with the "store" backend)
+    chunks_to_use, embeddings_to_use = custom_chunks, custom_embeddings
+    if custom_chunks is None and RETRIEVAL_BACKEND != "store":
+        # Only the rows in scope are scored, as in get_answer
+        chunks_to_use = filter_chunks_by_document(in_memory_scope(conversation_id, owner), pdf_context)
+        embeddings_to_use = chunks_to_use.embeddings
+    
+    if RETRIEVAL_MODE == "hybrid":
+        fused_chunks = hybrid_retrieve(query, top_k, similarity_threshold, conversation_id, chunks_to_use, embeddings_to_use,
+                                       pdf_context=pdf_context, owner=owner)
+        if fused_chunks is not None:
+            # Same number of chunks as the two-step path hands on
+            return fused_chunks[:5] or None
     
     # Get more chunks initially for better diversity
-    retrieved_chunks = retrieve_similar_chunks(query, top_k, similarity_threshold, conversation_id, chunks_to_use, embeddings_to_use)
+    retrieved_chunks = retrieve_similar_chunks(query, top_k, similarity_threshold, conversation_id, chunks_to_use, embeddings_to_use,
+                                               pdf_context=pdf_context, owner=owner)
     if not retrieved_chunks:
         return None
     
-    # Apply TF-IDF filtering (more lenient)
-    filtered_chunks = tfidf_filter_chunks(query, retrieved_chunks, tfidf_threshold)
+    # Score against the persistent BM25 index (more lenient)
+    filtered_chunks = lexical_filter_chunks(query, retrieved_chunks, tfidf_threshold)
     
     # Sort by combined relevance score
     filtered_chunks.sort(key=lambda x: (x.get("similarity_score", 0) + x.get("tfidf_score", 0)), reverse=True)
@@ -595,8 +3305,9 @@ def build_context(filtered_chunks):
             
         seen_content.add(chunk_hash)
         source_pdf = chunk.get('source_pdf', chunk.get('source', 'Unknown'))
-        page_no = chunk.get('page_no', chunk.get('page_number', 1))
-        context += f"From {i}. {source_pdf} (Page {page_no})\n{chunk_text}\n\n"
+        pages = chunk_pages_cited(chunk)
+        page_label = f"Pages {', '.join(str(page) for page in pages)}" if len(pages) > 1 else f"Page {pages[0]}"
+        context += f"From {i}. {source_pdf} ({page_label})\n{chunk_text}\n\n"
         
         # Limit context length to avoid overwhelming the model
         if len(context) > 5000:
@@ -827,7 +3538,6 @@ def _chunks_to_citations(filtered_chunks, query=""):
     for chunk in sorted_chunks:
         try:
             source_pdf = chunk.get("source_pdf", "")
-            page_no = chunk.get("page_no", 1)
             chunk_text = chunk.get("chunk_text", "").lower()
             
             # Group chunks by PDF
@@ -851,7 +3561,7 @@ def _chunks_to_citations(filtered_chunks, query=""):
             matched = query_tokens.intersection(chunk_tokens)
             
             group = pdf_page_groups[source_pdf]
-            group["pages"].add(page_no)
+            group["pages"].update(chunk_pages_cited(chunk))
             group["chunks"].append(chunk)
             group["all_keywords"].update(matched)
             
@@ -877,13 +3587,14 @@ def _chunks_to_citations(filtered_chunks, query=""):
         # Sort pages by their relevance (highest scoring chunks first)
         page_scores = {}
         for chunk in data["chunks"]:
-            page_no = chunk.get("page_no", 1)
             similarity = float(chunk.get("similarity_score", 0) or 0)
             tfidf = float(chunk.get("tfidf_score", 0) or 0)
             combined = similarity + tfidf
             
-            if page_no not in page_scores or combined > page_scores[page_no]:
-                page_scores[page_no] = combined
+            # Pages of collapsed near-duplicates share their canonical chunk's score
+            for page_no in chunk_pages_cited(chunk):
+                if page_no not in page_scores or combined > page_scores[page_no]:
+                    page_scores[page_no] = combined
         
         # Sort pages by their best score
         sorted_pages_data = sorted(page_scores.items(), key=lambda x: x[1], reverse=True)
@@ -966,7 +3677,7 @@ def generate_follow_up_questions(answer, query):
             "How does this work?"
         ]
 
-def get_answer(query, conversation_id: str | None = None, pdf_context: str = None, min_confidence_threshold: float = 0.15):
+def get_answer(query, conversation_id: str | None = None, pdf_context: str = None, min_confidence_threshold: float = 0.15, owner=None):
     import time
     start_time = time.perf_counter()
     
@@ -976,12 +3687,13 @@ def get_answer(query, conversation_id: str | None = None, pdf_context: str = Non
     print(f"[PDF_CONTEXT] Query context: {pdf_context}")
     print(f"[CONFIDENCE] Minimum threshold: {min_confidence_threshold}")
     
-    # Always try to load embeddings from ChromaDB if memory is empty
-    if not in_memory_embeddings:
+    # Always try to load embeddings from ChromaDB if memory is empty (the "store" backend
+    # queries ChromaDB directly instead)
+    if not in_memory_embeddings and RETRIEVAL_BACKEND != "store":
         print("[RAG] No embeddings in memory, trying to load from ChromaDB...")
         try:
             # Try to load embeddings from ChromaDB
-            collection = chroma_client.get_collection(collection_name)
+            collection = get_chroma_collection()
             count = collection.count()
             print(f"[RAG] Found {count} documents in ChromaDB")
             
@@ -991,8 +3703,7 @@ def get_answer(query, conversation_id: str | None = None, pdf_context: str = Non
                 results = collection.get(include=['documents', 'embeddings', 'metadatas'])
                 
                 # Clear existing memory
-                in_memory_chunks.clear()
-                in_memory_embeddings.clear()
+                clear_in_memory_store()
                 
                 # Handle different ChromaDB result structures
                 if isinstance(results, dict):
@@ -1030,18 +3741,7 @@ def get_answer(query, conversation_id: str | None = None, pdf_context: str = Non
                     if isinstance(embedding, np.ndarray):
                         embedding = embedding.tolist()
                     
-                    chunk_id = f"chromadb_{i}"
-                    in_memory_chunks[chunk_id] = {
-                        'content': doc,
-                        'metadata': metadata,
-                        'source': metadata.get('source', 'Unknown'),
-                        'source_pdf': metadata.get('source_pdf', 'Unknown'),
-                        'page_no': metadata.get('page_no', 1),
-                        'page_number': metadata.get('page_no', 1),  # Also add as page_number for compatibility
-                        'chunk_text': doc,
-                        'document_id': metadata.get('id', f"doc_{i}")
-                    }
-                    in_memory_embeddings[chunk_id] = embedding
+                    _add_in_memory_chunk(doc, metadata, embedding)
                 
                 print(f"[RAG] Loaded {len(in_memory_chunks)} chunks and {len(in_memory_embeddings)} embeddings into memory")
             else:
@@ -1054,25 +3754,45 @@ def get_answer(query, conversation_id: str | None = None, pdf_context: str = Non
     print(f"[SEARCH] Starting query processing for: {query}")
     chunk_start = time.perf_counter()
     
-    # Filter chunks by PDF context if provided
-    if pdf_context:
-        print(f"[PDF_FILTER] Filtering chunks for PDF: {pdf_context}")
-        pdf_filtered_chunks = filter_chunks_by_document(in_memory_chunks, pdf_context)
-        pdf_filtered_embeddings = {k: v for k, v in in_memory_embeddings.items() if k in pdf_filtered_chunks}
-        
-        if not pdf_filtered_chunks:
-            print(f"[PDF_FILTER] No chunks found for PDF: {pdf_context}")
-            return format_no_answer_response(pdf_context=pdf_context, reason="not_in_document")
-        
-        # Use PDF-filtered chunks for processing with lower threshold for PDF-specific queries
-        filtered_chunks = process_query_with_tfidf(query, top_k=20, similarity_threshold=0.05, tfidf_threshold=0.01, 
-                                                 conversation_id=conversation_id, 
-                                                 custom_chunks=pdf_filtered_chunks, 
-                                                 custom_embeddings=pdf_filtered_embeddings)
-        
-        print(f"[PDF_FILTER] Filtered chunks returned: {len(filtered_chunks) if filtered_chunks else 0} chunks")
+    if RETRIEVAL_BACKEND == "store":
+        # ChromaDB applies the conversation, owner and PDF filters itself (see store_where),
+        # with a lower threshold for PDF-specific queries
+        print(f"[SEARCH] Querying ChromaDB (conversation {conversation_id}, owner {owner}, PDF {pdf_context})")
+        if pdf_context:
+            filtered_chunks = process_query_with_tfidf(query, top_k=20, similarity_threshold=0.05, tfidf_threshold=0.01,
+                                                       conversation_id=conversation_id, pdf_context=pdf_context, owner=owner)
+        else:
+            filtered_chunks = process_query_with_tfidf(query, top_k=10, similarity_threshold=0.3, tfidf_threshold=0.05,
+                                                       conversation_id=conversation_id, owner=owner)
     else:
-        filtered_chunks = process_query_with_tfidf(query, top_k=10, similarity_threshold=0.3, tfidf_threshold=0.05, conversation_id=conversation_id)
+        # Only the rows store_where would let through, found through the store's conversation index
+        scoped_chunks = in_memory_scope(conversation_id, owner)
+        print(f"[SCOPE] Conversation {conversation_id}, owner {owner}: {len(scoped_chunks)} of {len(in_memory_chunks)} chunks")
+        
+        # Filter chunks by PDF context if provided
+        if pdf_context:
+            print(f"[PDF_FILTER] Filtering chunks for PDF: {pdf_context}")
+            pdf_filtered_chunks = filter_chunks_by_document(scoped_chunks, pdf_context)
+            pdf_filtered_embeddings = pdf_filtered_chunks.embeddings
+            
+            if not pdf_filtered_chunks:
+                print(f"[PDF_FILTER] No chunks found for PDF: {pdf_context}")
+                return format_no_answer_response(pdf_context=pdf_context, reason="not_in_document")
+            
+            # Use PDF-filtered chunks for processing with lower threshold for PDF-specific queries
+            filtered_chunks = process_query_with_tfidf(query, top_k=20, similarity_threshold=0.05, tfidf_threshold=0.01, 
+                                                     conversation_id=conversation_id, 
+                                                     custom_chunks=pdf_filtered_chunks, 
+                                                     custom_embeddings=pdf_filtered_embeddings,
+                                                     pdf_context=pdf_context, owner=owner)
+            
+            print(f"[PDF_FILTER] Filtered chunks returned: {len(filtered_chunks) if filtered_chunks else 0} chunks")
+        else:
+            filtered_chunks = process_query_with_tfidf(query, top_k=10, similarity_threshold=0.3, tfidf_threshold=0.05,
+                                                       conversation_id=conversation_id,
+                                                       custom_chunks=scoped_chunks,
+                                                       custom_embeddings=scoped_chunks.embeddings,
+                                                       owner=owner)
     
     chunk_time = time.perf_counter() - chunk_start
     print(f"[TIME] Chunk processing took: {chunk_time:.2f}s")
@@ -0,0 +1,262 @@
+"""
+Database-backed ingestion queue shared by every web and worker process.
+
+Uploads call enqueue_ingestion(); `manage.py ingest_worker` processes claim jobs with
+claim_next_job(), which takes a row lease through a conditional UPDATE so only one
+worker (on any host) can own a job at a time. Workers renew the lease while reporting
+progress; a job whose lease expires is handed to the next worker that asks.
+"""
+import os
+import socket
+from datetime import timedelta
+
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import ConversationDocument, IngestionJob, UserDocument
+
+DEFAULT_LEASE_SECONDS = 300
+RETRY_BACKOFF_SECONDS = 30
+
+ACTIVE_STATUSES = (IngestionJob.STATUS_QUEUED, IngestionJob.STATUS_RUNNING)
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue_ingestion(filename, file_path, conversation_id=None, user=None, content_hash='', previous_content_hash='',
+                      action=IngestionJob.ACTION_INGEST):
+    """Queue a PDF for ingestion (or, with action=ACTION_REMOVE, for removal from the index) and return the job."""
+    job = IngestionJob.objects.create(
+        action=action,
+        user=user if user is not None and user.is_authenticated else None,
+        filename=filename,
+        file_path=file_path,
+        conversation_id=str(conversation_id) if conversation_id else None,
+        content_hash=content_hash or '',
+        previous_content_hash=previous_content_hash or '',
+    )
+    print(f"[QUEUE] Enqueued {action} job {job.id} for {filename}")
+    return job
+
+
+def record_attached(filename, file_path, conversation_id=None, user=None, content_hash=''):
+    """
+    Record an upload whose bytes were already embedded as a finished ingest job, so every
+    web process attaches the stored vectors through sync_completed_ingestions, as it does
+    for jobs finished by a worker.
+    """
+    job = IngestionJob.objects.create(
+        action=IngestionJob.ACTION_INGEST,
+        status=IngestionJob.STATUS_DONE,
+        user=user if user is not None and user.is_authenticated else None,
+        filename=filename,
+        file_path=file_path,
+        conversation_id=str(conversation_id) if conversation_id else None,
+        content_hash=content_hash or '',
+    )
+    print(f"[QUEUE] Recorded job {job.id}: {filename} reuses stored vectors")
+    return job
+
+
+def _claimable(now):
+    queued = Q(status=IngestionJob.STATUS_QUEUED, available_at__lte=now)
+    lease_expired = Q(status=IngestionJob.STATUS_RUNNING, lease_expires_at__lt=now)
+    return (queued | lease_expired) & Q(attempts__lt=F('max_attempts'))
+
+
+def claim_next_job(worker_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    Lease the oldest claimable job to worker_id, preferring jobs that have not had their
+    first pages indexed yet over background jobs. The UPDATE only succeeds if the row is
+    still claimable, so concurrent workers racing for the same row get exactly one winner.
+    """
+    now = timezone.now()
+    candidates = list(
+        IngestionJob.objects.filter(_claimable(now)).order_by('background', 'available_at', 'id').values_list('id', flat=True)[:10]
+    )
+    for job_id in candidates:
+        claimed = IngestionJob.objects.filter(_claimable(now), id=job_id).update(
+            status=IngestionJob.STATUS_RUNNING,
+            lease_owner=worker_id,
+            lease_expires_at=now + timedelta(seconds=lease_seconds),
+            attempts=F('attempts') + 1,
+            updated_at=now,
+        )
+        if claimed:
+            return IngestionJob.objects.get(id=job_id)
+    return None
+
+
+def report_progress(job, worker_id, pages_done, pages_total, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """Record page progress and extend the lease. Returns False if the lease was lost to another worker."""
+    now = timezone.now()
+    updated = IngestionJob.objects.filter(
+        id=job.id, lease_owner=worker_id, status=IngestionJob.STATUS_RUNNING
+    ).update(
+        pages_done=pages_done,
+        pages_total=pages_total,
+        lease_expires_at=now + timedelta(seconds=lease_seconds),
+        updated_at=now,
+    )
+    return bool(updated)
+
+
+def complete_job(job, worker_id):
+    now = timezone.now()
+    IngestionJob.objects.filter(id=job.id, lease_owner=worker_id).update(
+        status=IngestionJob.STATUS_DONE,
+        lease_expires_at=None,
+        error='',
+        updated_at=now,
+    )
+
+
+def fail_job(job, worker_id, error, retry=True):
+    """Requeue with exponential backoff, or mark failed once max_attempts is reached (or retry=False)."""
+    job.refresh_from_db(fields=['attempts', 'max_attempts'])
+    now = timezone.now()
+    if retry and job.attempts < job.max_attempts:
+        delay = RETRY_BACKOFF_SECONDS * (2 ** (job.attempts - 1))
+        fields = {
+            'status': IngestionJob.STATUS_QUEUED,
+            'available_at': now + timedelta(seconds=delay),
+        }
+        print(f"[QUEUE] Job {job.id} failed (attempt {job.attempts}/{job.max_attempts}), retrying in {delay}s")
+    else:
+        fields = {'status': IngestionJob.STATUS_FAILED}
+        print(f"[QUEUE] Job {job.id} failed permanently after {job.attempts} attempts")
+    IngestionJob.objects.filter(id=job.id, lease_owner=worker_id).update(
+        lease_expires_at=None,
+        error=str(error)[:2000],
+        updated_at=now,
+        **fields,
+    )
+
+
+def defer_job(job, worker_id):
+    """
+    Put a job whose first pages are indexed back on the queue at background priority, so
+    newer uploads get their first pages indexed before this one's remaining pages.
+    The attempt is not counted.
+    """
+    IngestionJob.objects.filter(id=job.id, lease_owner=worker_id, status=IngestionJob.STATUS_RUNNING).update(
+        status=IngestionJob.STATUS_QUEUED,
+        background=True,
+        attempts=F('attempts') - 1,
+        lease_owner='',
+        lease_expires_at=None,
+        available_at=timezone.now(),
+        updated_at=timezone.now(),
+    )
+
+
+def release_job(job, worker_id):
+    """Hand a job back to the queue without counting the attempt (e.g. worker shutdown)."""
+    IngestionJob.objects.filter(id=job.id, lease_owner=worker_id, status=IngestionJob.STATUS_RUNNING).update(
+        status=IngestionJob.STATUS_QUEUED,
+        attempts=F('attempts') - 1,
+        lease_owner='',
+        lease_expires_at=None,
+        updated_at=timezone.now(),
+    )
+
+
+def fail_abandoned_jobs():
+    """Mark running jobs whose lease expired after their last allowed attempt as failed."""
+    now = timezone.now()
+    return IngestionJob.objects.filter(
+        status=IngestionJob.STATUS_RUNNING,
+        lease_expires_at__lt=now,
+        attempts__gte=F('max_attempts'),
+    ).update(status=IngestionJob.STATUS_FAILED, error='Lease expired on final attempt', updated_at=now)
+
+
+def status_label(job_status):
+    """Map a job status onto the 'processing' / 'ready' / 'failed' values the UI understands."""
+    if job_status in ACTIVE_STATUSES:
+        return 'processing'
+    if job_status == IngestionJob.STATUS_DONE:
+        return 'ready'
+    return 'failed'
+
+
+def job_status_payload(job):
+    return {
+        'status': status_label(job.status),
+        'job_id': job.id,
+        'job_status': job.status,
+        'pages_done': job.pages_done,
+        'pages_total': job.pages_total,
+        # Page ranges already searchable; answers drawn from them may be partial until status is 'ready'
+        'indexed_pages': [[1, job.pages_done]] if job.pages_done else [],
+        'queryable': job.status == IngestionJob.STATUS_DONE or job.pages_done > 0,
+        'attempts': job.attempts,
+        'error': job.error,
+        'timestamp': job.updated_at.timestamp(),
+    }
+
+
+def latest_jobs_by_filename(filenames=None, job_ids=None, since=None):
+    """Most recent job per filename, optionally restricted to filenames, job ids or recently updated jobs."""
+    jobs = IngestionJob.objects.order_by('filename', '-created_at')
+    if filenames is not None:
+        jobs = jobs.filter(filename__in=list(filenames))
+    if job_ids is not None:
+        jobs = jobs.filter(id__in=list(job_ids))
+    if since is not None:
+        jobs = jobs.filter(Q(status__in=ACTIVE_STATUSES) | Q(updated_at__gte=since))
+    latest = {}
+    for job in jobs:
+        latest.setdefault(job.filename, job)
+    return latest
+
+
+def active_filenames():
+    return set(IngestionJob.objects.filter(status__in=ACTIVE_STATUSES).values_list('filename', flat=True))
+
+
+def partially_indexed(conversation_id=None):
+    """Unfinished jobs with some pages already indexed, optionally for one conversation."""
+    jobs = IngestionJob.objects.filter(status__in=ACTIVE_STATUSES, pages_done__gt=0)
+    if conversation_id is not None:
+        jobs = jobs.filter(conversation_id=str(conversation_id))
+    return list(jobs)
+
+
+def sync_floor():
+    """
+    Where a process starts following completed jobs: the id of the oldest unfinished job,
+    or one past the newest job. Ids are assigned at enqueue time, so unlike completion
+    times they don't depend on which worker (or host clock) finishes a job first.
+    """
+    oldest_active = IngestionJob.objects.filter(status__in=ACTIVE_STATUSES).order_by('id').values_list('id', flat=True).first()
+    if oldest_active is not None:
+        return oldest_active
+    return (IngestionJob.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+
+
+def jobs_from(first_id):
+    """Jobs with id >= first_id, oldest first."""
+    return list(IngestionJob.objects.filter(id__gte=first_id).order_by('id'))
+
+
+def is_user_upload(filename):
+    """True if the file in the upload directory came in through the upload view (it is ingested per conversation)."""
+    return (
+        ConversationDocument.objects.filter(filename=filename).exists()
+        or UserDocument.objects.filter(filename=filename).exists()
+        or IngestionJob.objects.filter(filename=filename, conversation_id__isnull=False).exists()
+    )
+
+
+def content_hash_in_use(content_hash):
+    """True while any upload record or unfinished job still needs the vectors stored under content_hash."""
+    if ConversationDocument.objects.filter(content_hash=content_hash).exists():
+        return True
+    if UserDocument.objects.filter(content_hash=content_hash).exists():
+        return True
+    return IngestionJob.objects.filter(
+        Q(content_hash=content_hash) | Q(previous_content_hash=content_hash), status__in=ACTIVE_STATUSES
+    ).exists()
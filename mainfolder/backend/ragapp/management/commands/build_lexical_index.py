@@ -0,0 +1,57 @@
+"""
+Django management command to fill the lexical (BM25) index from ChromaDB
+Usage: python manage.py build_lexical_index [--rebuild] [--batch-size 1000]
+
+Ingestion keeps the lexical index of the active index generation up to date; this command
+indexes chunks stored before it existed (or while it was unavailable) and drops entries
+whose chunks are no longer in ChromaDB. --rebuild empties it first.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+import time
+
+
+class Command(BaseCommand):
+    help = 'Bring the lexical (BM25) index in step with the ChromaDB collection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Empty the lexical index and index every chunk again')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Chunks read from ChromaDB per request')
+
+    def handle(self, *args, **options):
+        from rag_app import get_chroma_collection, get_lexical_index
+
+        index = get_lexical_index()
+        if index is None:
+            raise CommandError('The lexical index is unavailable (SQLite was built without FTS5)')
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be positive')
+        if options['rebuild']:
+            index.clear()
+            self.stdout.write(f'Cleared {index.path}')
+
+        start = time.perf_counter()
+        collection = get_chroma_collection()
+        stored, added, offset = set(), 0, 0
+        while True:
+            page = collection.get(limit=options['batch_size'], offset=offset, include=['documents', 'metadatas'])
+            ids = page['ids']
+            if not ids:
+                break
+            offset += len(ids)
+            stored.update(ids)
+            indexed = index.indexed(ids)
+            missing = [i for i, chunk_id in enumerate(ids) if chunk_id not in indexed]
+            if missing:
+                index.upsert([ids[i] for i in missing], [page['documents'][i] for i in missing],
+                             [page['metadatas'][i] for i in missing])
+                added += len(missing)
+            self.stdout.write(f'[LEXICAL] {offset} chunks checked, {added} indexed')
+
+        stale = list(index.chunk_ids() - stored)
+        if stale:
+            index.delete(ids=stale)
+        self.stdout.write(self.style.SUCCESS(
+            f'{index.path}: {index.count()} chunks ({added} added, {len(stale)} stale entries dropped) '
+            f'in {time.perf_counter() - start:.1f}s'
+        ))
@@ -0,0 +1,68 @@
+"""
+Django management command that compares word-budget and token-budget chunking
+Usage: python manage.py chunking_report [FILE ...] [--limit N]
+
+Parses and chunks PDFs (no embedding, nothing stored) and reports how many
+embedding-model tokens each mode produces and how many the model truncates.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+import os
+import time
+
+
+class Command(BaseCommand):
+    help = 'Report chunk counts and tokens truncated by the embedding model for each chunking budget'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'files',
+            nargs='*',
+            help='PDFs to analyse (default: every PDF in uploaded_pdfs)',
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=0,
+            help='Only analyse the first N PDFs (0 = all)',
+        )
+
+    def handle(self, *args, **options):
+        from rag_app import SentenceChunker, get_tokenizer, measure_truncation, parse_pdf, pdf_dir
+
+        paths = options['files']
+        if not paths and os.path.isdir(pdf_dir):
+            paths = sorted(os.path.join(pdf_dir, f) for f in os.listdir(pdf_dir) if f.lower().endswith('.pdf'))
+        if options['limit']:
+            paths = paths[:options['limit']]
+        if not paths:
+            raise CommandError('No PDFs to analyse')
+
+        max_length = get_tokenizer()[1]
+        chunkers = {budget: SentenceChunker(budget=budget) for budget in ('words', 'tokens')}
+        totals = {budget: {'chunks': 0, 'tokens': 0, 'truncated_chunks': 0, 'truncated_tokens': 0, 'seconds': 0.0}
+                  for budget in chunkers}
+
+        for path in paths:
+            try:
+                pages = [page_info['text'] for page_info in parse_pdf(path)['pages']]
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'ERROR: Could not parse {path}: {e}'))
+                continue
+            for budget, chunker in chunkers.items():
+                start = time.perf_counter()
+                chunks = [chunk for page_chunks in chunker.chunk_many(pages) for chunk in page_chunks]
+                totals[budget]['seconds'] += time.perf_counter() - start
+                for key, value in measure_truncation(chunks).items():
+                    totals[budget][key] += value
+            self.stdout.write(f'Analysed {os.path.basename(path)}')
+
+        self.stdout.write(f'\nEmbedding model limit: {max_length} tokens per chunk ({len(paths)} PDFs)')
+        for budget, stats in totals.items():
+            share = 100.0 * stats['truncated_tokens'] / stats['tokens'] if stats['tokens'] else 0.0
+            average = stats['tokens'] / stats['chunks'] if stats['chunks'] else 0.0
+            self.stdout.write(
+                f"{budget:>6}: {stats['chunks']} chunks, {average:.0f} tokens/chunk, "
+                f"{stats['truncated_chunks']} truncated, {stats['truncated_tokens']}/{stats['tokens']} tokens "
+                f"({share:.1f}%) never embedded, chunking {stats['seconds']:.2f}s"
+            )
@@ -0,0 +1,34 @@
+"""
+Django management command to inspect or clear the persistent embedding cache
+Usage: python manage.py embedding_cache [--clear]
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Show size and usage of the embedding cache, or clear it'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Delete every cached embedding',
+        )
+
+    def handle(self, *args, **options):
+        from rag_app import get_embedding_cache
+
+        cache = get_embedding_cache()
+        if cache is None:
+            raise CommandError('The embedding cache is disabled (RAG_EMBED_CACHE_MB=0)')
+        if options['clear']:
+            cache.clear()
+            self.stdout.write(self.style.SUCCESS(f'Cleared {cache.path}'))
+
+        stats = cache.stats()
+        self.stdout.write(f'Cache file: {cache.path}')
+        self.stdout.write(
+            f"Entries: {stats['entries']} ({stats['bytes'] / (1024 * 1024):.1f} MB of vectors, "
+            f"limit {stats['max_bytes'] / (1024 * 1024):.0f} MB)"
+        )
@@ -0,0 +1,144 @@
+"""
+Django management command that benchmarks hybrid (dense + BM25) retrieval against the two-step path
+Usage: python manage.py hybrid_benchmark [--chunks 20000] [--queries 30] [--backend memory store] [--fusion rrf|weighted]
+
+Builds a synthetic corpus in a temporary ChromaDB collection, lexical index, embedding cache
+and chunk store (the real ones are left untouched): chunks are random text with a few
+keywords of one of --topics topics and a unique part number, and embeddings are their
+topic's vector plus noise, normalised like the model's. Two kinds of questions are timed
+through process_query_with_tfidf in both retrieval modes:
+  - topical questions using a topic's keywords, embedded near that topic; precision@5
+    counts results from that topic;
+  - exact-term questions naming one chunk's part number, embedded near its topic like a
+    real embedding would be; recall@5 counts how often that chunk is returned.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+import contextlib
+import io
+import os
+import shutil
+import tempfile
+import time
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark hybrid dense + lexical retrieval against dense retrieval with lexical re-scoring'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunks', type=int, default=20000, help='Chunks in the synthetic corpus')
+        parser.add_argument('--queries', type=int, default=30, help='Questions of each kind')
+        parser.add_argument('--dim', type=int, default=384, help='Embedding dimension (all-MiniLM-L6-v2: 384)')
+        parser.add_argument('--topics', type=int, default=50, help='Topics the corpus is spread over')
+        parser.add_argument('--words', type=int, default=120, help='Words per chunk')
+        parser.add_argument('--backend', nargs='+', default=['memory', 'store'], choices=['memory', 'store'],
+                            help='Retrieval backends to time (see RAG_RETRIEVAL_BACKEND)')
+        parser.add_argument('--fusion', default=None, choices=['rrf', 'weighted'],
+                            help='Fusion for the hybrid mode (default: RAG_HYBRID_FUSION)')
+
+    def handle(self, *args, **options):
+        import numpy as np
+        import chromadb
+        import rag_app
+
+        if options['chunks'] < options['topics'] or options['queries'] <= 0:
+            raise CommandError('--chunks must be at least --topics, and --queries positive')
+        rng = np.random.default_rng(0)
+        dim, size = options['dim'], options['chunks']
+        saved = {name: getattr(rag_app, name) for name in
+                 ('_collection', '_lexical_index', '_embedding_cache', 'RETRIEVAL_MODE', 'RETRIEVAL_BACKEND', 'HYBRID_FUSION')}
+        workdir = tempfile.mkdtemp(prefix='hybrid_benchmark_')
+        client = chromadb.EphemeralClient()
+        collection_name = f'hybrid_benchmark_{os.getpid()}'
+        try:
+            collection = client.create_collection(collection_name)
+            rag_app._collection = collection
+            rag_app._lexical_index = rag_app.LexicalIndex(os.path.join(workdir, 'lexical_index.sqlite3'))
+            rag_app._embedding_cache = rag_app.EmbeddingCache(os.path.join(workdir, 'embeddings.sqlite3'))
+            if options['fusion']:
+                rag_app.HYBRID_FUSION = options['fusion']
+
+            # Corpus: Zipf-distributed words, a topic per chunk and a unique part number
+            vocabulary = np.array([
+                ''.join(rng.choice(list('abcdefghijklmnopqrstuvwxyz'), int(length)))
+                for length in rng.integers(3, 10, 5000)
+            ])
+            word_weights = 1.0 / np.arange(1, len(vocabulary) + 1)
+            word_weights /= word_weights.sum()
+            topic_vectors = rng.standard_normal((options['topics'], dim)).astype(np.float32)
+            topic_words = rng.choice(vocabulary[len(vocabulary) // 2:], (options['topics'], 8), replace=False)
+            topics = rng.integers(0, options['topics'], size)
+
+            def embed_near(topic_numbers):
+                vectors = topic_vectors[topic_numbers] + 0.5 * rng.standard_normal((len(topic_numbers), dim)).astype(np.float32)
+                return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+            store = rag_app.ChunkStore()
+            writer = rag_app.ChromaBatchWriter(batch_size=2000, collection=collection)
+            start = time.perf_counter()
+            for offset in range(0, size, 2000):
+                count = min(2000, size - offset)
+                words = rng.choice(vocabulary, (count, options['words']), p=word_weights)
+                keywords = topic_words[topics[offset:offset + count][:, None], rng.integers(0, 8, (count, 4))]
+                embeddings = embed_near(topics[offset:offset + count])
+                for i in range(count):
+                    number = offset + i
+                    text = f"{' '.join(words[i])} {' '.join(keywords[i])}. Part PN-{number:06d} applies."
+                    metadata = {'id': f'bench_{number}', 'type': 'pdf_chunk', 'source_pdf': f'doc{number // 200}.pdf',
+                                'conversation_id': 'global', 'page_no': number % 200 + 1, 'chunk_index': number % 200,
+                                'page_chunk_index': 0}
+                    writer.add(metadata['id'], text, embeddings[i], metadata)
+                    store.add(text, metadata, embeddings[i])
+            writer.close()
+            self.stdout.write(f'Indexed {size:,} chunks in {time.perf_counter() - start:.1f}s')
+
+            # Questions; their embeddings go in the temporary cache so no model is needed
+            questions = []
+            for q in range(options['queries']):
+                topic = int(rng.integers(options['topics']))
+                questions.append(('topical', f"what about {' '.join(rng.choice(topic_words[topic], 3, replace=False))}", topic, None))
+                target = int(rng.integers(size))
+                questions.append(('exact', f'which procedure covers part PN-{target:06d}', int(topics[target]), f'bench_{target}'))
+            vectors = embed_near(np.array([topic for _, _, topic, _ in questions]))
+            rag_app._embedding_cache.put_many(
+                (rag_app._embedding_cache.key(text), vector) for (_, text, _, _), vector in zip(questions, vectors)
+            )
+
+            for backend in options['backend']:
+                rag_app.RETRIEVAL_BACKEND = backend
+                custom = store.chunks if backend == 'memory' else None
+                for mode in ('two-step', 'hybrid'):
+                    rag_app.RETRIEVAL_MODE = mode
+                    timings, found, precise = [], 0, []
+                    for kind, text, topic, target in questions:
+                        with contextlib.redirect_stdout(io.StringIO()):
+                            began = time.perf_counter()
+                            results = rag_app.process_query_with_tfidf(
+                                text, top_k=10, similarity_threshold=0.3, tfidf_threshold=0.05,
+                                custom_chunks=custom, custom_embeddings=custom.embeddings if custom is not None else None
+                            ) or []
+                            timings.append(time.perf_counter() - began)
+                        ids = [chunk.get('document_id') for chunk in results[:5]]
+                        if kind == 'exact':
+                            found += target in ids
+                        elif ids:
+                            precise.append(sum(topics[int(chunk_id.rpartition('_')[2])] == topic for chunk_id in ids) / len(ids))
+                    self.stdout.write(
+                        f'{backend:>6} {mode:>8}: p50 {_percentile(timings, 0.5) * 1000:.1f} ms, '
+                        f'p95 {_percentile(timings, 0.95) * 1000:.1f} ms | exact-term recall@5 {found / options["queries"]:.0%} | '
+                        f'topical precision@5 {sum(precise) / max(1, len(precise)):.0%}'
+                    )
+        finally:
+            for name, value in saved.items():
+                setattr(rag_app, name, value)
+            try:
+                client.delete_collection(collection_name)
+            except Exception:
+                pass
+            shutil.rmtree(workdir, ignore_errors=True)
+        self.stdout.write(self.style.SUCCESS('Done'))
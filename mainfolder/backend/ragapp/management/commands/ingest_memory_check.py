@@ -0,0 +1,105 @@
+"""
+Django management command that checks ingestion memory stays bounded
+Usage: python manage.py ingest_memory_check [--pages 2000] [--ceiling-mb 64]
+
+Generates a large synthetic PDF, ingests it into a throwaway ChromaDB collection and
+fails if the peak Python heap used by process_pdf exceeds the ceiling, or grows with
+document length (compared against a document a quarter of the size).
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+import os
+import shutil
+import tempfile
+import time
+
+
+_VOCABULARY = (
+    "analysis budget contract delivery estimate finding growth harbour index journal kernel ledger margin "
+    "network outcome policy quarter revenue schedule tenant update vendor warranty yield zone"
+).split()
+
+
+def _make_pdf(path, pages, words_per_page):
+    import random
+    import fitz
+    # Varied text, so boilerplate stripping and near-duplicate collapsing leave it alone
+    rng = random.Random(pages)
+    doc = fitz.open()
+    for page_num in range(pages):
+        body = " ".join(
+            " ".join(rng.choice(_VOCABULARY) for _ in range(7)).capitalize() + "." for _ in range(words_per_page // 7)
+        )
+        doc.new_page().insert_textbox(fitz.Rect(36, 36, 576, 806), body, fontsize=6)
+    doc.save(path)
+    doc.close()
+
+
+class Command(BaseCommand):
+    help = 'Ingest a large synthetic PDF and check peak ingestion memory against a ceiling'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pages',
+            type=int,
+            default=2000,
+            help='Pages in the synthetic document',
+        )
+        parser.add_argument(
+            '--words-per-page',
+            type=int,
+            default=400,
+            help='Approximate words of text on each synthetic page',
+        )
+        parser.add_argument(
+            '--ceiling-mb',
+            type=float,
+            default=64.0,
+            help='Maximum allowed peak Python heap (tracemalloc) during process_pdf',
+        )
+        parser.add_argument(
+            '--max-growth',
+            type=float,
+            default=1.5,
+            help='Maximum allowed ratio of peak memory for the full document vs a quarter-size one',
+        )
+
+    def handle(self, *args, **options):
+        import tracemalloc
+        import chromadb
+        import rag_app
+
+        tmp_dir = tempfile.mkdtemp(prefix='ingest_memory_check_')
+        saved = (rag_app._collection, rag_app.log_file, rag_app.stats_dir)
+        try:
+            # Keep the real collection, CSV log and stats cache untouched
+            rag_app._collection = chromadb.PersistentClient(path=os.path.join(tmp_dir, 'chroma')).get_or_create_collection('memory_check')
+            rag_app.log_file = os.path.join(tmp_dir, 'time_report_ingestion.csv')
+            rag_app.stats_dir = tmp_dir
+
+            # Load the model and segmenter first so they don't count towards the pipeline's peak
+            rag_app.embed_texts(['warm up'])
+            rag_app.get_chunker().nlp
+
+            peaks = {}
+            for pages in (max(1, options['pages'] // 4), options['pages']):
+                path = os.path.join(tmp_dir, f'synthetic_{pages}.pdf')
+                _make_pdf(path, pages, options['words_per_page'])
+                tracemalloc.start()
+                start = time.perf_counter()
+                rag_app.process_pdf(path, os.path.basename(path), None, raise_errors=True, keep_in_memory=False)
+                elapsed = time.perf_counter() - start
+                peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+                tracemalloc.stop()
+                peaks[pages] = peak
+                self.stdout.write(f'{pages} pages: peak {peak:.1f} MB, {elapsed:.1f}s')
+        finally:
+            rag_app._collection, rag_app.log_file, rag_app.stats_dir = saved
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        small, large = (peaks[pages] for pages in sorted(peaks))
+        if large > options['ceiling_mb']:
+            raise CommandError(f'Peak ingestion memory {large:.1f} MB exceeds the {options["ceiling_mb"]:.1f} MB ceiling')
+        if small and large / small > options['max_growth']:
+            raise CommandError(f'Peak memory grew {large / small:.2f}x with document length (allowed {options["max_growth"]:.2f}x)')
+        self.stdout.write(self.style.SUCCESS(f'Ingestion memory bounded: peak {large:.1f} MB'))
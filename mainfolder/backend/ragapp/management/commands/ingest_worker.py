@@ -0,0 +1,150 @@
+"""
+Django management command that drains the ingestion job queue
+Usage: python manage.py ingest_worker [--once] [--worker-id ID]
+
+Run as many worker processes as needed, on one or more hosts sharing the database.
+"""
+
+from django.core.management.base import BaseCommand
+import os
+import time
+from datetime import datetime
+
+
+class Command(BaseCommand):
+    help = 'Process queued PDF ingestion jobs from the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--worker-id',
+            default=None,
+            help='Lease owner name for this worker (default: hostname:pid)',
+        )
+        parser.add_argument(
+            '--lease-seconds',
+            type=int,
+            default=300,
+            help='How long a claimed job stays leased without a progress update',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait between polls when the queue is empty',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit when the queue is empty instead of polling forever',
+        )
+        parser.add_argument(
+            '--max-jobs',
+            type=int,
+            default=0,
+            help='Exit after processing this many jobs (0 = unlimited)',
+        )
+
+    def handle(self, *args, **options):
+        from ragapp import ingestion_queue as queue
+
+        worker_id = options['worker_id'] or queue.default_worker_id()
+        lease_seconds = options['lease_seconds']
+        processed = 0
+        self.stdout.write(
+            self.style.SUCCESS(f'Ingestion worker {worker_id} started at {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}')
+        )
+
+        while True:
+            abandoned = queue.fail_abandoned_jobs()
+            if abandoned:
+                self.stdout.write(self.style.WARNING(f'Marked {abandoned} abandoned job(s) as failed'))
+
+            job = queue.claim_next_job(worker_id, lease_seconds)
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            try:
+                self.run_job(queue, job, worker_id, lease_seconds)
+            except KeyboardInterrupt:
+                queue.release_job(job, worker_id)
+                self.stdout.write(self.style.WARNING(f'Interrupted; job {job.id} returned to the queue'))
+                return
+
+            processed += 1
+            if options['max_jobs'] and processed >= options['max_jobs']:
+                break
+
+        self.stdout.write(self.style.SUCCESS(f'Worker {worker_id} processed {processed} job(s)'))
+
+    def run_job(self, queue, job, worker_id, lease_seconds):
+        from rag_app import process_pdf, PROGRESSIVE_FIRST_PAGES
+
+        self.stdout.write(f'[job {job.id}] {job.action} {job.filename} (attempt {job.attempts}/{job.max_attempts})')
+        if job.action == job.ACTION_REMOVE:
+            self.remove_document(queue, job, worker_id)
+            return
+        if not os.path.isfile(job.file_path):
+            queue.fail_job(job, worker_id, f'File not found: {job.file_path}', retry=False)
+            return
+
+        pages = {'done': 0, 'total': 0}
+
+        def on_progress(pages_done, pages_total):
+            pages['done'], pages['total'] = pages_done, pages_total
+            if not queue.report_progress(job, worker_id, pages_done, pages_total, lease_seconds):
+                self.stdout.write(self.style.WARNING(f'[job {job.id}] lease lost to another worker'))
+
+        # New jobs index only their first pages, then go back on the queue at background
+        # priority; the background run reuses those pages and indexes the rest.
+        first_pass = not job.background and PROGRESSIVE_FIRST_PAGES > 0
+
+        start = time.perf_counter()
+        try:
+            process_pdf(
+                job.file_path, job.filename, job.conversation_id,
+                progress_callback=on_progress, raise_errors=True, content_hash=job.content_hash or None,
+                previous_content_hash=job.previous_content_hash or None,
+                # The web process loads finished documents from the store; don't hold them here too
+                keep_in_memory=False,
+                max_pages=PROGRESSIVE_FIRST_PAGES if first_pass else None
+            )
+        except Exception as e:
+            queue.fail_job(job, worker_id, e)
+            self.stdout.write(self.style.ERROR(f'[job {job.id}] failed: {e}'))
+            return
+
+        if first_pass and pages['done'] < pages['total']:
+            queue.defer_job(job, worker_id)
+            self.stdout.write(f'[job {job.id}] first {PROGRESSIVE_FIRST_PAGES} pages indexed, rest queued at background priority')
+            return
+
+        queue.complete_job(job, worker_id)
+        self.stdout.write(self.style.SUCCESS(f'[job {job.id}] done in {time.perf_counter() - start:.2f}s'))
+        self.release_previous_content(queue, job)
+
+    def remove_document(self, queue, job, worker_id):
+        from rag_app import remove_document
+
+        try:
+            remove_document(job.filename, job.conversation_id, job.file_path)
+        except Exception as e:
+            queue.fail_job(job, worker_id, e)
+            self.stdout.write(self.style.ERROR(f'[job {job.id}] removal failed: {e}'))
+            return
+        queue.complete_job(job, worker_id)
+        self.stdout.write(self.style.SUCCESS(f'[job {job.id}] removed {job.filename}'))
+
+    def release_previous_content(self, queue, job):
+        """Drop the replaced version's vectors once no upload or pending job refers to them."""
+        from rag_app import delete_content
+
+        previous = job.previous_content_hash
+        if not previous or previous == job.content_hash or queue.content_hash_in_use(previous):
+            return
+        try:
+            delete_content(previous)
+        except Exception as e:
+            self.stdout.write(self.style.WARNING(f'[job {job.id}] could not delete old content {previous[:12]}: {e}'))
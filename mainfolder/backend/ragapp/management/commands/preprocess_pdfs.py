@@ -1,14 +1,55 @@
 """
 Django management command to preprocess all PDFs before users login
-Usage: python manage.py preprocess_pdfs
+Usage: python manage.py preprocess_pdfs [--workers N] [--force]
+
+Progress is journaled (see rag_app.IngestionJournal), so a run that is killed part-way
+can be started again: finished documents are skipped and the interrupted one resumes.
+With --workers, pages already stored with the same fingerprint are not embedded again.
 """
 
 from django.core.management.base import BaseCommand, CommandError
-from django.conf import settings
 import os
 import time
 from datetime import datetime
 
+
+def _parse_and_chunk(file_path):
+    """Pool worker: parse and chunk one PDF. Runs in a child process, so it must stay top-level."""
+    from rag_app import chunk_pdf
+    filename = os.path.basename(file_path)
+    try:
+        parsed, records = chunk_pdf(file_path)
+        return filename, file_path, parsed, records, None
+    except Exception as e:
+        return filename, file_path, None, [], str(e)
+
+
+def _reusable_pages(filename, records):
+    """
+    Pages of a globally stored document whose chunks can be kept as they are: the stored
+    page fingerprint matches and the page has exactly the chunk ids (and collapsed
+    near-duplicate pages) the new records would write, as after an interrupted run.
+    """
+    from collections import defaultdict
+    from rag_app import _chunk_doc_id, _document_selector, _format_pages, get_chroma_collection, stored_page_fingerprints
+
+    selector = _document_selector(filename, "global")
+    fingerprints = stored_page_fingerprints(selector)
+    if not fingerprints:
+        return set()
+    stored = defaultdict(dict)
+    results = get_chroma_collection().get(where=selector, include=['metadatas'])
+    for chunk_id, metadata in zip(results['ids'], results['metadatas']):
+        stored[metadata.get('page_no')][chunk_id] = metadata.get('duplicate_pages') or None
+    wanted = defaultdict(dict)
+    page_hashes = {}
+    for page_no, page_chunk_index, _, _, page_hash, duplicate_pages in records:
+        wanted[page_no][_chunk_doc_id(filename, page_no, page_chunk_index)] = _format_pages(duplicate_pages) or None
+        page_hashes[page_no] = page_hash
+    return {page_no for page_no, chunks in wanted.items()
+            if fingerprints.get(page_no) == page_hashes[page_no] and stored.get(page_no) == chunks}
+
+
 class Command(BaseCommand):
     help = 'Preprocess all PDFs and store in ChromaDB before users login'
 
@@ -16,13 +57,19 @@ class Command(BaseCommand):
         parser.add_argument(
             '--force',
             action='store_true',
-            help='Force reprocessing even if ChromaDB already has data',
+            help='Ignore the ingestion journal and reprocess every PDF',
         )
         parser.add_argument(
             '--verbose',
             action='store_true',
             help='Show detailed processing information',
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Parse and chunk PDFs in N processes; embedding is batched across files and stored by one writer',
+        )
 
     def handle(self, *args, **options):
         start_time = time.time()
@@ -32,27 +79,10 @@ class Command(BaseCommand):
         
         try:
             # Import here to avoid import errors during Django setup
-            from rag_app import chroma_client, collection_name, process_pdf
-            
-            # Check if ChromaDB already has data
-            if not options['force']:
-                try:
-                    collection = chroma_client.get_collection(collection_name)
-                    count = collection.count()
-                    if count > 0:
-                        self.stdout.write(
-                            self.style.WARNING(f'WARNING: ChromaDB already contains {count} documents')
-                        )
-                        if not options['force']:
-                            self.stdout.write(
-                                self.style.SUCCESS('SUCCESS: Skipping preprocessing - use --force to reprocess')
-                            )
-                            return
-                except:
-                    pass
+            from rag_app import IngestionJournal, get_chroma_collection, ingest_pdfs, pdf_dir
             
             # Get PDF directory
-            upload_dir = os.path.join(settings.BASE_DIR, 'uploaded_pdfs')
+            upload_dir = pdf_dir
             
             if not os.path.exists(upload_dir):
                 raise CommandError(f'ERROR: PDF directory not found: {upload_dir}')
@@ -67,32 +97,37 @@ class Command(BaseCommand):
                 self.style.SUCCESS(f'Found {len(pdf_files)} PDF files to process')
             )
             
-            # Process each PDF
-            processed_count = 0
-            errors = []
+            # Documents the journal records as finished (and still stored) are skipped
+            journal = IngestionJournal()
+            journal.prepare(options['force'])
+            pending_files = [f for f in pdf_files if not journal.is_done(f, os.path.join(upload_dir, f))]
+            skipped_count = len(pdf_files) - len(pending_files)
+            if skipped_count:
+                self.stdout.write(f'Skipping {skipped_count} PDFs already ingested (journal: {journal.path})')
             
-            for i, filename in enumerate(pdf_files, 1):
-                try:
-                    file_path = os.path.join(upload_dir, filename)
-                    
+            # Process each PDF
+            if not pending_files:
+                processed_count, errors = 0, []
+            elif options['workers'] > 1:
+                processed_count, errors = self.process_parallel(upload_dir, pending_files, options['workers'], journal)
+            else:
+                def announce(i, filename):
                     if options['verbose']:
-                        self.stdout.write(f'[{i}/{len(pdf_files)}] Processing: {filename}')
+                        self.stdout.write(f'[{i}/{len(pending_files)}] Processing: {filename}')
                     else:
-                        self.stdout.write(f'Processing: {filename} ({i}/{len(pdf_files)})')
-                    
-                    # Process the PDF
-                    process_pdf(file_path, filename, None)
-                    processed_count += 1
-                    
-                    if options['verbose']:
-                        self.stdout.write(
-                            self.style.SUCCESS(f'SUCCESS: Successfully processed: {filename}')
-                        )
-                    
-                except Exception as e:
-                    error_msg = f'ERROR: Failed to process {filename}: {str(e)}'
-                    errors.append(error_msg)
+                        self.stdout.write(f'Processing: {filename} ({i}/{len(pending_files)})')
+
+                processed, _, failures = ingest_pdfs(
+                    [os.path.join(upload_dir, f) for f in pending_files], journal=journal, on_start=announce,
+                    keep_in_memory=False
+                )
+                processed_count = len(processed)
+                errors = [f'ERROR: {failure}' for failure in failures]
+                for error_msg in errors:
                     self.stdout.write(self.style.ERROR(error_msg))
+                if options['verbose']:
+                    for filename in processed:
+                        self.stdout.write(self.style.SUCCESS(f'SUCCESS: Successfully processed: {filename}'))
             
             # Final status
             end_time = time.time()
@@ -102,7 +137,7 @@ class Command(BaseCommand):
             self.stdout.write(
                 self.style.SUCCESS(f'PDF Preprocessing Complete!')
             )
-            self.stdout.write(f'Successfully processed: {processed_count}/{len(pdf_files)} PDFs')
+            self.stdout.write(f'Successfully processed: {processed_count}/{len(pending_files)} PDFs ({skipped_count} already ingested)')
             self.stdout.write(f'Processing time: {processing_time:.2f} seconds')
             
             if errors:
@@ -114,7 +149,7 @@ class Command(BaseCommand):
             
             # Verify ChromaDB
             try:
-                collection = chroma_client.get_collection(collection_name)
+                collection = get_chroma_collection()
                 final_count = collection.count()
                 self.stdout.write(
                     self.style.SUCCESS(f'ChromaDB now contains {final_count} document chunks')
@@ -130,3 +165,102 @@ class Command(BaseCommand):
             
         except Exception as e:
             raise CommandError(f'ERROR: Preprocessing failed: {str(e)}')
+
+    def process_parallel(self, upload_dir, pdf_files, workers, journal):
+        """
+        Parse/chunk in a process pool, embed in batches that span files in this process,
+        and write through a single ChromaBatchWriter. A file is journaled as done once all
+        of its chunks are flushed and its stale chunks pruned.
+        """
+        import multiprocessing
+        from rag_app import (
+            ChromaBatchWriter, EMBED_WINDOW, embed_texts, save_pdf_stats, _store_chunk, _chunk_doc_id, _document_selector
+        )
+
+        store_writer = ChromaBatchWriter()
+        pending = []  # (filename, page_no, page_chunk_index, chunk_index, chunk_text, page_hash, duplicate_pages)
+        kept_ids = {}  # filename -> ids written this run; anything else stored for the file is stale
+        remaining = {}  # filename -> chunks not yet written
+        page_counts = {}
+        errors = []
+        totals = {'files': 0, 'pages': 0, 'chunks': 0, 'reused_pages': 0, 'embed': 0.0}
+        start = time.perf_counter()
+
+        def embed_pending():
+            embed_start = time.perf_counter()
+            embeddings = embed_texts([record[4] for record in pending])
+            totals['embed'] += time.perf_counter() - embed_start
+            for (filename, page_no, page_chunk_index, chunk_index, chunk, page_hash, duplicate_pages), embedding in zip(pending, embeddings):
+                _store_chunk(
+                    store_writer, filename, None, page_no, page_chunk_index, chunk_index, chunk, embedding,
+                    keep_in_memory=False, page_hash=page_hash, duplicate_pages=duplicate_pages
+                )
+            totals['chunks'] += len(pending)
+            batch_pages = {}
+            for record in pending:
+                remaining[record[0]] -= 1
+                batch_pages[record[0]] = max(batch_pages.get(record[0], 0), record[1])
+            pending.clear()
+            store_writer.flush()
+            for filename, last_page in batch_pages.items():
+                if remaining[filename]:
+                    journal.progress(filename, last_page, page_counts[filename])
+                else:
+                    finish(filename)
+
+        def finish(filename):
+            store_writer.prune(_document_selector(filename, "global"), kept_ids[filename])
+            journal.finish(filename, len(kept_ids[filename]))
+
+        def progress():
+            elapsed = time.perf_counter() - start
+            rate = totals['chunks'] / elapsed if elapsed > 0 else 0.0
+            self.stdout.write(
+                f"\r[{totals['files']}/{len(pdf_files)} files] {totals['pages']} pages, "
+                f"{totals['chunks']} chunks stored, {rate:.1f} chunks/s",
+                ending=''
+            )
+            self.stdout.flush()
+
+        paths = [os.path.join(upload_dir, f) for f in pdf_files]
+        self.stdout.write(f'Parsing with {workers} worker processes...')
+        with multiprocessing.Pool(processes=workers) as pool:
+            for filename, file_path, parsed, records, error in pool.imap_unordered(_parse_and_chunk, paths):
+                totals['files'] += 1
+                journal.start(filename, file_path)
+                if error:
+                    journal.fail(filename, error)
+                    errors.append(f'ERROR: Failed to process {filename}: {error}')
+                    progress()
+                    continue
+                save_pdf_stats(file_path, parsed)
+                totals['pages'] += parsed['page_count']
+                page_counts[filename] = parsed['page_count']
+                kept_ids[filename] = {_chunk_doc_id(filename, record[0], record[1]) for record in records}
+                # Pages stored by an earlier (e.g. interrupted) run are kept, not re-embedded
+                reused = _reusable_pages(filename, records)
+                if reused:
+                    records = [record for record in records if record[0] not in reused]
+                    totals['reused_pages'] += len(reused)
+                remaining[filename] = len(records)
+                if not records:
+                    finish(filename)
+                pending.extend((filename,) + tuple(record) for record in records)
+                if len(pending) >= EMBED_WINDOW:
+                    embed_pending()
+                progress()
+        if pending:
+            embed_pending()
+        store_writer.close()
+        progress()
+        self.stdout.write('')
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Throughput: {totals['pages'] / elapsed:.2f} pages/s, {totals['chunks'] / elapsed:.2f} chunks/s, "
+                f"{totals['reused_pages']} stored pages reused "
+                f"(embed {totals['embed']:.2f}s, store {store_writer.store_time:.2f}s, total {elapsed:.2f}s)"
+            )
+        )
+        return len(kept_ids), errors
@@ -0,0 +1,291 @@
+"""
+Django management command that re-indexes every document into a new index generation
+Usage: python manage.py rebuild_index [--model NAME] [--chunker MODE] [--chunk-budget tokens|words]
+                                      [--overlap-tokens N] [--no-switch] [--keep-old] [--status]
+
+Blue/green re-indexing for embedding model or chunker changes. The documents of the active
+generation are re-ingested from their PDFs into a new ChromaDB collection tagged with the
+new settings, while the web process and ingest workers keep reading and writing the active
+one. Once every document is in the new collection, the registry is switched over in one
+atomic write; serving processes follow within RAG_INDEX_CHECK_SECONDS, and after --grace
+seconds documents added to the old generation in the meantime are caught up and the old
+generation is dropped. Progress and throughput are logged and kept in the registry, where
+`--status` (or GET /system-status/) reads them. An interrupted rebuild resumes where it stopped.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+import os
+import time
+
+
+def _document_key(document):
+    if document['content_hash']:
+        return f"sha256:{document['content_hash']}"
+    if document['scope'] == 'global':
+        return document['filename']
+    return f"{document['scope']}/{document['filename']}"
+
+
+class Command(BaseCommand):
+    help = 'Re-index all documents into a new index generation alongside the active one, then switch over'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default=None, help='Embedding model (default: RAG_EMBED_MODEL)')
+        parser.add_argument('--chunker', default=None, help='Chunker mode (default: RAG_CHUNKER)')
+        parser.add_argument('--chunk-budget', default=None, choices=['tokens', 'words'],
+                            help='Chunk budget (default: RAG_CHUNK_BUDGET)')
+        parser.add_argument('--overlap-tokens', type=int, default=None,
+                            help='Token overlap between chunks (default: RAG_CHUNK_OVERLAP_TOKENS)')
+        parser.add_argument('--force', action='store_true',
+                            help='Rebuild even if the active generation already uses these settings')
+        parser.add_argument('--no-switch', action='store_true',
+                            help='Build and verify the new generation but leave the active one in place')
+        parser.add_argument('--keep-old', action='store_true',
+                            help='Keep the previous generation\'s collection after switching')
+        parser.add_argument('--allow-missing', action='store_true',
+                            help='Switch even if some documents\' PDFs are gone and could not be re-indexed')
+        parser.add_argument('--grace', type=float, default=30.0,
+                            help='Seconds between the switch and dropping the previous generation')
+        parser.add_argument('--status', action='store_true', help='Show the active generation and rebuild progress')
+
+    def handle(self, *args, **options):
+        import rag_app
+
+        rag_app.get_index_generation()
+        registry = rag_app.current_index_registry()
+        if options['status']:
+            self.show_status(registry)
+            return
+
+        active = registry['active']
+        configured = rag_app.CONFIGURED_INDEX_SETTINGS
+        settings = {
+            'embed_model': options['model'] or configured['embed_model'],
+            'chunker': options['chunker'] or configured['chunker'],
+            'chunk_budget': options['chunk_budget'] or configured['chunk_budget'],
+            'chunk_overlap_tokens': configured['chunk_overlap_tokens'] if options['overlap_tokens'] is None else options['overlap_tokens'],
+        }
+        if settings['chunker'] not in rag_app.CHUNKER_PIPELINES:
+            raise CommandError(f"Unknown chunker mode {settings['chunker']!r}; expected one of {sorted(rag_app.CHUNKER_PIPELINES)}")
+
+        building = registry.get('building')
+        if building and rag_app.index_settings_of(building) == settings:
+            generation = building
+            self.stdout.write(f"Resuming rebuild of {generation['collection']}")
+        else:
+            if rag_app.index_settings_of(active) == settings and not options['force']:
+                self.stdout.write(self.style.SUCCESS(f"The active generation {active['collection']} already uses {settings}"))
+                return
+            if building:
+                self.stdout.write(self.style.WARNING(f"Abandoning the unfinished rebuild of {building['collection']}"))
+                rag_app.retire_index_generation(building)
+            generation = rag_app.new_index_generation(settings)
+            self.stdout.write(f"Building {generation['collection']} with {settings}")
+        generation.pop('progress', None)
+        self.registry = dict(registry, building=generation)
+        self.progress = {'documents': 0, 'documents_total': 0, 'pages': 0, 'chunks': 0,
+                         'started_at': time.time(), 'updated_at': time.time()}
+        self.save_progress(force=True)
+
+        source = rag_app.get_chroma_client().get_collection(active['collection'])
+        rag_app.use_index_generation(generation)
+        self.target = rag_app.get_chroma_collection()
+        self.journal = rag_app.IngestionJournal(
+            os.path.join(rag_app.index_cache_dir(generation), 'rebuild_journal.sqlite3')
+        )
+        self.missing, self.errors = {}, {}
+        try:
+            documents = self.rebuild(source)
+            self.remove_deleted(documents)
+            self.verify(documents, options['allow_missing'])
+            self.report(final=True)
+            if options['no_switch']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"{generation['collection']} is built and verified; run again without --no-switch to switch over"
+                ))
+                return
+
+            registry = rag_app.current_index_registry()
+            registry['active'] = dict(generation, activated_at=time.time())
+            registry['building'] = None
+            rag_app.save_index_registry(registry)
+            self.stdout.write(self.style.SUCCESS(f"Switched the active index to {generation['collection']}"))
+
+            # Serving processes notice the switch within RAG_INDEX_CHECK_SECONDS; anything they
+            # ingested into the old generation before that is caught up before it is dropped
+            time.sleep(options['grace'])
+            self.rebuild(source, catch_up=True)
+            if options['keep_old']:
+                self.stdout.write(f"Kept the previous generation's collection {active['collection']}")
+            else:
+                rag_app.retire_index_generation(active)
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Interrupted; run the same command again to resume'))
+        finally:
+            self.journal.close()
+
+    def rebuild(self, source, catch_up=False):
+        """Re-index every document of the source collection that isn't done yet; repeats until a pass finds nothing new."""
+        import rag_app
+
+        attempted = set()
+        while True:
+            documents = rag_app.list_indexed_documents(source)
+            self.progress['documents_total'] = len(documents)
+            pending = [
+                document for document in documents
+                if _document_key(document) not in attempted and not self.is_done(document)
+            ]
+            if not pending:
+                return documents
+            self.progress['documents'] = len(documents) - len(pending)
+            if catch_up:
+                self.stdout.write(f'Catching up {len(pending)} documents changed during the switch')
+            for document in pending:
+                attempted.add(_document_key(document))
+                self.rebuild_document(document)
+
+    def source_path(self, document):
+        """The PDF a stored document was ingested from, or None if it is gone."""
+        import rag_app
+
+        filename_path = os.path.join(rag_app.pdf_dir, document['filename'] or '')
+        content_hash = document['content_hash']
+        if content_hash:
+            if os.path.isfile(rag_app.content_file_path(content_hash)):
+                return rag_app.content_file_path(content_hash)
+            if os.path.isfile(filename_path) and rag_app.hash_file(filename_path) == content_hash:
+                return filename_path
+            return None
+        return filename_path if os.path.isfile(filename_path) else None
+
+    def is_done(self, document):
+        key = _document_key(document)
+        if key in self.missing or key in self.errors:
+            return True
+        path = self.source_path(document)
+        return path is not None and self.journal.is_done(key, path)
+
+    def rebuild_document(self, document):
+        import rag_app
+
+        key = _document_key(document)
+        path = self.source_path(document)
+        if path is None:
+            self.missing[key] = document
+            self.stdout.write(self.style.WARNING(f"{key}: source PDF is gone, can't re-index it"))
+            return
+        self.journal.start(key, path)
+        pages_before = self.progress['pages']
+
+        def on_progress(pages, total):
+            self.progress['pages'] = pages_before + pages
+            self.save_progress()
+
+        scope = document['scope']
+        try:
+            rag_app.process_pdf(
+                path, document['filename'], None if scope in ('global', 'shared') else scope,
+                raise_errors=True, content_hash=document['content_hash'], keep_in_memory=False,
+                progress_callback=on_progress,
+            )
+        except Exception as e:
+            self.journal.fail(key, e)
+            self.errors[key] = str(e)
+            self.stdout.write(self.style.ERROR(f'{key}: {e}'))
+            return
+        chunks = self.count_chunks(document)
+        self.journal.finish(key, chunks)
+        self.progress['documents'] += 1
+        self.progress['chunks'] += chunks
+        self.report()
+
+    def count_chunks(self, document):
+        import rag_app
+
+        selector = rag_app._document_selector(document['filename'], document['scope'], document['content_hash'])
+        return len(self.target.get(where=selector, include=[])['ids'])
+
+    def remove_deleted(self, documents):
+        """Drop documents removed from the active generation while the rebuild ran."""
+        import rag_app
+
+        keys = {_document_key(document) for document in documents}
+        for document in rag_app.list_indexed_documents(self.target):
+            if _document_key(document) not in keys:
+                selector = rag_app._document_selector(document['filename'], document['scope'], document['content_hash'])
+                self.target.delete(where=selector)
+                if rag_app.get_lexical_index() is not None:
+                    rag_app.get_lexical_index().delete(where=selector)
+                self.stdout.write(f'{_document_key(document)}: removed from the active index during the rebuild, dropped')
+
+    def verify(self, documents, allow_missing):
+        """Every document of the active generation must have chunks in the new one, and the new one must answer a query."""
+        import rag_app
+
+        rebuilt = {_document_key(document): document['chunks'] for document in rag_app.list_indexed_documents(self.target)}
+        problems = [f'{key}: {error}' for key, error in self.errors.items()]
+        for document in documents:
+            key = _document_key(document)
+            if key not in self.missing and key not in self.errors and not rebuilt.get(key):
+                problems.append(f'{key}: no chunks in the new generation')
+        if self.missing and not allow_missing:
+            problems.append(f'{len(self.missing)} documents have no source PDF (use --allow-missing to drop them)')
+        sample = self.target.get(limit=1, include=['embeddings'])
+        if sample['ids']:
+            hit = self.target.query(query_embeddings=[list(sample['embeddings'][0])], n_results=1, include=['distances'])
+            if not hit['distances'][0] or hit['distances'][0][0] > 1e-3:
+                problems.append('the new collection does not find a stored vector when queried with it')
+        if problems:
+            for problem in problems:
+                self.stdout.write(self.style.ERROR(problem))
+            raise CommandError(
+                'Verification failed; the active generation is unchanged. Fix the problems and run again to resume.'
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f'Verified {len(rebuilt)} documents ({sum(rebuilt.values())} chunks) in the new generation'
+        ))
+
+    def report(self, final=False):
+        progress = self.progress
+        elapsed = max(time.time() - progress['started_at'], 1e-6)
+        line = (
+            f"[REINDEX] {progress['documents']}/{progress['documents_total']} documents, "
+            f"{progress['pages']} pages, {progress['chunks']} chunks in {elapsed:.0f}s "
+            f"({progress['pages'] / elapsed:.1f} pages/s, {progress['chunks'] / elapsed:.1f} chunks/s)"
+        )
+        self.stdout.write(self.style.SUCCESS(line) if final else line)
+        self.save_progress(force=True)
+
+    def save_progress(self, force=False):
+        """Publish progress in the registry's building entry, at most once a second."""
+        import rag_app
+
+        now = time.time()
+        if not force and now - self.progress['updated_at'] < 1.0:
+            return
+        self.progress['updated_at'] = now
+        elapsed = max(now - self.progress['started_at'], 1e-6)
+        self.progress['pages_per_second'] = round(self.progress['pages'] / elapsed, 2)
+        self.progress['chunks_per_second'] = round(self.progress['chunks'] / elapsed, 2)
+        registry = rag_app.load_index_registry() or dict(self.registry)
+        registry['building'] = dict(self.registry['building'], progress=dict(self.progress))
+        rag_app.save_index_registry(registry)
+
+    def show_status(self, registry):
+        active = registry['active']
+        self.stdout.write(f"Active generation: {active['collection']} "
+                          f"({active['embed_model']}, {active['chunker']}, {active['chunk_budget']} budget)")
+        building = registry.get('building')
+        if not building:
+            self.stdout.write('No rebuild in progress')
+            return
+        self.stdout.write(f"Building: {building['collection']} "
+                          f"({building['embed_model']}, {building['chunker']}, {building['chunk_budget']} budget)")
+        progress = building.get('progress')
+        if progress:
+            self.stdout.write(
+                f"  {progress['documents']}/{progress['documents_total']} documents, {progress['pages']} pages, "
+                f"{progress['chunks']} chunks; {progress.get('pages_per_second', 0)} pages/s, "
+                f"{progress.get('chunks_per_second', 0)} chunks/s; updated {time.time() - progress['updated_at']:.0f}s ago"
+            )
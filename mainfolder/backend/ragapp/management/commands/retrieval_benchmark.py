@@ -0,0 +1,94 @@
+"""
+Django management command that benchmarks in-memory similarity search
+Usage: python manage.py retrieval_benchmark [--sizes 10000 100000 1000000] [--queries 20] [--top-k 10]
+
+Fills a VectorIndex with random unit vectors and reports query latency for a search over
+every chunk and over a scoped subset (e.g. one document's chunks, as with pdf_context).
+For sizes up to --loop-max, the previous per-pair cosine_similarity loop is timed as well
+and its results are checked against the vectorised search.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+import time
+
+
+def _pairwise_search(query, embeddings, top_k, threshold):
+    """The search retrieve_similar_chunks used to do: one cosine_similarity call per chunk, then a full sort."""
+    import numpy as np
+    from sklearn.metrics.pairwise import cosine_similarity
+    similarities = []
+    for chunk_id, chunk_embedding in embeddings.items():
+        similarity = cosine_similarity(np.array(query).reshape(1, -1), np.array(chunk_embedding).reshape(1, -1))[0][0]
+        similarities.append((chunk_id, similarity))
+    similarities.sort(key=lambda x: x[1], reverse=True)
+    return [(chunk_id, sim) for chunk_id, sim in similarities if sim >= threshold][:top_k]
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark vectorised in-memory similarity search at several index sizes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                            help='Numbers of chunks to index')
+        parser.add_argument('--dim', type=int, default=384, help='Embedding dimension (all-MiniLM-L6-v2: 384)')
+        parser.add_argument('--queries', type=int, default=20, help='Queries timed per size')
+        parser.add_argument('--top-k', type=int, default=10, help='Results per query')
+        parser.add_argument('--threshold', type=float, default=0.3, help='Minimum cosine similarity')
+        parser.add_argument('--scope-fraction', type=float, default=0.1,
+                            help='Fraction of chunks in the scoped (filtered) search')
+        parser.add_argument('--loop-max', type=int, default=10000,
+                            help='Also time the old per-pair loop for sizes up to this many chunks (0 = never)')
+
+    def handle(self, *args, **options):
+        import numpy as np
+        from rag_app import VectorIndex
+
+        if options['top_k'] <= 0 or options['queries'] <= 0:
+            raise CommandError('--top-k and --queries must be positive')
+        rng = np.random.default_rng(0)
+        dim = options['dim']
+        for size in options['sizes']:
+            index = VectorIndex()
+            start = time.perf_counter()
+            for offset in range(0, size, 100000):
+                block = rng.standard_normal((min(100000, size - offset), dim), dtype=np.float32)
+                index.add_many((f'chunk_{offset + i}' for i in range(len(block))), block)
+            build = time.perf_counter() - start
+
+            # Queries close to a stored chunk, so some results clear the threshold
+            targets = rng.integers(0, size, options['queries'])
+            queries = [index.matrix[target] + 0.5 * rng.standard_normal(dim, dtype=np.float32) / np.sqrt(dim) for target in targets]
+            scope = [index.keys[i] for i in np.sort(rng.choice(size, max(1, int(size * options['scope_fraction'])), replace=False))]
+
+            timings = {'all': [], 'scoped': []}
+            for query in queries:
+                start = time.perf_counter()
+                index.search(query, options['top_k'], options['threshold'])
+                timings['all'].append(time.perf_counter() - start)
+                start = time.perf_counter()
+                index.search(query, options['top_k'], options['threshold'], keys=scope)
+                timings['scoped'].append(time.perf_counter() - start)
+
+            line = (f'{size:>9,} chunks: built in {build:.2f}s ({index.matrix.nbytes / 2 ** 20:.0f} MB matrix) | '
+                    f'all p50 {_percentile(timings["all"], 0.5) * 1000:.2f} ms, p95 {_percentile(timings["all"], 0.95) * 1000:.2f} ms | '
+                    f'{len(scope):,} scoped p50 {_percentile(timings["scoped"], 0.5) * 1000:.2f} ms')
+            if size <= options['loop_max']:
+                embeddings = {key: index.matrix[i].tolist() for i, key in enumerate(index.keys)}
+                loop_times = []
+                for query in queries[:3]:
+                    start = time.perf_counter()
+                    expected = _pairwise_search(query.tolist(), embeddings, options['top_k'], options['threshold'])
+                    loop_times.append(time.perf_counter() - start)
+                    found = index.search(query, options['top_k'], options['threshold'])
+                    if [key for key, _ in found] != [key for key, _ in expected]:
+                        raise CommandError(f'Vectorised search disagrees with the per-pair loop at {size} chunks')
+                loop = _percentile(loop_times, 0.5)
+                line += f' | per-pair loop {loop * 1000:.0f} ms ({loop / _percentile(timings["all"], 0.5):.0f}x slower)'
+            self.stdout.write(line)
+            del index
+        self.stdout.write(self.style.SUCCESS('Done'))
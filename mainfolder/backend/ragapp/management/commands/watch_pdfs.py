@@ -0,0 +1,191 @@
+"""
+Django management command that watches the upload directory and queues ingestion
+Usage: python manage.py watch_pdfs [--debounce 2] [--polling] [--once]
+
+PDFs added, changed or deleted in uploaded_pdfs (e.g. by a document sync job) are
+queued for `manage.py ingest_worker` once they have stopped changing for --debounce
+seconds. Change detection uses inotify (FSEvents/ReadDirectoryChanges elsewhere)
+through the watchdog package when it is installed, and polls the directory otherwise.
+Files uploaded through the web UI are ingested per conversation and are left alone.
+"""
+
+from django.core.management.base import BaseCommand
+import os
+import threading
+import time
+from datetime import datetime
+
+
+def _scan(directory):
+    """{filename: (size, mtime)} for the PDFs in directory."""
+    listing = {}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith('.pdf'):
+                    stat = entry.stat()
+                    listing[entry.name] = (stat.st_size, stat.st_mtime)
+    except FileNotFoundError:
+        pass
+    return listing
+
+
+class Command(BaseCommand):
+    help = 'Watch the upload directory and queue new, changed and deleted PDFs for ingestion or removal'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dir',
+            default=None,
+            help='Directory to watch (default: uploaded_pdfs)',
+        )
+        parser.add_argument(
+            '--debounce',
+            type=float,
+            default=2.0,
+            help='Seconds a file must go unchanged before it is queued',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=5.0,
+            help='Seconds between directory scans when polling',
+        )
+        parser.add_argument(
+            '--polling',
+            action='store_true',
+            help='Poll the directory even if inotify (watchdog) is available',
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Reconcile the directory with the index once and exit',
+        )
+
+    def handle(self, *args, **options):
+        from rag_app import pdf_dir
+
+        directory = options['dir'] or pdf_dir
+        debounce = options['debounce']
+        self.pending = {}  # filename -> time.monotonic() of its last change
+        self.lock = threading.Lock()
+        self.stdout.write(
+            self.style.SUCCESS(f'Watching {directory} since {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}')
+        )
+
+        # Catch up on whatever changed while the watcher was not running
+        self.reconcile(directory)
+        if options['once']:
+            self.drain(directory, 0)
+            return
+
+        observer = None if options['polling'] else self.start_observer(directory)
+        snapshot = _scan(directory)
+        last_poll = time.monotonic()
+        try:
+            while True:
+                if observer is None and time.monotonic() - last_poll >= options['poll_interval']:
+                    current = _scan(directory)
+                    for name in set(snapshot) | set(current):
+                        if snapshot.get(name) != current.get(name):
+                            self.touch(name)
+                    snapshot, last_poll = current, time.monotonic()
+                self.drain(directory, debounce)
+                time.sleep(min(0.5, max(debounce, 0.1)))
+        except KeyboardInterrupt:
+            self.stdout.write('Stopping watcher')
+        finally:
+            if observer is not None:
+                observer.stop()
+                observer.join()
+
+    def start_observer(self, directory):
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            self.stdout.write(self.style.WARNING('watchdog is not installed; polling for changes'))
+            return None
+
+        command = self
+
+        class PdfEventHandler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                if event.is_directory:
+                    return
+                for path in (event.src_path, getattr(event, 'dest_path', None)):
+                    if path and str(path).lower().endswith('.pdf'):
+                        command.touch(os.path.basename(path))
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+            observer = Observer()
+            observer.schedule(PdfEventHandler(), directory, recursive=False)
+            observer.start()
+        except Exception as e:
+            self.stdout.write(self.style.WARNING(f'File system notifications unavailable ({e}); polling for changes'))
+            return None
+        self.stdout.write(f'Using {type(observer).__name__} for change notifications')
+        return observer
+
+    def touch(self, name, when=None):
+        with self.lock:
+            self.pending[name] = time.monotonic() if when is None else when
+
+    def reconcile(self, directory):
+        """Mark every PDF on disk, and every globally indexed PDF no longer on disk, for a check."""
+        from rag_app import get_chroma_collection
+
+        names = set(_scan(directory))
+        try:
+            stored = get_chroma_collection().get(where={"conversation_id": "global"}, include=['metadatas'])
+            names |= {metadata.get('source_pdf') for metadata in stored['metadatas'] if metadata.get('source_pdf')}
+        except Exception as e:
+            self.stdout.write(self.style.WARNING(f'Could not list indexed documents: {e}'))
+        for name in names:
+            self.touch(name, when=0)
+
+    def drain(self, directory, debounce):
+        """Dispatch files that have been quiet for `debounce` seconds."""
+        now = time.monotonic()
+        with self.lock:
+            ready = [(name, changed) for name, changed in self.pending.items() if now - changed >= debounce]
+        for name, changed in ready:
+            try:
+                handled = self.dispatch(directory, name)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'Could not queue {name}: {e}'))
+                handled = False
+            if handled:
+                with self.lock:
+                    # A change that arrived while dispatching keeps the file pending
+                    if self.pending.get(name) == changed:
+                        del self.pending[name]
+
+    def dispatch(self, directory, name):
+        """Queue ingestion or removal for one file. Returns False to retry later."""
+        from rag_app import count_stored_chunks, get_pdf_stats
+        from ragapp.ingestion_queue import active_filenames, enqueue_ingestion, is_user_upload, latest_jobs_by_filename
+        from ragapp.models import IngestionJob
+
+        if name in active_filenames():
+            # Re-check once the running job is done; it may have read an older version
+            return False
+        if is_user_upload(name):
+            return True
+
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            if get_pdf_stats(path):
+                # Unchanged since its stats were recorded, and indexed: a document that yields no
+                # chunks (e.g. scanned pages) counts as indexed once its ingestion job finished
+                job = latest_jobs_by_filename([name]).get(name)
+                finished = job is not None and job.action == job.ACTION_INGEST and job.status == job.STATUS_DONE
+                if finished or count_stored_chunks(name):
+                    return True
+            enqueue_ingestion(name, path)
+            self.stdout.write(f'Queued {name} for ingestion')
+        elif count_stored_chunks(name):
+            enqueue_ingestion(name, path, action=IngestionJob.ACTION_REMOVE)
+            self.stdout.write(f'Queued {name} for removal')
+        return True
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ragapp', '0013_content_addressed_documents'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='previous_content_hash',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ragapp', '0014_ingestionjob_previous_content_hash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='ingestionjob',
+            name='ragapp_inge_status_5ff29e_idx',
+        ),
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='background',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='ingestionjob',
+            index=models.Index(fields=['status', 'background', 'available_at'], name='ragapp_inge_status_214045_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ragapp', '0015_ingestionjob_background'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingestionjob',
+            name='action',
+            field=models.CharField(choices=[('ingest', 'Ingest'), ('remove', 'Remove')], default='ingest', max_length=16),
+        ),
+    ]
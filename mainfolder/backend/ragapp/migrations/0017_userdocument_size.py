@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:14
+
+import os
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_sizes(apps, schema_editor):
+    """Count documents uploaded before quotas existed at their current size on disk."""
+    UserDocument = apps.get_model('ragapp', 'UserDocument')
+    upload_dir = os.path.join(settings.BASE_DIR.parent, 'uploaded_pdfs')
+    for document in UserDocument.objects.all().only('id', 'filename'):
+        try:
+            size = os.path.getsize(os.path.join(upload_dir, document.filename))
+        except OSError:
+            continue
+        UserDocument.objects.filter(id=document.id).update(size=size)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ragapp', '0016_ingestionjob_action'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userdocument',
+            name='size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_sizes, migrations.RunPython.noop),
+    ]
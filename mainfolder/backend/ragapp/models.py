@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class Conversation(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
@@ -50,6 +51,8 @@ class UserDocument(models.Model):
     """
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     filename = models.CharField(max_length=255) # Matches the filename in uploaded_pdfs
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True) # SHA-256 of the uploaded bytes
+    size = models.BigIntegerField(default=0) # Bytes, counted against the user's upload quota
     uploaded_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
@@ -57,3 +60,71 @@ class UserDocument(models.Model):
 
     def __str__(self):
         return f"{self.filename} ({self.user.username})"
+
+class ConversationDocument(models.Model):
+    """
+    Links a conversation (DB id or guest session uuid) to the content-addressed vectors
+    of a document it uploaded. The chunks themselves are stored once per content_hash.
+    """
+    conversation_key = models.CharField(max_length=64, db_index=True)
+    filename = models.CharField(max_length=255)
+    content_hash = models.CharField(max_length=64, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('conversation_key', 'filename')
+
+    def __str__(self):
+        return f"{self.filename} -> {self.content_hash[:12]} ({self.conversation_key})"
+
+class IngestionJob(models.Model):
+    """
+    Database-backed queue entry for PDF ingestion, drained by `manage.py ingest_worker`.
+    Workers claim a job with a time-limited lease; if a worker dies, the lease expires
+    and another worker picks the job up again.
+    """
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+    ACTION_INGEST = 'ingest'
+    ACTION_REMOVE = 'remove'
+    ACTION_CHOICES = [
+        (ACTION_INGEST, 'Ingest'),
+        (ACTION_REMOVE, 'Remove'),
+    ]
+
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    action = models.CharField(max_length=16, choices=ACTION_CHOICES, default=ACTION_INGEST)
+    filename = models.CharField(max_length=255)
+    file_path = models.CharField(max_length=1024)
+    conversation_id = models.CharField(max_length=64, null=True, blank=True)
+    content_hash = models.CharField(max_length=64, blank=True)
+    previous_content_hash = models.CharField(max_length=64, blank=True) # Version being replaced; its unchanged pages are reused
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    pages_done = models.IntegerField(default=0) # Pages 1..pages_done are indexed and queryable
+    pages_total = models.IntegerField(default=0)
+    background = models.BooleanField(default=False) # First pages done; the rest yields to newer uploads
+    error = models.TextField(blank=True)
+    lease_owner = models.CharField(max_length=128, blank=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'background', 'available_at']),
+            models.Index(fields=['filename']),
+        ]
+
+    def __str__(self):
+        return f"{self.filename} [{self.status}]"
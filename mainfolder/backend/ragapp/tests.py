@@ -1,3 +1,714 @@
-from django.test import TestCase
+import io
+import os
+import random
+import shutil
+import tempfile
+import tracemalloc
+import zlib
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase, TestCase
+
+_VOCABULARY = (
+    "analysis budget contract delivery estimate finding growth harbour index journal kernel ledger margin "
+    "network outcome policy quarter revenue schedule tenant update vendor warranty yield zone"
+).split()
+
+
+def _make_pdf(path, pages, words_per_page=400):
+    import fitz
+    # Varied text, so boilerplate stripping and near-duplicate collapsing leave it alone
+    rng = random.Random(pages)
+    doc = fitz.open()
+    for _ in range(pages):
+        body = " ".join(
+            " ".join(rng.choice(_VOCABULARY) for _ in range(7)).capitalize() + "." for _ in range(words_per_page // 7)
+        )
+        doc.new_page().insert_textbox(fitz.Rect(36, 36, 576, 806), body, fontsize=6)
+    doc.save(path)
+    doc.close()
+
+
+class _HashingEncoder:
+    """Stands in for the SentenceTransformer: deterministic unit vectors, no model download."""
+    max_seq_length = 256
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, **kwargs):
+        import numpy as np
+        vectors = np.stack([np.random.default_rng(len(text)).standard_normal(384) for text in texts]).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class _WordEncoder(_HashingEncoder):
+    """Bag-of-words unit vectors, so texts sharing more words are more similar."""
+
+    def encode(self, texts, batch_size=32, convert_to_numpy=True, **kwargs):
+        import numpy as np
+        single = isinstance(texts, str)
+        vectors = np.full((1 if single else len(texts), 384), 1e-3, dtype=np.float32)
+        for row, text in enumerate([texts] if single else texts):
+            for word in text.lower().replace('.', ' ').split():
+                vectors[row, zlib.crc32(word.encode()) % 384] += 1.0
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors[0] if single else vectors
+
+
+def _whitespace_tokenizer(texts, add_special_tokens=False):
+    return {"input_ids": [text.split() for text in texts]}
+
+
+def _make_text_pdf(path, pages):
+    import fitz
+    doc = fitz.open()
+    for text in pages:
+        doc.new_page().insert_textbox(fitz.Rect(36, 36, 576, 806), text, fontsize=9)
+    doc.save(path)
+    doc.close()
+
+
+class IsolatedIndexMixin:
+    """
+    Runs rag_app against a throwaway ChromaDB collection, cache directory and in-memory
+    store, with a stand-in encoder and the rule-based sentencizer (no model downloads).
+    """
+
+    encoder = _HashingEncoder
+
+    def isolate_index(self):
+        import chromadb
+        import rag_app
+
+        self.rag_app = rag_app
+        self.tmp_dir = tempfile.mkdtemp(prefix='rag_test_')
+        self.addCleanup(shutil.rmtree, self.tmp_dir, ignore_errors=True)
+        settings = dict(rag_app.LEGACY_INDEX_SETTINGS, chunker='sentencizer')
+        patcher = mock.patch.multiple(
+            rag_app,
+            _chroma_client=chromadb.EphemeralClient(),
+            _collection=None,
+            LEGACY_COLLECTION=f'test_{id(self)}',
+            _model=self.encoder(),
+            _tokenizer=(_whitespace_tokenizer, self.encoder.max_seq_length),
+            _embedding_cache=None,
+            _lexical_index=None,
+            _chunkers={},
+            _generation=None,
+            _generation_pinned=False,
+            CHUNKER_MODE='sentencizer',
+            LEGACY_INDEX_SETTINGS=settings,
+            CONFIGURED_INDEX_SETTINGS=settings,
+            EMBED_CACHE_MB=0,
+            pdf_dir=self.tmp_dir,
+            content_files_dir=os.path.join(self.tmp_dir, '.content'),
+            cache_dir=self.tmp_dir,
+            stats_dir=self.tmp_dir,
+            contents_dir=os.path.join(self.tmp_dir, 'contents'),
+            log_file=os.path.join(self.tmp_dir, 'time_report_ingestion.csv'),
+            index_registry_path=os.path.join(self.tmp_dir, 'index_generations.json'),
+        )
+        os.makedirs(os.path.join(self.tmp_dir, 'contents'))
+        os.makedirs(os.path.join(self.tmp_dir, '.content'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        rag_app.clear_in_memory_store()
+        self.addCleanup(rag_app.clear_in_memory_store)
+
+    def ingest(self, filename, pages, conversation_id=None, content_hash=False):
+        """Write a PDF of these page texts and ingest it; content_hash=True stores it content-addressed, as uploads are."""
+        path = os.path.join(self.tmp_dir, filename)
+        _make_text_pdf(path, pages)
+        digest = self.rag_app.hash_file(path) if content_hash else None
+        self.rag_app.process_pdf(path, filename, conversation_id, raise_errors=True, content_hash=digest)
+        return digest
+
+
+class IngestionMemoryTests(IsolatedIndexMixin, SimpleTestCase):
+    """process_pdf streams pages, so its peak heap stays bounded however long the document is."""
+
+    PAGES = 400
+    CEILING_MB = 16
+
+    def setUp(self):
+        self.isolate_index()
+        # Lazy imports, the segmenter and the lexical index load here, not in the measured runs
+        self.peak_mb(2)
+
+    def peak_mb(self, pages):
+        path = os.path.join(self.tmp_dir, f'synthetic_{pages}.pdf')
+        _make_pdf(path, pages)
+        tracemalloc.start()
+        try:
+            self.rag_app.process_pdf(path, os.path.basename(path), None, raise_errors=True, keep_in_memory=False)
+            return tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        finally:
+            tracemalloc.stop()
+
+    def test_large_pdf_peak_memory_under_ceiling(self):
+        peak = self.peak_mb(self.PAGES)
+        self.assertGreater(self.rag_app.get_chroma_collection().count(), 0)
+        self.assertLess(peak, self.CEILING_MB, f'{self.PAGES}-page ingestion peaked at {peak:.1f} MB')
+
+    def test_peak_memory_does_not_grow_with_length(self):
+        small = self.peak_mb(self.PAGES // 4)
+        large = self.peak_mb(self.PAGES)
+        self.assertLess(large, small * 1.5, f'peak grew from {small:.1f} MB to {large:.1f} MB')
+
+
+class UpsertBatchingTests(IsolatedIndexMixin, SimpleTestCase):
+    """process_pdf writes vectors in upserts of RAG_UPSERT_BATCH_SIZE, and re-ingesting a document replaces them."""
+
+    def setUp(self):
+        self.isolate_index()
+
+    def test_chunks_are_upserted_in_batches(self):
+        collection = self.rag_app.get_chroma_collection()
+        pages = [f'Section {number} covers valve {number} pressure checks.' for number in range(7)]
+        with mock.patch.object(self.rag_app, 'UPSERT_BATCH_SIZE', 3), \
+                mock.patch.object(collection, 'upsert', wraps=collection.upsert) as upsert:
+            self.ingest('manual.pdf', pages)
+        batches = [len(call.kwargs['ids']) for call in upsert.call_args_list]
+        self.assertEqual(sum(batches), collection.count())
+        self.assertEqual(batches, [3, 3, 1])
+
+    def test_reingesting_the_same_name_replaces_vectors(self):
+        collection = self.rag_app.get_chroma_collection()
+        self.ingest('manual.pdf', ['Valve pressure checks.', 'Pump maintenance.', 'Gasket replacement.'])
+        first = set(collection.get(include=[])['ids'])
+        self.ingest('manual.pdf', ['Valve pressure checks, revised.', 'Pump maintenance.'])
+        stored = collection.get(include=['documents'])
+        self.assertEqual(len(stored['ids']), 2)
+        self.assertTrue(set(stored['ids']) <= first)
+        self.assertIn('Valve pressure checks, revised.', stored['documents'])
+
+
+class IncrementalReingestionTests(IsolatedIndexMixin, SimpleTestCase):
+    """A revised document only re-embeds the pages whose text changed."""
+
+    def setUp(self):
+        self.isolate_index()
+
+    def test_only_changed_pages_are_embedded(self):
+        collection = self.rag_app.get_chroma_collection()
+        pages = [f'Section {number} covers valve {number} pressure checks.' for number in range(5)]
+        self.ingest('manual.pdf', pages)
+        before = collection.get(include=['embeddings'])
+        vectors = dict(zip(before['ids'], before['embeddings']))
+
+        revised = pages[:2] + ['Section 2 now covers pump maintenance.'] + pages[3:4]
+        with mock.patch.object(self.rag_app._model, 'encode', wraps=self.rag_app._model.encode) as encode:
+            self.ingest('manual.pdf', revised)
+        encoded = [text for call in encode.call_args_list for text in call.args[0]]
+        self.assertEqual(encoded, ['Section 2 now covers pump maintenance.'])
+
+        after = collection.get(include=['documents', 'embeddings', 'metadatas'])
+        self.assertEqual(sorted(after['documents']), sorted(revised))
+        self.assertEqual(sorted(metadata['page_no'] for metadata in after['metadatas']), [1, 2, 3, 4])
+        for doc_id, document, embedding in zip(after['ids'], after['documents'], after['embeddings']):
+            if document in pages:
+                self.assertEqual(list(embedding), list(vectors[doc_id]))
+
+
+class BoilerplateTests(IsolatedIndexMixin, SimpleTestCase):
+    """Running headers, footers and page counters are stripped before chunking; body text is kept."""
+
+    def setUp(self):
+        self.isolate_index()
+
+    def test_page_counters_match_only_their_own_page(self):
+        key = self.rag_app._boilerplate_key
+        self.assertEqual(key('Page 3 of 40', 3), key('Page  4 of 40', 4))
+        self.assertNotEqual(key('Page 3 of 40', 3), key('Page 3 of 40', 4))
+        self.assertNotEqual(key('Page 3 of 40', 3), key('3 of 40', 3))
+        self.assertIsNone(key('   ', 1))
+
+    def test_repeated_lines_are_stripped_before_chunking(self):
+        pages = [
+            f'ACME Corp - Confidential\nSection {number} covers valve {number} pressure checks.\n42\nPage {number} of 6'
+            for number in range(1, 7)
+        ]
+        self.ingest('manual.pdf', pages)
+        documents = ' '.join(self.rag_app.get_chroma_collection().get(include=['documents'])['documents'])
+        self.assertNotIn('Confidential', documents)
+        self.assertNotIn('of 6', documents)
+        for number in range(1, 7):
+            self.assertIn(f'valve {number} pressure', documents)
+        # Parses as a page counter, but a number that doesn't follow the page is never one
+        self.assertEqual(documents.count('42'), 6)
+        stats = self.rag_app.get_pdf_stats(os.path.join(self.tmp_dir, 'manual.pdf'))
+        self.assertEqual(stats['boilerplate']['lines_removed'], 12)
+
+
+class TruncationStatsTests(IsolatedIndexMixin, SimpleTestCase):
+    """Ingestion only tokenizes word-budget chunks for [TRUNCATION] stats when RAG_TRUNCATION_STATS asks for it."""
+
+    def setUp(self):
+        self.isolate_index()
+
+    def test_no_tokenizer_pass_by_default(self):
+        with mock.patch.object(self.rag_app, 'measure_truncation', wraps=self.rag_app.measure_truncation) as measure:
+            self.ingest('quiet.pdf', ['Valve pressure checks.', 'Pump maintenance.'])
+        measure.assert_not_called()
+        self.assertGreater(self.rag_app.get_chroma_collection().count(), 0)
+
+    def test_stats_when_enabled(self):
+        with mock.patch.object(self.rag_app, 'TRUNCATION_STATS', 1), \
+                mock.patch.object(self.rag_app, 'measure_truncation', wraps=self.rag_app.measure_truncation) as measure:
+            self.ingest('measured.pdf', ['Valve pressure checks.', 'Pump maintenance.'])
+        measure.assert_called()
+
+
+class EmbeddingCacheTests(IsolatedIndexMixin, SimpleTestCase):
+    """A cached vector is only reused for the exact text it was encoded from."""
+
+    def setUp(self):
+        self.isolate_index()
+        cache = self.rag_app.EmbeddingCache(os.path.join(self.tmp_dir, 'embeddings.sqlite3'), max_bytes=1 << 20)
+        patcher = mock.patch.object(self.rag_app, '_embedding_cache', cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = cache
+
+    def test_whitespace_variants_are_encoded_separately(self):
+        import numpy as np
+        # _HashingEncoder seeds on the text's length, so the two variants embed differently
+        texts = ['Valve pressure checks.', 'Valve  pressure\nchecks. ']
+        first = self.rag_app.embed_texts(texts[:1])
+        both = self.rag_app.embed_texts(texts)
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 2)
+        np.testing.assert_allclose(both[0], first[0])
+        np.testing.assert_allclose(both[1], self.rag_app._model.encode(texts[1:])[0], rtol=1e-6)
+        # Served from the cache now, still the variant's own vector
+        np.testing.assert_allclose(self.rag_app.embed_texts(texts[1:])[0], both[1])
+
+
+class VectorIndexTests(SimpleTestCase):
+    """VectorIndex returns what the old per-pair cosine_similarity loop returned."""
+
+    def vectors(self, count, dim=32):
+        import numpy as np
+        rng = np.random.default_rng(7)
+        vectors = rng.standard_normal((count, dim)).astype(np.float32) * rng.uniform(0.5, 3, (count, 1)).astype(np.float32)
+        vectors[5] = vectors[2] * 2  # Same direction: a tie, broken by insertion order
+        vectors[9] = 0
+        return rng, {f'chunk_{i}': vector for i, vector in enumerate(vectors)}
+
+    def assert_same_results(self, found, expected):
+        self.assertEqual([key for key, _ in found], [key for key, _ in expected])
+        for (_, score), (_, reference) in zip(found, expected):
+            self.assertAlmostEqual(score, float(reference), places=5)
+
+    def test_search_matches_per_pair_loop(self):
+        import rag_app
+        from ragapp.management.commands.retrieval_benchmark import _pairwise_search
+
+        rng, embeddings = self.vectors(300)
+        index = rag_app.VectorIndex.from_embeddings(embeddings)
+        for target in (2, 40, 123):
+            query = embeddings[f'chunk_{target}'] + 0.3 * rng.standard_normal(32).astype('float32')
+            for top_k, threshold in ((10, -1.0), (5, 0.2), (300, 0.0), (3, 0.99)):
+                self.assert_same_results(index.search(query, top_k, threshold),
+                                         _pairwise_search(query.tolist(), embeddings, top_k, threshold))
+
+            scope = sorted(rng.choice(300, 40, replace=False).tolist())
+            scoped = {f'chunk_{i}': embeddings[f'chunk_{i}'] for i in scope}
+            self.assert_same_results(index.search(query, 10, 0.0, keys=list(scoped)),
+                                     _pairwise_search(query.tolist(), scoped, 10, 0.0))
+
+    def test_removal_keeps_the_remaining_rows(self):
+        import rag_app
+        from ragapp.management.commands.retrieval_benchmark import _pairwise_search
+
+        rng, embeddings = self.vectors(50)
+        index = rag_app.VectorIndex.from_embeddings(embeddings)
+        removed = ['chunk_2', 'chunk_17', 'chunk_49']
+        index.remove(removed)
+        for key in removed:
+            del embeddings[key]
+        self.assertEqual(index.keys, list(embeddings))
+        query = rng.standard_normal(32).astype('float32')
+        self.assert_same_results(index.search(query, 50, -1.0), _pairwise_search(query.tolist(), embeddings, 50, -1.0))
+
+
+class ChunkStoreTests(SimpleTestCase):
+    """ChunkStore rows and searches match the dict-of-dicts store and per-pair loop they replaced."""
+
+    def setUp(self):
+        import numpy as np
+        import rag_app
+
+        self.rng = np.random.default_rng(11)
+        self.store = rag_app.ChunkStore()
+        self.chunks, self.embeddings = {}, {}
+        documents = [('manual.pdf', None, None), ('notes.pdf', '7', None), ('report.pdf', 'shared', 'ab' * 32)]
+        for number in range(120):
+            source_pdf, conversation_id, content_hash = documents[number % 3]
+            page_no, page_chunk_index = number // 6 + 1, number % 2
+            metadata = {
+                'id': rag_app._chunk_doc_id(source_pdf, page_no, page_chunk_index,
+                                            None if conversation_id == 'shared' else conversation_id, content_hash),
+                'type': 'pdf_chunk', 'source_pdf': source_pdf, 'conversation_id': conversation_id or 'global',
+                'page_no': page_no, 'chunk_index': number // 3, 'page_chunk_index': page_chunk_index,
+                'page_hash': f'{number:040x}',
+            }
+            if content_hash:
+                metadata['content_hash'] = content_hash
+            if number == 4:
+                metadata['id'] = 'legacy_manual.pdf_4'
+                metadata['section'] = 'Appendix'
+            if number == 8:
+                metadata['duplicate_pages'] = '3,5'
+            text = f'Chunk {number} of {source_pdf}: valve pressure, pump seals, é.'
+            embedding = (self.rng.standard_normal(32) * self.rng.uniform(0.5, 3)).astype('float32')
+            key = self.store.add(text, metadata, embedding)
+            # What in_memory_chunks / in_memory_embeddings used to hold for this chunk
+            self.chunks[key] = {
+                'content': text, 'chunk_text': text, 'metadata': metadata, 'source': 'Unknown',
+                'source_pdf': source_pdf, 'page_no': page_no, 'page_number': page_no,
+                'chunk_id': metadata['id'], 'document_id': metadata['id'],
+            }
+            self.embeddings[key] = embedding.tolist()
+
+    def assert_same_rows(self):
+        import numpy as np
+        self.assertEqual(list(self.store.chunks), list(self.chunks))
+        for key, expected in self.chunks.items():
+            self.assertEqual(self.store.chunks[key].copy(), expected)
+            np.testing.assert_allclose(self.store.embeddings[key], self.embeddings[key], rtol=1e-5)
+
+    def assert_same_search(self, rows, embeddings):
+        from ragapp.management.commands.retrieval_benchmark import _pairwise_search
+
+        for _ in range(3):
+            query = self.rng.standard_normal(32).astype('float32')
+            for top_k, threshold in ((10, -1.0), (5, 0.1), (200, 0.0)):
+                found = rows.embeddings.search(query, top_k, threshold)
+                expected = _pairwise_search(query.tolist(), embeddings, top_k, threshold)
+                self.assertEqual([key for key, _ in found], [key for key, _ in expected])
+                for (_, score), (_, reference) in zip(found, expected):
+                    self.assertAlmostEqual(score, float(reference), places=5)
+
+    def test_rows_match_old_chunk_dicts(self):
+        self.assert_same_rows()
+
+    def test_search_matches_per_pair_loop(self):
+        self.assert_same_search(self.store.chunks, self.embeddings)
+        rows = self.store.document_rows('notes.pdf')
+        scoped = self.store.chunks.subset(rows)
+        self.assertEqual(set(scoped), {key for key, chunk in self.chunks.items() if chunk['source_pdf'] == 'notes.pdf'})
+        self.assert_same_search(scoped, {key: self.embeddings[key] for key in scoped})
+
+    def test_removing_a_document_keeps_the_rest(self):
+        removed = self.store.remove_rows(self.store.document_rows('manual.pdf'))
+        self.assertEqual(removed, 40)
+        for key in [key for key, chunk in self.chunks.items() if chunk['source_pdf'] == 'manual.pdf']:
+            del self.chunks[key], self.embeddings[key]
+        self.assert_same_rows()
+        self.assert_same_search(self.store.chunks, self.embeddings)
+
+
+class RetrievalScopeTests(IsolatedIndexMixin, TestCase):
+    """Both retrieval backends search exactly the documents the requester may see."""
+
+    encoder = _WordEncoder
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from ragapp.models import Conversation, ConversationDocument, UserDocument
+
+        self.isolate_index()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+        self.alice_conversation = Conversation.objects.create(user=self.alice, title='alice')
+        self.bob_conversation = Conversation.objects.create(user=self.bob, title='bob')
+        self.ingest('manual.pdf', ['Valve pressure checks.'])
+        # Private uploads match the question better than the shared manual does
+        for user, conversation, filename in ((self.alice, self.alice_conversation, 'alice.pdf'),
+                                             (self.bob, self.bob_conversation, 'bob.pdf')):
+            digest = self.ingest(filename, [f'Valve pressure valve pressure limits for {user.username}.'],
+                                 str(conversation.id), content_hash=True)
+            UserDocument.objects.create(user=user, filename=filename, content_hash=digest)
+            ConversationDocument.objects.create(conversation_key=str(conversation.id), filename=filename, content_hash=digest)
+
+    def sources(self, backend, conversation_id=None, owner=None):
+        rag_app = self.rag_app
+        with mock.patch.multiple(rag_app, RETRIEVAL_BACKEND=backend, query_gemini=mock.Mock(return_value='answer'),
+                                 generate_follow_up_questions=mock.Mock(return_value=[])), \
+                mock.patch.object(rag_app, 'build_context', wraps=rag_app.build_context) as build_context:
+            rag_app.get_answer('valve pressure', conversation_id, owner=owner)
+        self.assertTrue(build_context.called, 'nothing was retrieved')
+        return {chunk['source_pdf'] for chunk in build_context.call_args[0][0]}
+
+    def test_backends_return_only_visible_documents(self):
+        alice_conversation, bob_conversation = str(self.alice_conversation.id), str(self.bob_conversation.id)
+        cases = [
+            ((None, self.alice.id), {'manual.pdf', 'alice.pdf'}),
+            ((None, None), {'manual.pdf'}),
+            ((bob_conversation, self.alice.id), {'manual.pdf'}),
+            ((bob_conversation, None), {'manual.pdf'}),
+            ((alice_conversation, self.alice.id), {'manual.pdf', 'alice.pdf'}),
+        ]
+        for backend in ('memory', 'store'):
+            for (conversation_id, owner), expected in cases:
+                with self.subTest(backend=backend, conversation_id=conversation_id, owner=owner):
+                    self.assertEqual(self.sources(backend, conversation_id, owner), expected)
+
+
+class IndexGenerationTests(IsolatedIndexMixin, SimpleTestCase):
+    """The original collection keeps its settings until rebuild_index builds, verifies and switches to a new generation."""
+
+    def setUp(self):
+        from django.core.management import call_command
+
+        self.isolate_index()
+        self.call_command = call_command
+        self.ingest('manual.pdf', ['Valve pressure checks. Pump maintenance schedule.', 'Second page of the manual.'])
+
+    def test_environment_alone_does_not_change_the_legacy_generation(self):
+        rag_app = self.rag_app
+        with mock.patch.object(rag_app, 'CONFIGURED_INDEX_SETTINGS',
+                               dict(rag_app.CONFIGURED_INDEX_SETTINGS, chunk_overlap_tokens=16)):
+            generation = rag_app.get_index_generation()
+        self.assertEqual(generation['collection'], rag_app.LEGACY_COLLECTION)
+        self.assertEqual(rag_app.index_settings_of(generation), rag_app.LEGACY_INDEX_SETTINGS)
+        self.assertFalse(os.path.exists(rag_app.index_registry_path), 'reading must not write the registry')
+
+    def test_rebuild_switches_to_a_verified_generation(self):
+        import io
+        rag_app = self.rag_app
+        legacy_chunks = rag_app.get_chroma_collection().count()
+        settings = dict(rag_app.CONFIGURED_INDEX_SETTINGS, chunk_overlap_tokens=16)
+        with mock.patch.multiple(rag_app, CONFIGURED_INDEX_SETTINGS=settings, INDEX_CHECK_SECONDS=0):
+            self.call_command('rebuild_index', grace=0, stdout=io.StringIO())
+            registry = rag_app.load_index_registry()
+            active = registry['active']
+            self.assertNotEqual(active['collection'], rag_app.LEGACY_COLLECTION)
+            self.assertEqual(rag_app.index_settings_of(active), settings)
+            self.assertIsNone(registry['building'])
+            self.assertEqual(rag_app.get_chroma_client().get_collection(active['collection']).count(), legacy_chunks)
+            collections = [collection.name for collection in rag_app.get_chroma_client().list_collections()]
+            self.assertNotIn(rag_app.LEGACY_COLLECTION, collections)
+            # Running it again with the same settings finds nothing to do
+            output = io.StringIO()
+            self.call_command('rebuild_index', grace=0, stdout=output)
+            self.assertIn('already uses', output.getvalue())
+
+
+class HybridRetrievalTests(IsolatedIndexMixin, TestCase):
+    """Hybrid retrieval finds exact-term matches the dense search misses, within the requester's scope on both backends."""
+
+    encoder = _WordEncoder
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+        from ragapp.models import Conversation
+
+        self.isolate_index()
+        self.ingest('manual.pdf', [
+            'Pump valve pressure maintenance.',
+            'Replace gasket XJ4471 yearly.',
+            'Cooling tower fan inspection.',
+            'Boiler feed water treatment.',
+            'Electrical panel thermal survey.',
+        ])
+        owner = User.objects.create_user('carol')
+        self.private_conversation = str(Conversation.objects.create(user=owner, title='private').id)
+        self.ingest('private.pdf', ['Private note on gasket XJ4471 pricing.'], self.private_conversation)
+
+    def retrieve(self, backend, mode):
+        rag_app = self.rag_app
+        with mock.patch.multiple(rag_app, RETRIEVAL_BACKEND=backend, RETRIEVAL_MODE=mode):
+            chunks = rag_app.process_query_with_tfidf('pump valve pressure XJ4471', top_k=10, similarity_threshold=0.3,
+                                                      tfidf_threshold=0.05) or []
+        return chunks
+
+    def test_exact_term_chunk_is_fused_in(self):
+        for backend in ('memory', 'store'):
+            with self.subTest(backend=backend):
+                two_step = [chunk['chunk_text'] for chunk in self.retrieve(backend, 'two-step')]
+                self.assertFalse(any('XJ4471' in text for text in two_step))
+                hybrid = self.retrieve(backend, 'hybrid')
+                texts = [chunk['chunk_text'] for chunk in hybrid]
+                self.assertIn('Pump valve pressure maintenance.', texts[0])
+                self.assertTrue(any('Replace gasket XJ4471' in text for text in texts), texts)
+                self.assertEqual({chunk['source_pdf'] for chunk in hybrid}, {'manual.pdf'})
+                for chunk in hybrid:
+                    self.assertGreater(chunk['fusion_score'], 0)
+                    for field in ('chunk_id', 'content', 'metadata', 'page_no', 'similarity_score', 'tfidf_score'):
+                        self.assertIn(field, chunk)
+
+
+class UploadTestMixin(IsolatedIndexMixin):
+    """Uploads go through the real upload view into a throwaway uploaded_pdfs directory."""
+
+    def isolate_uploads(self):
+        from ragapp import views
+
+        self.isolate_index()
+        self.views = views
+        self.upload_dir = os.path.join(self.tmp_dir, 'uploads')
+        os.makedirs(self.upload_dir)
+        patcher = mock.patch.multiple(views, UPLOAD_DIR=self.upload_dir, _job_sync_floor=None, _loaded_jobs=set())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def pdf_bytes(self, pages):
+        path = os.path.join(self.tmp_dir, f'bytes_{abs(hash(tuple(pages)))}.pdf')
+        _make_text_pdf(path, pages)
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def upload(self, filename, data, conversation_id, client=None):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        return (client or self.client).post('/upload/', {
+            'files': SimpleUploadedFile(filename, data, content_type='application/pdf'),
+            'conversation_id': conversation_id or '',
+        })
+
+
+class DeduplicationTests(UploadTestMixin, TestCase):
+    """Uploading bytes that are already embedded reuses their vectors in every web process."""
+
+    def setUp(self):
+        self.isolate_uploads()
+
+    def test_identical_upload_reuses_stored_vectors(self):
+        from ragapp.models import IngestionJob
+
+        data = self.pdf_bytes(['Quarterly revenue grew in every region.', 'Margins held steady.'])
+        first = self.upload('report.pdf', data, 'guest-a').json()
+        self.assertEqual(first['processed_files'], ['report.pdf'])
+        job = IngestionJob.objects.get(id=first['job_ids'][0])
+        # What the ingest worker does with the queued job
+        self.rag_app.process_pdf(job.file_path, job.filename, job.conversation_id, raise_errors=True,
+                                 content_hash=job.content_hash)
+        IngestionJob.objects.filter(id=job.id).update(status=IngestionJob.STATUS_DONE)
+
+        with mock.patch.object(self.rag_app._model, 'encode', wraps=self.rag_app._model.encode) as encode:
+            second = self.upload('copy.pdf', data, 'guest-b').json()
+        self.assertEqual(second['already_processed'], ['copy.pdf'])
+        self.assertEqual(second['job_ids'], [])
+        encode.assert_not_called()
+        attached = IngestionJob.objects.get(filename='copy.pdf')
+        self.assertEqual((attached.status, attached.content_hash), (IngestionJob.STATUS_DONE, job.content_hash))
+        self.assertIn('copy.pdf', {row['source_pdf'] for row in self.rag_app.in_memory_scope('guest-b').values()})
+
+        # Another web process, which started following jobs before the upload, attaches it too
+        self.rag_app.clear_in_memory_store()
+        self.views._loaded_jobs.clear()
+        self.views._job_sync_floor = job.id
+        self.views.sync_completed_ingestions()
+        self.assertIn('copy.pdf', {row['source_pdf'] for row in self.rag_app.in_memory_scope('guest-b').values()})
+
+
+class UploadTests(UploadTestMixin, TestCase):
+    """Uploads are refused, without leaving bytes behind, when over quota or when the name is someone else's."""
+
+    def setUp(self):
+        from django.contrib.auth.models import User
+
+        self.isolate_uploads()
+        self.alice = User.objects.create_user('alice')
+        self.bob = User.objects.create_user('bob')
+
+    def client_for(self, user):
+        from django.test import Client
+        client = Client()
+        client.force_login(user)
+        return client
+
+    def content_files(self):
+        return sorted(os.listdir(self.rag_app.content_files_dir))
+
+    def test_name_taken_by_another_user_is_refused(self):
+        alice_bytes = self.pdf_bytes(['Alice owns this report.'])
+        self.assertEqual(self.upload('report.pdf', alice_bytes, None, self.client_for(self.alice)).status_code, 200)
+        stored = self.content_files()
+
+        response = self.upload('report.pdf', self.pdf_bytes(['Bob wrote something else.']), None, self.client_for(self.bob))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual([rejected['filename'] for rejected in response.json()['rejected_files']], ['report.pdf'])
+        with open(os.path.join(self.upload_dir, 'report.pdf'), 'rb') as f:
+            self.assertEqual(f.read(), alice_bytes)
+        self.assertEqual(self.content_files(), stored)
+
+        # The owner may replace their own file
+        response = self.upload('report.pdf', self.pdf_bytes(['Alice, second edition.']), None, self.client_for(self.alice))
+        self.assertEqual(response.status_code, 200)
+
+    def test_upload_over_quota_is_refused(self):
+        from ragapp import uploads
+        from ragapp.models import UserDocument
+
+        data = self.pdf_bytes(['A report that does not fit in the quota.'])
+        with mock.patch.object(uploads, 'USER_QUOTA_BYTES', len(data) - 1):
+            response = self.upload('big.pdf', data, None, self.client_for(self.alice))
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('quota', response.json()['rejected_files'][0]['error'])
+        self.assertFalse(UserDocument.objects.filter(user=self.alice).exists())
+        self.assertEqual(self.content_files(), [])
+        self.assertFalse(os.path.exists(os.path.join(self.upload_dir, 'big.pdf')))
+
+
+class ProcessExistingPdfsTests(UploadTestMixin, TestCase):
+    """POST /process-existing-pdfs/ queues jobs instead of ingesting inside the request."""
+
+    def setUp(self):
+        self.isolate_uploads()
+
+    def test_queues_jobs_for_shared_files_only(self):
+        from ragapp.models import IngestionJob
+        from ragapp.ingestion_queue import enqueue_ingestion
+
+        for name in ('manual.pdf', 'guide.pdf', 'running.pdf'):
+            _make_text_pdf(os.path.join(self.upload_dir, name), ['Shared text.'])
+        self.assertEqual(self.upload('private.pdf', self.pdf_bytes(['Private text.']), None).status_code, 200)
+        finished = enqueue_ingestion('guide.pdf', os.path.join(self.upload_dir, 'guide.pdf'))
+        finished.status = IngestionJob.STATUS_DONE
+        finished.save()
+        enqueue_ingestion('running.pdf', os.path.join(self.upload_dir, 'running.pdf'))
+
+        with mock.patch.object(self.rag_app, 'process_pdf') as process_pdf:
+            response = self.client.post('/process-existing-pdfs/')
+        self.assertEqual(response.status_code, 200)
+        process_pdf.assert_not_called()
+        payload = response.json()
+        queued = IngestionJob.objects.filter(id__in=payload['job_ids'])
+        # The user's upload already has its own job; the running one isn't queued twice
+        self.assertEqual(sorted(queued.values_list('filename', flat=True)), ['guide.pdf', 'manual.pdf'])
+        self.assertTrue(all(job.status == IngestionJob.STATUS_QUEUED for job in queued))
+        self.assertEqual(payload['skipped_count'], 1)
+
+
+class WatchPdfsTests(UploadTestMixin, TestCase):
+    """watch_pdfs queues what changed on disk, and leaves alone what is already indexed."""
+
+    def setUp(self):
+        self.isolate_uploads()
+
+    def watch(self):
+        from django.core.management import call_command
+        call_command('watch_pdfs', '--once', '--dir', self.upload_dir, stdout=io.StringIO())
+
+    def test_document_without_chunks_is_not_requeued(self):
+        from django.core.management import call_command
+        from ragapp.models import IngestionJob
+
+        scanned = os.path.join(self.upload_dir, 'scanned.pdf')
+        _make_text_pdf(scanned, ['', ''])
+        _make_text_pdf(os.path.join(self.upload_dir, 'manual.pdf'), ['Valve pressure checks.'])
+        self.watch()
+        self.assertEqual(sorted(IngestionJob.objects.values_list('filename', flat=True)), ['manual.pdf', 'scanned.pdf'])
+        call_command('ingest_worker', '--once', stdout=io.StringIO())
+        self.assertEqual(self.rag_app.count_stored_chunks('scanned.pdf'), 0)
+        self.assertGreater(self.rag_app.count_stored_chunks('manual.pdf'), 0)
+
+        # A restarted watcher finds both handled
+        self.watch()
+        self.assertEqual(IngestionJob.objects.count(), 2)
+
+        # Until the file changes
+        _make_text_pdf(scanned, ['Pump maintenance schedule.'])
+        os.utime(scanned, (os.path.getatime(scanned), os.path.getmtime(scanned) + 10))
+        self.watch()
+        self.assertEqual(IngestionJob.objects.filter(filename='scanned.pdf').count(), 2)
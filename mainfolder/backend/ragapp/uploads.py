@@ -0,0 +1,179 @@
+"""
+Streaming upload stage used by the upload view.
+
+Each uploaded PDF is written chunk by chunk to a temp file next to the content store
+while its SHA-256 and size are computed, so the per-file limit and the uploader's quota
+are enforced before the whole file has landed. The finished file is renamed into the
+content store under its hash (immutable, so the ingest job always reads the bytes it
+was queued for) and hard-linked into uploaded_pdfs under its display name with an
+atomic rename, so readers never see a partly written file and two users uploading the
+same name at once can't interleave their bytes. A display name held by someone else's
+document (another user, another guest conversation or a global document) is never
+replaced: the upload is refused unless its bytes are identical.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import uuid
+
+from django.db.models import Sum
+
+from .models import Conversation, ConversationDocument, UserDocument
+
+# Largest single PDF accepted, and total bytes of PDFs each signed-in user may keep (0 = no limit)
+MAX_UPLOAD_BYTES = int(float(os.environ.get("RAG_UPLOAD_MAX_MB", "200")) * 1024 * 1024)
+USER_QUOTA_BYTES = int(float(os.environ.get("RAG_USER_QUOTA_MB", "2048")) * 1024 * 1024)
+
+
+class UploadRejected(Exception):
+    """The upload was refused before being published (file too large, quota exceeded or name taken)."""
+
+    def __init__(self, message, status=413):
+        super().__init__(message)
+        self.status = status
+
+
+class StagedUpload:
+    """A fully written upload in the content store: path, size in bytes and SHA-256."""
+
+    def __init__(self, path, size, content_hash):
+        self.path = path
+        self.size = size
+        self.content_hash = content_hash
+
+
+def _megabytes(size):
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+def upload_limit(user, filename):
+    """
+    (max bytes, reason) for the next upload: the per-file limit, lowered to what is left of
+    a signed-in user's quota. A file replacing one of the user's documents of the same name
+    gets that document's bytes back.
+    """
+    limit, reason = MAX_UPLOAD_BYTES or None, 'the per-file upload limit'
+    if USER_QUOTA_BYTES and user is not None and user.is_authenticated:
+        used = UserDocument.objects.filter(user=user).exclude(filename=filename).aggregate(total=Sum('size'))['total'] or 0
+        remaining = max(0, USER_QUOTA_BYTES - used)
+        if limit is None or remaining < limit:
+            limit, reason = remaining, f'your storage quota ({_megabytes(USER_QUOTA_BYTES)}, {_megabytes(used)} used)'
+    return limit, reason
+
+
+def stage_upload(uploaded_file, max_bytes=None, reason='the upload limit'):
+    """
+    Stream an UploadedFile into the content store, hashing and counting bytes as they are
+    written. Raises UploadRejected (and removes the partial file) as soon as max_bytes is
+    exceeded. Identical content already in the store is kept and the new copy dropped.
+    """
+    from rag_app import content_file_path, content_files_dir
+
+    if max_bytes is not None and uploaded_file.size is not None and uploaded_file.size > max_bytes:
+        raise UploadRejected(f'{uploaded_file.name} ({_megabytes(uploaded_file.size)}) exceeds {reason}')
+
+    os.makedirs(content_files_dir, exist_ok=True)
+    sha = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(prefix='.upload-', suffix='.part', dir=content_files_dir)
+    try:
+        with os.fdopen(fd, 'wb') as destination:
+            for chunk in uploaded_file.chunks():
+                size += len(chunk)
+                if max_bytes is not None and size > max_bytes:
+                    raise UploadRejected(f'{uploaded_file.name} exceeds {reason}')
+                sha.update(chunk)
+                destination.write(chunk)
+            destination.flush()
+            os.fsync(destination.fileno())
+        content_hash = sha.hexdigest()
+        path = content_file_path(content_hash)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    return StagedUpload(path, size, content_hash)
+
+
+def discard_staged(staged):
+    """Remove a staged upload from the content store, unless an upload record or job still needs those bytes."""
+    from .ingestion_queue import content_hash_in_use
+
+    if content_hash_in_use(staged.content_hash):
+        return
+    try:
+        os.remove(staged.path)
+    except OSError:
+        pass
+
+
+def _may_replace(filename, user, conversation_id):
+    """
+    True if every upload record for filename belongs to this uploader: the signed-in
+    user's own documents and conversations, or the guest's conversation. A file with no
+    upload records is a global document and is never replaced from the upload view.
+    """
+    if user is not None and user.is_authenticated:
+        if UserDocument.objects.filter(filename=filename).exclude(user=user).exists():
+            return False
+        own_keys = {str(pk) for pk in Conversation.objects.filter(user=user).values_list('id', flat=True)}
+        own_records = UserDocument.objects.filter(filename=filename, user=user).exists()
+    else:
+        own_keys, own_records = set(), False
+    own_keys.add(str(conversation_id))
+    keys = set(ConversationDocument.objects.filter(filename=filename).values_list('conversation_key', flat=True))
+    return (own_records or bool(keys)) and keys <= own_keys
+
+
+def _same_file(path, other):
+    try:
+        return os.path.samefile(path, other)
+    except OSError:
+        return False
+
+
+def publish_upload(staged, filename, directory, user=None, conversation_id=None):
+    """
+    Make a staged upload visible as directory/filename. A new name is created atomically;
+    an existing file is atomically replaced only if it is this uploader's own document
+    (or already holds the same bytes). Otherwise raises UploadRejected, and the caller
+    records nothing for the upload.
+    """
+    final_path = os.path.join(directory, filename)
+    if _same_file(staged.path, final_path):
+        return final_path
+    tmp_path = os.path.join(directory, f'.{uuid.uuid4().hex}.part')
+    try:
+        os.link(staged.path, tmp_path)
+    except OSError:
+        # No hard links on this file system: fall back to a copy
+        shutil.copyfile(staged.path, tmp_path)
+    try:
+        try:
+            # Fails if the name exists, so two first uploads of a name can't both win
+            os.link(tmp_path, final_path)
+            return final_path
+        except FileExistsError:
+            pass
+        except OSError:
+            if not os.path.exists(final_path):
+                os.replace(tmp_path, final_path)
+                return final_path
+        if not _may_replace(filename, user, conversation_id):
+            raise UploadRejected(
+                f'{filename} is already taken by another document; rename the file and upload it again', status=409
+            )
+        os.replace(tmp_path, final_path)
+    finally:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+    return final_path
@@ -20,9 +20,55 @@ os.makedirs(UPLOAD_DIR, exist_ok=True)
 import uuid
 SERVER_INSTANCE_ID = str(uuid.uuid4())
 
-# Global processing status tracker
-# Format: {filename: {'status': 'processing'|'ready', 'timestamp': float}}
-processing_status = {}
+# Document processing status lives in the IngestionJob table (see ingestion_queue.py)
+# so every gunicorn worker sees the same state and it survives restarts.
+
+# Ingestion runs in ingest_worker processes; each web process pulls newly finished
+# documents into its own in-memory index before answering queries. Every job below
+# _job_sync_floor is settled for this process (loaded, failed, or finished before the
+# first sync, when the whole collection is loaded); _loaded_jobs holds the finished jobs
+# at or above it that are already loaded. Jobs finish in any order across workers, so
+# the floor only moves past a contiguous run of settled jobs.
+_job_sync_floor = None
+_loaded_jobs = set()
+
+
+# job id -> pages of a still-running ingestion already loaded into this process
+_partial_pages_loaded = {}
+
+
+def sync_completed_ingestions():
+    global _job_sync_floor
+    from rag_app import attach_content, load_document_from_store, load_document_pages, remove_in_memory_document
+    from .ingestion_queue import jobs_from, partially_indexed, sync_floor
+    from .models import IngestionJob
+    try:
+        if _job_sync_floor is None:
+            _job_sync_floor = sync_floor()
+        settled = True
+        for job in jobs_from(_job_sync_floor):
+            if job.status == IngestionJob.STATUS_DONE and job.id not in _loaded_jobs:
+                if job.action == job.ACTION_REMOVE:
+                    remove_in_memory_document(job.filename, job.conversation_id or "global")
+                elif job.content_hash:
+                    attach_content(job.content_hash, job.filename, job.conversation_id)
+                else:
+                    load_document_from_store(job.filename, job.conversation_id)
+                _partial_pages_loaded.pop(job.id, None)
+                _loaded_jobs.add(job.id)
+            if settled and (job.id in _loaded_jobs or job.status == IngestionJob.STATUS_FAILED):
+                _job_sync_floor = job.id + 1
+                _loaded_jobs.discard(job.id)
+            else:
+                settled = False
+        # Pages committed by ingestions still in progress are queryable straight away
+        for job in partially_indexed():
+            loaded = _partial_pages_loaded.get(job.id, 0)
+            if job.pages_done > loaded:
+                load_document_pages(job.filename, job.conversation_id, loaded + 1, job.pages_done, job.content_hash or None)
+                _partial_pages_loaded[job.id] = job.pages_done
+    except Exception as e:
+        print(f"[SYNC] Failed to load finished ingestions: {e}")
 
 
 def landing_page_view(request):
@@ -32,55 +78,16 @@ def landing_page_view(request):
 def dashboard_view(request):
     """
     Dashboard view - access controlled by Frontend Clerk SDK.
-    Initializes RAG system/ChromaDB on load.
+    Renders only: PDFs dropped into uploaded_pdfs are picked up by `manage.py watch_pdfs`
+    and ingested by `manage.py ingest_worker`, and queries load the index on demand.
     """
-    try:
-        from rag_app import get_chroma_collection, process_pdf
-        
-        # Check if ChromaDB collection exists and has data
-        try:
-            collection = get_chroma_collection()
-            count = collection.count()
-            print(f"[CHROMADB] Found {count} documents in ChromaDB")
-            
-            # Use existing documents
-            load_embeddings_from_chromadb()
-            
-            # SMART AUTO-PROCESSING (Gentle Mode)
-            # Check for ONE file that exists in uploaded_pdfs but NOT in ChromaDB
-            if os.path.exists(UPLOAD_DIR):
-                pdf_files = [f for f in os.listdir(UPLOAD_DIR) if f.lower().endswith('.pdf')]
-                
-                # Get list of already processed files from ChromaDB metadata (cached in memory)
-                from rag_app import in_memory_metadata
-                processed_filenames = set(m.get('source_pdf') for m in in_memory_metadata if m.get('source_pdf'))
-                
-                for pdf_file in pdf_files:
-                    if pdf_file not in processed_filenames:
-                        print(f"[AUTO-PROCESS] Found new file: {pdf_file}. Processing ONE file gently...")
-                        try:
-                            file_path = os.path.join(UPLOAD_DIR, pdf_file)
-                            # Process just this one file
-                            process_pdf(file_path, pdf_file, None)
-                            print(f"[AUTO-PROCESS] Successfully processed {pdf_file}")
-                            # Break after one file to save RAM/CPU (Lazy Batching)
-                            break 
-                        except Exception as e:
-                            print(f"[AUTO-PROCESS] Failed to process {pdf_file}: {e}")
-                            
-        except Exception as e:
-            print(f"[CHROMADB] Collection check error: {e}")
-            
-    except Exception as e:
-        print(f"[CHROMADB] Error: {e}")
-    
     return render(request, 'ragapp/dashboard.html')
 
 
 def load_embeddings_from_chromadb():
     """Load embeddings from ChromaDB into memory"""
     try:
-        from rag_app import get_chroma_collection, in_memory_chunks, in_memory_embeddings
+        from rag_app import _add_in_memory_chunk, clear_in_memory_store, get_chroma_collection, in_memory_chunks, in_memory_embeddings
         
         collection = get_chroma_collection()
         count = collection.count()
@@ -89,8 +96,7 @@ def load_embeddings_from_chromadb():
             print(f"[MEMORY] Loading {count} documents from ChromaDB into memory...")
             
             # Clear existing memory
-            in_memory_chunks.clear()
-            in_memory_embeddings.clear()
+            clear_in_memory_store()
             
             # Load all documents from ChromaDB
             results = collection.get(include=['documents', 'embeddings', 'metadatas'])
@@ -132,19 +138,7 @@ def load_embeddings_from_chromadb():
                     embedding = embeddings[i] if i < len(embeddings) else []
                     metadata = metadatas[i] if i < len(metadatas) else {}
                     
-                    chunk_id = f"chromadb_{i}"
-                    in_memory_chunks[chunk_id] = {
-                        'content': doc,
-                        'chunk_text': doc,  # Add for compatibility
-                        'metadata': metadata,
-                        'source': metadata.get('source', 'Unknown'),
-                        'source_pdf': metadata.get('source_pdf', 'Unknown'),  # Add source_pdf
-                        'page_no': metadata.get('page_no', 1),  # Add page_no
-                        'page_number': metadata.get('page_no', 1),
-                        'chunk_id': metadata.get('id', chunk_id),  # Add original chunk ID
-                        'document_id': metadata.get('id', chunk_id)
-                    }
-                    in_memory_embeddings[chunk_id] = embedding
+                    _add_in_memory_chunk(doc, metadata, embedding)
                     
                     if i == 0:  # Debug first item
                         print(f"[DEBUG] First chunk loaded successfully")
@@ -165,8 +159,27 @@ def load_embeddings_from_chromadb():
         print(f"[MEMORY] Full traceback:")
         traceback.print_exc()
 
+def queue_existing_pdfs(include_finished=False):
+    """
+    Queue the upload folder's PDFs (user uploads excepted) for ingest_worker.
+    Files that already have a job are left alone; with include_finished, only those whose job is
+    still queued or running (a finished document queued again reuses its unchanged pages' vectors).
+    Returns (queued jobs, skipped filenames).
+    """
+    from .ingestion_queue import ACTIVE_STATUSES, enqueue_ingestion, is_user_upload, latest_jobs_by_filename
+
+    pdf_files = [
+        f for f in os.listdir(UPLOAD_DIR)
+        if f.lower().endswith('.pdf') and os.path.isfile(os.path.join(UPLOAD_DIR, f)) and not is_user_upload(f)
+    ]
+    latest = latest_jobs_by_filename(pdf_files)
+    skipped = [f for f, job in latest.items() if not include_finished or job.status in ACTIVE_STATUSES]
+    jobs = [enqueue_ingestion(f, os.path.join(UPLOAD_DIR, f)) for f in pdf_files if f not in skipped]
+    return jobs, skipped
+
+
 def process_all_existing_pdfs_once():
-    """Process all PDFs once and store in ChromaDB"""
+    """Queue every PDF in the upload folder for ingest_worker when ChromaDB is still empty"""
     try:
         from rag_app import get_chroma_collection
         
@@ -180,30 +193,12 @@ def process_all_existing_pdfs_once():
         except:
             pass
         
-        processed_count = 0
-        errors = []
-        
         if os.path.exists(UPLOAD_DIR):
-            pdf_files = [f for f in os.listdir(UPLOAD_DIR) if f.lower().endswith('.pdf')]
-            print(f"[CHROMADB] Processing {len(pdf_files)} PDF files once and storing in ChromaDB...")
-            
-            for filename in pdf_files:
-                try:
-                    file_path = os.path.join(UPLOAD_DIR, filename)
-                    print(f"[CHROMADB] Processing: {filename}")
-                    process_pdf(file_path, filename, None)
-                    processed_count += 1
-                except Exception as e:
-                    error_msg = f"Failed to process {filename}: {str(e)}"
-                    errors.append(error_msg)
-                    print(f"[CHROMADB] {error_msg}")
-            
-            print(f"[CHROMADB] Successfully processed {processed_count} PDFs and stored in ChromaDB")
-            if processed_count > 0:
-                # Load the newly processed embeddings into memory
-                load_embeddings_from_chromadb()
-            if errors:
-                print(f"[CHROMADB] {len(errors)} errors occurred")
+            # Ingestion never runs inside a request: ingest_worker picks these up, and
+            # sync_completed_ingestions() loads each document as its job finishes.
+            # Files with a job (queued, running or finished) are not queued again on every query
+            jobs, skipped = queue_existing_pdfs()
+            print(f"[CHROMADB] Queued {len(jobs)} PDF files for ingestion ({len(skipped)} already have a job)")
         else:
             print(f"[CHROMADB] Upload directory not found: {UPLOAD_DIR}")
             
@@ -216,7 +211,6 @@ def process_all_existing_pdfs_once():
 @csrf_exempt
 def upload_files(request):
     if request.method == 'POST':
-        import time
         files = request.FILES.getlist('files')
         conversation_id = request.POST.get('conversation_id') or None
         created_new_conversation = False
@@ -238,22 +232,38 @@ def upload_files(request):
         else:
             print(f"[DEBUG] Using existing conversation: {conversation_id}")
         
+        from rag_app import get_content_manifest, attach_content
+        from .ingestion_queue import enqueue_ingestion, job_status_payload, record_attached
+        from .models import ConversationDocument
+        from .uploads import UploadRejected, discard_staged, publish_upload, stage_upload, upload_limit
         processed_files = []
         already_processed = []
+        rejected_files = []
+        jobs = []
         
         for file in files:
             if file.name.lower().endswith('.pdf'):
-                # Mark as processing immediately
-                processing_status[file.name] = {
-                    'status': 'processing',
-                    'timestamp': time.time()
-                }
+                # Stream to a temp file while hashing and enforcing the size limit/quota,
+                # then rename into place so readers never see a partial file. A name that
+                # belongs to someone else's document is refused rather than replaced.
+                staged = None
+                try:
+                    max_bytes, reason = upload_limit(request.user, file.name)
+                    staged = stage_upload(file, max_bytes, reason)
+                    publish_upload(staged, file.name, UPLOAD_DIR, request.user, conversation_id)
+                except UploadRejected as e:
+                    print(f"[UPLOAD] Rejected {file.name}: {e}")
+                    if staged is not None:
+                        # Refused after staging: don't keep an unreferenced copy in the content store
+                        discard_staged(staged)
+                    rejected_files.append({'filename': file.name, 'error': str(e), 'status': e.status})
+                    continue
+                content_hash = staged.content_hash
                 
-                # Process all documents (no persistent storage check)
-                file_path = os.path.join(UPLOAD_DIR, file.name)
-                with open(file_path, 'wb+') as destination:
-                    for chunk in file.chunks():
-                        destination.write(chunk)
+                # Hash of the version this upload replaces, so unchanged pages can be reused
+                previous_content_hash = ConversationDocument.objects.filter(
+                    conversation_key=str(conversation_id), filename=file.name
+                ).values_list('content_hash', flat=True).first() or ''
                 
                 # Link file to conversation if provided (Moved BEFORE processing to ensure it's linked even if processing fails/crashes)
                 
@@ -261,10 +271,17 @@ def upload_files(request):
                 if request.user.is_authenticated:
                     try:
                         from .models import UserDocument
-                        UserDocument.objects.get_or_create(user=request.user, filename=file.name)
+                        UserDocument.objects.update_or_create(
+                            user=request.user, filename=file.name,
+                            defaults={'content_hash': content_hash, 'size': staged.size}
+                        )
                         print(f"[PRIVACY] Linked {file.name} to user {request.user.username}")
                     except Exception as e:
                         print(f"[PRIVACY] Error linking document: {e}")
+                ConversationDocument.objects.update_or_create(
+                    conversation_key=str(conversation_id), filename=file.name,
+                    defaults={'content_hash': content_hash}
+                )
                 if conversation_id:
                     if request.user.is_authenticated:
                         try:
@@ -285,31 +302,44 @@ def upload_files(request):
                         request.session.modified = True
                         request.session.save()
                 
-                # Process PDF (Doing this LAST so that Database Link is safe)
-                try:
-                    process_pdf(file_path, file.name, conversation_id)
-                except Exception as e:
-                    print(f"[ERROR] Failed to process PDF {file.name}: {e}")
-                    # We do NOT raise the error here, so the user still gets a "Success" response
-                    # and the file is in their library, even if AI processing failed.
+                # Identical bytes were already embedded (any user/conversation/filename): reuse the stored vectors.
+                # The finished job tells the other web processes to attach them too.
+                if get_content_manifest(content_hash):
+                    try:
+                        attach_content(content_hash, file.name, conversation_id)
+                        job = record_attached(file.name, staged.path, conversation_id, request.user, content_hash)
+                        _loaded_jobs.add(job.id)
+                        already_processed.append(file.name)
+                        continue
+                    except Exception as e:
+                        print(f"[DEDUP] Could not reuse stored vectors for {file.name}: {e}")
                 
+                # Queue PDF for the ingest_worker (Doing this LAST so that Database Link is safe).
+                # The job reads the immutable content-addressed copy, not the shared filename.
+                jobs.append(enqueue_ingestion(
+                    file.name, staged.path, conversation_id, request.user, content_hash, previous_content_hash
+                ))
                 processed_files.append(file.name)
         
         # Prepare response message
         message_parts = []
         if processed_files:
-            message_parts.append(f'Processed {len(processed_files)} new files successfully!')
+            message_parts.append(f'Queued {len(processed_files)} new files for processing!')
         if already_processed:
-            message_parts.append(f'{len(already_processed)} files were already processed and skipped.')
+            message_parts.append(f'{len(already_processed)} files were already processed and reused.')
+        if rejected_files:
+            message_parts.append(f'{len(rejected_files)} files were rejected.')
         
         return JsonResponse({
             'message': ' '.join(message_parts),
             'processed_files': processed_files,
             'already_processed': already_processed,
+            'rejected_files': rejected_files,
             'conversation_id': conversation_id,
             'created_new_conversation': created_new_conversation,
-            'processing_status': {name: processing_status.get(name, {}) for name in processed_files}
-        })
+            'job_ids': [job.id for job in jobs],
+            'processing_status': {job.filename: job_status_payload(job) for job in jobs}
+        }, status=rejected_files[0]['status'] if rejected_files and not (processed_files or already_processed) else 200)
     return JsonResponse({'error': 'Invalid request method'}, status=400)
     if request.method == 'POST':
         files = request.FILES.getlist('files')
@@ -381,8 +411,25 @@ def upload_files(request):
 
 @csrf_exempt
 def document_status_api(request):
-    """API endpoint to get current processing status of all documents"""
-    return JsonResponse({'status': processing_status})
+    """
+    API endpoint to get processing status from the shared job table.
+    Optional ?job_ids=1,2 restricts to specific jobs; otherwise returns active jobs
+    plus anything finished in the last hour.
+    """
+    from datetime import timedelta
+    from django.utils import timezone
+    from .ingestion_queue import latest_jobs_by_filename, job_status_payload
+
+    job_ids = request.GET.get('job_ids')
+    if job_ids:
+        try:
+            ids = [int(i) for i in job_ids.split(',') if i.strip()]
+        except ValueError:
+            return JsonResponse({'error': 'Invalid job_ids'}, status=400)
+        jobs = latest_jobs_by_filename(job_ids=ids)
+    else:
+        jobs = latest_jobs_by_filename(since=timezone.now() - timedelta(hours=1))
+    return JsonResponse({'status': {name: job_status_payload(job) for name, job in jobs.items()}})
 
 
 
@@ -406,31 +453,34 @@ def query(request):
             print(f"[DEBUG] User authenticated: {request.user.is_authenticated}")
             
             # Ensure PDFs are processed before querying
-            from rag_app import get_chroma_collection, in_memory_embeddings
+            from rag_app import get_chroma_collection, in_memory_embeddings, RETRIEVAL_BACKEND
             try:
                 collection = get_chroma_collection()
                 count = collection.count()
                 print(f"[CHROMADB] Found {count} documents in ChromaDB")
                 print(f"[MEMORY] Found {len(in_memory_embeddings)} embeddings in memory")
                 if count == 0:
-                    print("[CHROMADB] No documents found, processing PDFs once...")
+                    print("[CHROMADB] No documents found, queueing PDFs for ingestion...")
                     process_all_existing_pdfs_once()
-                elif len(in_memory_embeddings) == 0:
+                elif len(in_memory_embeddings) == 0 and RETRIEVAL_BACKEND != "store":
                     print("[MEMORY] No embeddings in memory, loading from ChromaDB...")
                     load_embeddings_from_chromadb()
                     # If still no embeddings, process PDFs
                     if len(in_memory_embeddings) == 0:
-                        print("[MEMORY] Still no embeddings, processing PDFs once...")
+                        print("[MEMORY] Still no embeddings, queueing PDFs for ingestion...")
                         process_all_existing_pdfs_once()
             except Exception as e:
-                print(f"[CHROMADB] Collection not found or error: {e}, processing PDFs once...")
+                print(f"[CHROMADB] Collection not found or error: {e}, queueing PDFs for ingestion...")
                 process_all_existing_pdfs_once()
             
+            sync_completed_ingestions()
+            
             # Generate answer via RAG with optional conversation scoping and PDF context
             pdf_context = data.get('pdf_context') if isinstance(data, dict) else request.POST.get('pdf_context')
             
             try:
-                result = get_answer(query_text, conversation_id, pdf_context)
+                owner = request.user.id if request.user.is_authenticated else None
+                result = get_answer(query_text, conversation_id, pdf_context, owner=owner)
                 # Backward compatible: if backend still returns string
                 if isinstance(result, str):
                     answer_payload = {
@@ -474,6 +524,17 @@ def query(request):
                     'confidence_score': 0.0
                 }
 
+            # Documents still being ingested were searched only up to their indexed pages
+            try:
+                from .ingestion_queue import partially_indexed
+                partial_jobs = partially_indexed(conversation_id) if conversation_id else []
+                answer_payload['partial_documents'] = {
+                    job.filename: {'indexed_pages': [[1, job.pages_done]], 'pages_total': job.pages_total}
+                    for job in partial_jobs
+                }
+            except Exception as e:
+                print(f"[SYNC] Could not check partially indexed documents: {e}")
+            
             # Persist conversation if user is authenticated, or create session-based conversation
             if request.user.is_authenticated:
                 conv: Conversation | None = None
@@ -590,28 +651,17 @@ def _now_iso():
 
 
 def restore_conversation_embeddings(conversation_id, documents):
-    """Restore embeddings for a conversation's documents"""
+    """Make a conversation's documents searchable again, from stored vectors where possible"""
     try:
-        from rag_app import in_memory_chunks, in_memory_embeddings, in_memory_metadata, process_pdf
-        import os
+        from rag_app import restore_conversation
+        from .models import ConversationDocument
         
         print(f"[DEBUG] Restoring embeddings for conversation {conversation_id} with documents: {documents}")
-        
-        # Clear existing embeddings first
-        in_memory_chunks.clear()
-        in_memory_embeddings.clear()
-        in_memory_metadata.clear()
-        
-        # Process each document for this conversation
-        for doc_name in documents:
-            file_path = os.path.join(UPLOAD_DIR, doc_name)
-            if os.path.exists(file_path):
-                print(f"[DEBUG] Processing document: {doc_name}")
-                process_pdf(file_path, doc_name, str(conversation_id))
-            else:
-                print(f"[WARNING] Document not found: {file_path}")
-        
-        print(f"[DEBUG] Restored {len(in_memory_chunks)} chunks for conversation {conversation_id}")
+        known_hashes = dict(
+            ConversationDocument.objects.filter(conversation_key=str(conversation_id)).values_list('filename', 'content_hash')
+        )
+        # Only documents with no stored vectors and no snapshot are re-processed
+        return restore_conversation(conversation_id, documents, known_hashes, UPLOAD_DIR)
         
     except Exception as e:
         print(f"[ERROR] Failed to restore embeddings: {e}")
@@ -656,6 +706,8 @@ def conversations_detail(request, conversation_id):
             conv = Conversation.objects.get(id=conversation_id, user=request.user)
             
             if request.method == 'GET':
+                if conv.documents:
+                    restore_conversation_embeddings(conv.id, conv.documents)
                 return JsonResponse({
                     'id': conv.id,
                     'title': conv.title or '',
@@ -718,6 +770,9 @@ def conversations_detail(request, conversation_id):
     if has_msgs:
         if request.method == 'GET':
              messages = request.session['conversation_messages'][str_id]
+             documents = request.session.get('conversation_documents', {}).get(str_id, [])
+             if documents:
+                 restore_conversation_embeddings(str_id, documents)
              return JsonResponse({
                     'id': str_id,
                     'title': 'Guest Chat',
@@ -796,12 +851,10 @@ def clear_embeddings(request):
     if request.method == 'POST':
         try:
             # Import the global variables from rag_app
-            from rag_app import in_memory_chunks, in_memory_embeddings, in_memory_metadata
+            from rag_app import clear_in_memory_store, in_memory_chunks, in_memory_embeddings
             
             # Clear all in-memory data
-            in_memory_chunks.clear()
-            in_memory_embeddings.clear()
-            in_memory_metadata.clear()
+            clear_in_memory_store()
             
             print(f"[DEBUG] Cleared all embeddings: {len(in_memory_chunks)} chunks, {len(in_memory_embeddings)} embeddings")
             
@@ -817,8 +870,8 @@ def clear_embeddings(request):
 def get_pdf_library(request):
     """Get all PDF files from the uploaded_pdfs folder with metadata"""
     try:
-        from rag_app import get_chroma_collection
-        import PyPDF2
+        from rag_app import get_chroma_collection, get_pdf_page_count
+        from .ingestion_queue import active_filenames
         
         pdf_files = []
         existing_filenames = set()
@@ -842,6 +895,7 @@ def get_pdf_library(request):
         
         if os.path.exists(UPLOAD_DIR):
             all_files = os.listdir(UPLOAD_DIR)
+            queued_or_running = active_filenames()
 
             # PRIVACY FILTER: Get list of user's owned files
             user_documents = set()
@@ -876,29 +930,22 @@ def get_pdf_library(request):
                     
                     # Check processing status
                     chunk_count = processed_docs.get(filename, 0)
-                    status_info = processing_status.get(filename, {})
                     
                     # Determine status:
                     # 1. If chunks exist in ChromaDB -> 'ready' (already processed)
-                    # 2. If currently being uploaded (in processing_status) -> 'processing'
+                    # 2. If an ingestion job is queued or running -> 'processing'
                     # 3. Otherwise -> 'ready' (old file, not being processed right now)
                     if chunk_count > 0:
                         status = 'ready'
-                    elif filename in processing_status and status_info.get('status') == 'processing':
-                        # Only show processing if actively being uploaded right now
+                    elif filename in queued_or_running:
+                        # Only show processing if a worker still has it queued/running
                         status = 'processing'
                     else:
                         # Old files that haven't been processed yet - show as ready
                         status = 'ready'
                     
-                    # Get page count
-                    page_count = None
-                    try:
-                        with open(filepath, 'rb') as f:
-                            pdf_reader = PyPDF2.PdfReader(f)
-                            page_count = len(pdf_reader.pages)
-                    except Exception as e:
-                        pass  # Silently skip page count errors
+                    # Page count recorded at ingestion (no reparse on every library request)
+                    page_count = get_pdf_page_count(filepath)
                     
                     # Add ALL documents to the list (both processing and ready)
                     pdf_files.append({
@@ -940,6 +987,9 @@ def get_pdf_library(request):
                 
                 if ids_to_delete:
                     collection.delete(ids=ids_to_delete)
+                    from rag_app import get_lexical_index
+                    if get_lexical_index() is not None:
+                        get_lexical_index().delete(ids=ids_to_delete)
                     print(f"[PDF_LIBRARY] Removed {deleted_count} embeddings for deleted PDFs")
         except Exception as e:
             print(f"[PDF_LIBRARY] Error cleaning up ChromaDB: {e}")
@@ -957,32 +1007,21 @@ def get_pdf_library(request):
 @csrf_exempt
 # @login_required
 def process_existing_pdfs(request):
-    """Process all existing PDFs in the upload_pdfs folder"""
+    """Queue the PDFs in the upload_pdfs folder for ingest_worker"""
     if request.method == 'POST':
         try:
-            processed_count = 0
-            errors = []
-            
+            jobs, skipped = [], []
             if os.path.exists(UPLOAD_DIR):
-                for filename in os.listdir(UPLOAD_DIR):
-                    if filename.lower().endswith('.pdf'):
-                        file_path = os.path.join(UPLOAD_DIR, filename)
-                        if os.path.isfile(file_path):
-                            try:
-                                # Process the PDF using existing logic
-                                process_pdf(file_path, filename, None)
-                                processed_count += 1
-                                print(f"[SUCCESS] Processed: {filename}")
-                            except Exception as e:
-                                error_msg = f"Failed to process {filename}: {str(e)}"
-                                errors.append(error_msg)
-                                print(f"[ERROR] {error_msg}")
+                # Like uploads, the ingestion itself runs in ingest_worker, not in this request;
+                # poll GET /document-status/?job_ids=... for progress
+                jobs, skipped = queue_existing_pdfs(include_finished=True)
+                print(f"[PROCESS] Queued {len(jobs)} PDFs for ingestion ({len(skipped)} already queued or running)")
             
             return JsonResponse({
-                'message': f'Processed {processed_count} PDFs successfully',
-                'processed_count': processed_count,
-                'errors': errors,
-                'total_errors': len(errors)
+                'message': f'Queued {len(jobs)} PDFs for ingestion',
+                'queued_count': len(jobs),
+                'skipped_count': len(skipped),
+                'job_ids': [job.id for job in jobs],
             })
             
         except Exception as e:
@@ -1031,14 +1070,17 @@ def search_pdfs(request):
                     collection = get_chroma_collection()
                     count = collection.count()
                     if count == 0:
-                        print("[CHROMADB] No documents found during search, processing PDFs once...")
+                        print("[CHROMADB] No documents found during search, queueing PDFs for ingestion...")
                         process_all_existing_pdfs_once()
                 except:
-                    print("[CHROMADB] Collection not found during search, processing PDFs once...")
+                    print("[CHROMADB] Collection not found during search, queueing PDFs for ingestion...")
                     process_all_existing_pdfs_once()
+                sync_completed_ingestions()
                 
-                # Use the existing get_answer function to find relevant content
-                result = get_answer(query, None)
+                # Use the existing get_answer function to find relevant content, within what
+                # this user may see (global documents plus their own uploads)
+                owner = request.user.id if request.user.is_authenticated else None
+                result = get_answer(query, None, owner=owner)
                 
                 # Extract source PDFs from citations
                 relevant_pdfs = set()
@@ -1116,7 +1158,7 @@ def pdf_viewer(request, pdf_name):
 def system_status(request):
     """Check system status - PDFs and ChromaDB"""
     try:
-        from rag_app import get_chroma_collection
+        from rag_app import current_index_registry, get_chroma_collection
         
         # Count PDFs
         pdf_count = 0
@@ -1133,6 +1175,9 @@ def system_status(request):
         except:
             embeddings_loaded = False
         
+        # Active index generation, and progress of a `manage.py rebuild_index` run if one is going
+        registry = current_index_registry()
+        
         return JsonResponse({
             'pdf_count': pdf_count,
             'embeddings_count': embeddings_count,
@@ -1140,6 +1185,8 @@ def system_status(request):
             'embeddings_loaded': embeddings_loaded,
             'system_ready': embeddings_loaded and pdf_count > 0,
             'storage_type': 'ChromaDB',
+            'index_generation': registry.get('active'),
+            'index_rebuild': registry.get('building'),
             'server_instance_id': SERVER_INSTANCE_ID
         })
         
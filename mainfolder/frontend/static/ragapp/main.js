@@ -1469,10 +1469,7 @@ class DocumentAssistant {
         if (!response.ok) throw new Error('Failed to process PDFs');
         const data = await response.json();
         
-        console.log(`[SUCCESS] Processed ${data.processed_count} PDFs`);
-        if (data.errors && data.errors.length > 0) {
-          console.warn('[WARNINGS]', data.errors);
-        }
+        console.log(`[SUCCESS] Queued ${data.queued_count} PDFs for ingestion`);
         
         // Reload the PDF library after processing
         await this.loadPDFLibrary();